@@ -0,0 +1,40 @@
+# Times the LLL traversals (from_list, to_list, repr, gas_estimate and
+# compile_to_assembly) on a deeply nested expression and on a long, shallow
+# sequence of stores like the ones make_setter produces:
+#
+#   python benchmarks/lll_traversal.py [depth] [width]
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from viper.parser import LLLnode
+from viper import compile_lll
+
+def deep_tree(depth):
+    o = ['calldataload', 4]
+    for i in range(depth):
+        o = ['with', '_x', o, ['add', '_x', ['mload', 32 * (i % 8)]]] if i % 3 == 0 else ['add', o, i]
+    return ['mstore', 0, o]
+
+def wide_tree(width):
+    return ['seq'] + [['sstore', ['add', 2, i], ['clamp', ['mload', 96], ['calldataload', 4 + 32 * i], ['mload', 64]]]
+                      for i in range(width)]
+
+def timed(name, f, *args):
+    t = time.time()
+    o = f(*args)
+    print('  %-20s %.4fs' % (name, time.time() - t))
+    return o
+
+def run(name, tree):
+    print(name)
+    node = timed('from_list', LLLnode.from_list, tree)
+    timed('to_list', node.to_list)
+    timed('repr', node.repr)
+    timed('gas_estimate', compile_lll.gas_estimate, node)
+    asm = timed('compile_to_assembly', compile_lll.compile_to_assembly, node)
+    timed('assembly_to_evm', compile_lll.assembly_to_evm, asm)
+
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 900
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    run('deep tree (depth %d)' % depth, deep_tree(depth))
+    run('wide tree (width %d)' % width, wide_tree(width))
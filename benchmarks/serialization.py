@@ -0,0 +1,28 @@
+# Compares the compact binary form of LLL and assembly (viper.serialize) with
+# pickle, by size and by time to dump and load, on a contract's LLL:
+#
+#   python benchmarks/serialization.py [source.vy] [rounds]
+import os, pickle, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from viper import compile_lll, parser, serialize
+
+def timed(f, arg, rounds):
+    t = time.time()
+    for i in range(rounds):
+        o = f(arg)
+    return o, (time.time() - t) / rounds
+
+def run(name, obj, dumps, loads, rounds):
+    print(name)
+    for label, dump, load in (('binary', dumps, loads), ('pickle', lambda x: pickle.dumps(x, 4), pickle.loads)):
+        blob, dump_time = timed(dump, obj, rounds)
+        o, load_time = timed(load, blob, rounds)
+        print('  %-8s %8d bytes  dump %.5fs  load %.5fs' % (label, len(blob), dump_time, load_time))
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'crowdfund.vy')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    lll = parser.parse_tree_to_lll(parser.parse(open(filename).read()), cache=None)
+    run('LLL', lll, serialize.dumps_lll, serialize.loads_lll, rounds)
+    run('LLL (shared subtrees)', parser.LLLInterner().intern(lll), serialize.dumps_lll, serialize.loads_lll, rounds)
+    run('assembly', compile_lll.compile_to_assembly(lll), serialize.dumps_assembly, serialize.loads_assembly, rounds)
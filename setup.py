@@ -19,6 +19,9 @@ setup(
     url='https://github.com/ethereum/viper',
     license=license,
     packages=find_packages(exclude=('tests', 'docs')),
+    entry_points={
+        'console_scripts': ['viper = viper.cli:main'],
+    },
     install_requires=[
         'ethereum == 1.3.7',
         'serpent',
@@ -0,0 +1,188 @@
+from viper import parser, compile_lll, compiler_plugin
+import time
+
+c = compiler_plugin.Compiler()
+
+def mk_contract(n, edited=None):
+    o = "x: num\n"
+    for i in range(n):
+        o += "def f%d(a: num) -> num:\n    return a * %d + self.x\n" % (i, i if i != edited else i + 1000)
+    return o
+
+def lower(code, cache):
+    return parser.parse_tree_to_lll(parser.parse(code), cache=cache)
+
+# Cached lowering gives the same LLL and bytecode as lowering from scratch
+cache = parser.FunctionCache()
+code = mk_contract(20)
+assert repr(lower(code, cache)) == repr(lower(code, None))
+assert cache.misses == 20 and cache.hits == 0
+assert repr(lower(code, cache)) == repr(lower(code, None))
+assert cache.hits == 20
+
+# Editing one function only re-lowers that function
+edited = mk_contract(20, edited=7)
+assert repr(lower(edited, cache)) == repr(lower(edited, None))
+assert cache.misses == 21 and cache.hits == 39
+assert compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lower(edited, cache))) == \
+    compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lower(edited, None)))
+
+# Changing the globals layout invalidates every function
+assert repr(lower("y: num\n" + code, cache)) == repr(lower("y: num\n" + code, None))
+assert cache.misses == 41
+
+# The memory layout of a function is restored on a hit too
+varz1, varz2 = {}, {}
+_def = parser.parse("def foo():\n    x = 5\n    y = 6\n")[0]
+cache.parse_func(_def, {}, varz1)
+cache.parse_func(_def, {}, varz2)
+assert varz1 == varz2 and varz1['_next_mem'] == parser.RESERVED_MEMORY + 64
+
+# Eviction beyond maxsize
+small = parser.FunctionCache(maxsize=5)
+lower(code, small)
+assert len(small.entries) == 5
+
+big = mk_contract(200)
+lower(big, cache)
+t0 = time.time()
+lower(mk_contract(200, edited=100), cache)
+print('Recompiled 200-function contract after an edit in %.3fs' % (time.time() - t0))
+print('Passed function cache tests')
+
+import os, shutil, tempfile
+from viper import cache as viper_cache
+
+cache_dir = tempfile.mkdtemp()
+try:
+    cc = compiler_plugin.Compiler(cache_dir=cache_dir)
+    crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+    # Cached artifacts match a normal compile
+    assert cc.compile(crowdfund) == c.compile(crowdfund)
+    assert cc.mk_full_signature(crowdfund) == c.mk_full_signature(crowdfund)
+    assert cc.gas_estimate(crowdfund) == c.gas_estimate(crowdfund)
+    entries, total = cc.cache.scan()
+    assert len(entries) == 1
+    # Unset options share an entry; the source and other options do not
+    assert viper_cache.mk_cache_key(crowdfund, {'libraries': None}) == viper_cache.mk_cache_key(crowdfund)
+    assert viper_cache.mk_cache_key(crowdfund, {'libraries': {'a': 1}}) != viper_cache.mk_cache_key(crowdfund)
+    assert viper_cache.mk_cache_key(crowdfund + '\n') != viper_cache.mk_cache_key(crowdfund)
+    # A second compiler instance (eg. another process) hits the same entry
+    cc2 = compiler_plugin.Compiler(cache_dir=cache_dir)
+    assert cc2.cache.get(viper_cache.mk_cache_key(crowdfund))['bytecode'] == c.compile(crowdfund)
+    # Least recently used entries are evicted beyond the size bound
+    small = viper_cache.DiskCache(os.path.join(cache_dir, 'small'), max_size=total * 3)
+    for i in range(10):
+        small.put('%064x' % i, cc.get_artifacts(crowdfund))
+    small.get('%064x' % 0)
+    entries, size = small.scan()
+    assert size <= total * 3 and len(entries) < 10
+    # Corrupted entries are dropped rather than served
+    with open(small.filename('%064x' % 9), 'wb') as f:
+        f.write(b'{garbage')
+    assert small.get('%064x' % 9) is None
+finally:
+    shutil.rmtree(cache_dir)
+
+print('Passed disk cache tests')
+
+import threading
+from viper import cache_server
+
+server_dir, local_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+server = cache_server.CacheServer(('127.0.0.1', 0), server_dir)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+try:
+    # One worker populates the shared cache, another one hits it
+    c1 = compiler_plugin.Compiler(cache_url=server.url)
+    assert c1.compile(crowdfund) == c.compile(crowdfund)
+    key = viper_cache.mk_cache_key(crowdfund)
+    assert server.RequestHandlerClass.cache.get(key)['abi'] == c.mk_full_signature(crowdfund)
+    c2 = compiler_plugin.Compiler(cache_url=server.url, cache_dir=local_dir)
+    assert c2.cache.get(key)['bytecode'] == c.compile(crowdfund)
+    # ...and copies the entry into its local cache
+    assert c2.cache.caches[0].get(key)['bytecode'] == c.compile(crowdfund)
+    # Entries corrupted in transit fail verification
+    blob = viper_cache.seal_blob(b'{}')
+    assert viper_cache.unseal_blob(blob) == b'{}'
+    try:
+        viper_cache.unseal_blob(blob[:-1] + b'!')
+        assert False
+    except ValueError:
+        pass
+    # Uploads that do not match their digest are refused
+    import urllib.request, urllib.error
+    try:
+        urllib.request.urlopen(urllib.request.Request(server.url + '/' + key, method='PUT', data=blob[:-1] + b'!'))
+        assert False
+    except urllib.error.HTTPError as e:
+        assert e.code == 400
+    # Misses are not errors
+    remote = viper_cache.HTTPCache(server.url)
+    assert remote.get('0' * 64) is None and remote.errors == 0
+finally:
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(server_dir)
+    shutil.rmtree(local_dir)
+
+# An unreachable server falls back to a normal compile
+c3 = compiler_plugin.Compiler(cache_url=server.url)
+assert c3.compile(crowdfund) == c.compile(crowdfund)
+assert c3.cache.errors == 2
+
+print('Passed remote cache tests')
+
+# All artifacts come out of a single pass and agree with the separate entry points
+a = compiler_plugin.mk_artifacts(crowdfund)
+assert a['bytecode'] == c.compile(crowdfund)
+assert a['abi'] == c.mk_full_signature(crowdfund)
+assert a['gas_estimates'] == c.gas_estimate(crowdfund)
+assert compile_lll.assembly_to_evm(a['assembly']) == a['bytecode']
+assert a['runtime_bytecode'] and a['runtime_bytecode'] in a['bytecode']
+assert compiler_plugin.mk_artifacts('x: num\n')['runtime_bytecode'] == b''
+
+print('Passed single-pass artifact tests')
+
+# Function details are worked out once per compilation, in one signature
+# table that lowering, the ABI and gas estimates all read; method IDs are
+# memoized across compilations and are those keccak gives
+sample = """
+def foo(a: address, b: num, c: bool) -> num:
+    return b
+
+def bar(x: num256, y: bytes32):
+    pass
+
+def baz(d: bytes <= 100) -> bytes <= 100:
+    return d
+"""
+calls = {'details': 0, 'tables': 0}
+get_func_details, mk_signature_table = parser.get_func_details, parser.mk_signature_table
+def counted_details(code):
+    calls['details'] += 1
+    return get_func_details(code)
+def counted_table(_defs):
+    calls['tables'] += 1
+    return mk_signature_table(_defs)
+function_cache = parser.function_cache
+parser.get_func_details, parser.mk_signature_table = counted_details, counted_table
+# Lowered from scratch, not from the cache
+parser.function_cache = parser.FunctionCache()
+try:
+    a = compiler_plugin.mk_artifacts(sample)
+    assert calls == {'details': 3, 'tables': 1}, calls
+    assert [f['name'] for f in a['abi']] == ['foo(address,int128,bool)', 'bar(int256,bytes32)', 'baz(bytes)']
+    assert sorted(a['gas_estimates']) == ['bar', 'baz', 'foo']
+    hits = parser.get_method_id.cache_info().hits
+    compiler_plugin.mk_artifacts(sample)
+    assert calls == {'details': 6, 'tables': 2}, calls
+    assert parser.get_method_id.cache_info().hits >= hits + 3
+finally:
+    parser.get_func_details, parser.mk_signature_table = get_func_details, mk_signature_table
+    parser.function_cache = function_cache
+_defs, _globals = parser.get_defs_and_globals(parser.parse(sample))
+assert [details[4:] for details in parser.mk_signature_table(_defs).values()] == \
+    [('foo(address,int128,bool)', 1217346781), ('bar(int256,bytes32)', 578567297), ('baz(bytes)', 756995038)]
+
+print('Passed signature table tests')
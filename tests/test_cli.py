@@ -0,0 +1,77 @@
+from viper import cli, compiler_plugin
+import contextlib, io, json, os, shutil, tempfile
+
+examples = os.path.join(os.path.dirname(__file__), '..', 'examples')
+crowdfund = open(os.path.join(examples, 'crowdfund.vy')).read()
+expected = compiler_plugin.mk_artifacts(crowdfund)
+
+with tempfile.TemporaryDirectory() as d:
+    src, out = os.path.join(d, 'src'), os.path.join(d, 'out')
+    os.makedirs(os.path.join(src, 'sub'))
+    shutil.copy(os.path.join(examples, 'crowdfund.vy'), os.path.join(src, 'crowdfund.vy'))
+    with open(os.path.join(src, 'sub', 'add.vy'), 'w') as f:
+        f.write("def add(a: num, b: num) -> num:\n    return a + b\n")
+    with open(os.path.join(src, 'notes.txt'), 'w') as f:
+        f.write("not a contract")
+    # Directories are searched for sources
+    assert cli.find_sources([src]) == [os.path.join(src, 'crowdfund.vy'), os.path.join(src, 'sub', 'add.vy')]
+
+    # Serial and batch builds write the same outputs, with timing on stderr
+    for jobs in (None, 2):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            assert cli.main(['-f', 'bytecode,bytecode_runtime,abi,gas', '-o', out, src] + (['--jobs', str(jobs)] if jobs else [])) == 0
+        assert 'crowdfund.vy: ' in err.getvalue() and 'add.vy: ' in err.getvalue()
+        o = json.load(open(os.path.join(out, 'crowdfund.json')))
+        assert o['bytecode'] == '0x' + expected['bytecode'].hex()
+        assert o['bytecode_runtime'] == '0x' + expected['runtime_bytecode'].hex()
+        assert o['abi'] == expected['abi'] and o['gas'] == expected['gas_estimates']
+        assert sorted(os.listdir(out)) == ['crowdfund.json', 'sub'] and os.listdir(os.path.join(out, 'sub')) == ['add.json']
+
+    # Without an output directory, outputs are printed keyed by filename
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+        assert cli.main(['-f', 'asm', os.path.join(src, 'sub', 'add.vy')]) == 0
+    assert list(json.loads(stdout.getvalue()).values())[0]['asm'] == compiler_plugin.mk_artifacts("def add(a: num, b: num) -> num:\n    return a + b\n")['assembly']
+
+    # LLL files are compiled as written
+    kernel = "(return 0 (lll (seq (mstore 0 (calldataload 4)) (return 0 32)) 0))"
+    with open(os.path.join(src, 'sub', 'kernel.lll'), 'w') as f:
+        f.write(kernel)
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+        assert cli.main(['-f', 'bytecode,abi', os.path.join(src, 'sub', 'kernel.lll')]) == 0
+    assert list(json.loads(stdout.getvalue()).values())[0] == \
+        {'bytecode': '0x' + compiler_plugin.mk_lll_artifacts(kernel)['bytecode'].hex(), 'abi': []}
+
+    # Sources with the same name in different directories keep their
+    # relative paths; two sources that would still write the same output are
+    # an error, before anything is compiled
+    other = os.path.join(d, 'other')
+    for directory in (os.path.join(other, 'a'), os.path.join(other, 'b')):
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'add.vy'), 'w') as f:
+            f.write("def add(a: num, b: num) -> num:\n    return a + b\n")
+    with contextlib.redirect_stderr(io.StringIO()):
+        assert cli.main(['-o', os.path.join(d, 'out2'), other]) == 0
+    assert sorted(os.listdir(os.path.join(d, 'out2'))) == ['a', 'b']
+    assert os.listdir(os.path.join(d, 'out2', 'a')) == os.listdir(os.path.join(d, 'out2', 'b')) == ['add.json']
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(err):
+            cli.main(['-o', os.path.join(d, 'out3'), os.path.join(other, 'a'), os.path.join(other, 'b')])
+        raise AssertionError("Expected an exception")
+    except SystemExit as e:
+        assert e.code == 2
+    assert 'add.json would be written by more than one source' in err.getvalue()
+    assert not os.path.exists(os.path.join(d, 'out3'))
+
+    # Failures are reported and give a nonzero exit status
+    with open(os.path.join(src, 'bad.vy'), 'w') as f:
+        f.write("def foo() -> num:\n    return msg.sender\n")
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        assert cli.main(['-o', out, src]) == 1
+    assert 'bad.vy: TypeMismatchException' in err.getvalue()
+
+print('Passed command-line compiler tests')
@@ -0,0 +1,43 @@
+import os, subprocess, sys
+
+# Importing the compiler plugin must stay cheap: no compilation work, and no
+# keccak backend, optimizer, cache or LLL reader loading at import time. The
+# import may take at most IMPORT_BUDGET times as long as starting a bare
+# interpreter on the same machine
+IMPORT_BUDGET = 2
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Bytecode is written on the warm-up import even where it is turned off, so
+# that the timed imports load the modules compiled
+env = dict(os.environ)
+env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+def run(code):
+    return subprocess.check_output([sys.executable, '-c', code], cwd=root, env=env)
+
+def time_import(module):
+    return float(run('import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)' % module))
+
+def time_startup():
+    return float(run('import subprocess, sys, time; t = time.perf_counter(); '
+                     'subprocess.check_call([sys.executable, "-c", "pass"]); print(time.perf_counter() - t)'))
+
+time_import('viper.compiler_plugin')
+t = min(time_import('viper.compiler_plugin') for i in range(5))
+startup = min(time_startup() for i in range(5))
+print('Imported viper.compiler_plugin in %.4fs, interpreter starts in %.4fs' % (t, startup))
+assert t < IMPORT_BUDGET * startup, "Import took %.4fs, budget is %.4fs" % (t, IMPORT_BUDGET * startup)
+
+out = run('import sys, viper.compiler_plugin; print(sorted(m for m in ("Crypto", "sha3", "tempfile", "concurrent.futures", '
+          '"viper.optimizer", "viper.cache", "viper.lll_reader", "json", "hashlib") if m in sys.modules))')
+assert out.strip() == b'[]', out
+
+# No compile function runs while importing
+out = run('import sys; calls = set(); '
+          'sys.setprofile(lambda frame, event, arg: event == "call" and calls.add(frame.f_code.co_name)); '
+          'import viper.compiler_plugin; sys.setprofile(None); '
+          'print(sorted(calls & {"gas_estimate", "compile_to_assembly", "parse_func", "mk_initial", "sha3_256"}))')
+assert out.strip() == b'[]', out
+
+print('Passed import time test')
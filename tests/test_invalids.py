@@ -1,5 +1,6 @@
 from viper import parser, compile_lll, compiler_plugin
-from viper.parser import InvalidTypeException, TypeMismatchException, VariableDeclarationException, StructureException, ConstancyViolationException
+from viper.parser import InvalidTypeException, TypeMismatchException, VariableDeclarationException, StructureException, ConstancyViolationException, \
+    ConstantClampException
 c = compiler_plugin.Compiler() 
 
 def must_fail(code, exception_type):
@@ -963,3 +964,14 @@ must_fail("""
 def foo(x: num) -> bytes <= 75:
     return x
 """, TypeMismatchException)
+
+must_fail("""
+def foo(x: bool) -> num:
+    return x + 1
+""", TypeMismatchException)
+
+must_fail("""
+y: num[3]
+def foo() -> num:
+    return self.y[3]
+""", ConstantClampException)
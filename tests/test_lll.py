@@ -0,0 +1,126 @@
+from viper.parser import LLLnode, LLLInterner
+from viper.opcodes import opcode_names, opcode_records, num_real_opcodes, get_opcode_id
+from viper import compile_lll, compiler_plugin, parser
+
+# Opcode IDs are resolved once, whatever the case of the name
+for name in ('add', 'ADD', 'Add'):
+    node = LLLnode.from_list([name, 1, 2])
+    assert opcode_names[node.opcode] == 'ADD' and node.opcode < num_real_opcodes
+assert opcode_records[get_opcode_id('clamp')] == [None, 3, 1, 45]
+assert get_opcode_id('clamp') >= num_real_opcodes
+assert LLLnode.from_list('x').opcode is None and LLLnode.from_list(5).opcode is None
+assert compile_lll.compile_to_assembly(LLLnode.from_list(['Mstore', 0, ['add', 1, 2]])) == \
+    ['PUSH1', 2, 'PUSH1', 1, 'ADD', 'PUSH1', 0, 'MSTORE']
+
+# Nodes are slotted
+assert not hasattr(LLLnode.from_list(['add', 1, 2]), '__dict__')
+
+# Validation catches malformed nodes, and can be skipped by trusted passes
+for bad in (['add', 1], ['add', 1, ['pass']], ['if', ['pass'], ['pass']], ['with', ['add', 1, 2], 1, 2]):
+    try:
+        LLLnode.from_list(bad)
+        raise AssertionError("Expected an exception: %r" % bad)
+    except Exception as e:
+        assert not isinstance(e, AssertionError)
+for code in (['seq', ['mstore', 0, 1], ['mload', 0]], ['if', 1, ['pass']], ['if', 1, 2, 3],
+             ['with', 'x', 1, ['add', 'x', 'x']], ['repeat', 224, 0, 5, ['pass']]):
+    a, b = LLLnode.from_list(code), LLLnode.from_list(code, validate=False)
+    assert a.valency == b.valency and a.opcode == b.opcode, code
+    assert compile_lll.compile_to_assembly(a) == compile_lll.compile_to_assembly(b)
+assert LLLnode.from_list(['multi', 1, 2], validate=False).valency == 2
+
+# Traversals do not recurse, so trees far deeper than the recursion limit work
+deep = ['calldataload', 4]
+for i in range(5000):
+    deep = ['add', deep, i % 7]
+node = LLLnode.from_list(['mstore', 0, deep])
+assert node.to_list()[2][1][1][2] == [4997 % 7]
+asm = compile_lll.compile_to_assembly(node)
+assert compile_lll.compile_to_assembly(LLLnode.from_list(node.to_list())) == asm
+assert asm.count('ADD') == 5000 and asm[-3:] == ['PUSH1', 0, 'MSTORE']
+assert compile_lll.gas_estimate(node) == 5000 * 6 + 6 + 6
+assert compile_lll.assembly_to_evm(asm)
+lines = node.repr().split('\n')
+assert lines[0] == "['mstore',", lines[1] == "  [0]"
+assert lines[-1] == ']' and max(len(line) for line in lines) < 80 + 2 * 5000
+
+# The pretty-printed form splits long subtrees, one argument per line
+node = LLLnode.from_list(['seq', ['mstore', 0, ['add', ['mload', 32], 1]], ['sstore', ['sha3_32', 123456789012345678901234567890], 5]])
+assert node.repr() == """['seq',
+  ['mstore', [0], ['add', ['mload', [32]], [1]]]
+  ['sstore', ['sha3_32', [123456789012345678901234567890]], [5]]
+]"""
+
+# Interning shares identical subtrees
+interner = LLLInterner()
+a = interner.node('mload', [interner.node(96)])
+assert interner.node('mload', [interner.node(96)]) is a and interner.hits == 2
+assert interner.node('mload', [interner.node(64)]) is not a
+assert interner.node(1) is not interner.node(True)
+e = ['add', 'v0', ['sha3_32', 'v0']]
+code = ['with', 'v0', 1, ['seq', ['mstore', 0, e],
+                                 ['with', 'v1', 2, ['seq', ['mstore', e, e], ['if', 'v1', ['sstore', e, 3]]]],
+                                 ['repeat', 320, 0, 3, ['seq', ['mstore', e, ['mload', 320]], ['if', e, ['break']]]]]]
+tree = LLLnode.from_list(code)
+dag = LLLInterner().intern(tree)
+assert dag.args[2].args[0].args[1] is dag.args[2].args[1].args[2].args[0].args[0]
+assert repr(dag) == repr(tree)
+# The DAG compiles to the same assembly and gas as the tree, even though the
+# shared subtree sits at different stack heights
+assert compile_lll.compile_dag_to_assembly(dag) == compile_lll.compile_to_assembly(tree)
+assert compile_lll.gas_estimate_dag(dag) == compile_lll.gas_estimate(tree)
+info = compile_lll.dag_info(dag)
+assert info[id(dag.args[2].args[0].args[1])][:3] == [6, ('v0',), False]
+assert info[id(dag)][1] == () and info[id(dag)][2]
+
+# A statement repeated as the value of its seq is still popped where its
+# value is dropped
+tree = LLLnode.from_list(['seq', ['mload', 0], ['mstore', 0, 1], ['mload', 0]])
+dag = LLLInterner().intern(tree)
+assert dag.args[0] is dag.args[2]
+assert compile_lll.compile_dag_to_assembly(dag) == compile_lll.compile_to_assembly(tree)
+assert compile_lll.compile_to_assembly(tree)[:4] == ['PUSH1', 0, 'MLOAD', 'POP']
+
+# Array and struct setters share most of their nodes
+setter = "x: num[3][40]\ny: num[3][40]\ndef f():\n    self.x = self.y\n"
+interner = LLLInterner()
+lll = parser.parse_tree_to_lll(parser.parse(setter), cache=None)
+dag = parser.parse_tree_to_lll(parser.parse(setter), cache=None, interner=interner)
+assert interner.hits > 4 * len(interner.nodes)
+assert compile_lll.compile_dag_to_assembly(dag) == compile_lll.compile_to_assembly(lll)
+assert compiler_plugin.mk_artifacts(setter, share=True) == compiler_plugin.mk_artifacts(setter)
+
+# Besides the clamps on the arguments, only products involving a decimal that
+# could overflow a word are checked
+def count_checks(expr):
+    lll = parser.parse_tree_to_lll(parser.parse("def f(a: num, b: num, c: num) -> num:\n    return %s\n" % expr), cache=None)
+    stack, o = [lll], [0, 0]
+    while stack:
+        node = stack.pop()
+        if node.value in ('clamp', 'assert'):
+            o[node.value == 'assert'] += 1
+        stack.extend(node.args)
+    return o
+
+assert count_checks("a + b + c - a") == [4, 0]
+assert count_checks("a / b % c") == [3, 0]
+assert count_checks("a * b * c") == [3, 0]
+assert count_checks("(a + b) * 3 - c") == [3, 0]
+assert count_checks("floor(a * 1.5 * 2.0)") == [1, 0]
+assert count_checks("floor(a * 1.5 * decimal(b))") == [2, 1]
+
+# Instructions after a terminator are dropped up to the next label, along
+# with labels nothing refers to, in nested assemblies too
+asm = compile_lll.compile_to_assembly(LLLnode.from_list(
+    ['return', 0, ['lll', ['seq', ['if', ['calldataload', 0], ['return', 0, 0], ['stop']], ['mstore', 0, 1], ['return', 0, 32]], 0]]))
+counters = {}
+pruned = compile_lll.eliminate_unreachable(asm, counters)
+assert [item for item in pruned if isinstance(item, list)] == [['PUSH1', 0, 'CALLDATALOAD', 'ISZERO', '_sym_3', 'JUMPI',
+                                                               'PUSH1', 0, 'PUSH1', 0, 'RETURN', '_sym_3', 'JUMPDEST', 'STOP']]
+assert [item for item in pruned if not isinstance(item, list)] == [item for item in asm if not isinstance(item, list)]
+assert counters == {'instructions_dropped': 8, 'labels_dropped': 1}
+assert compile_lll.eliminate_unreachable(pruned) == pruned
+assert compile_lll.eliminate_unreachable(['PUSH1', 0, '_sym_1', 'JUMP', 'PUSH2', 86, 0, 'STOP', '_sym_1', 'JUMPDEST', 'STOP']) == \
+    ['PUSH1', 0, '_sym_1', 'JUMP', '_sym_1', 'JUMPDEST', 'STOP']
+
+print('Passed LLL node tests')
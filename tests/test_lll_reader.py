@@ -0,0 +1,55 @@
+from viper.parser import LLLnode
+from viper.lll_reader import parse_lll, to_sexpr, LLLSyntaxException
+from viper import compile_lll, compiler_plugin, optimizer, parser
+import os
+
+crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+
+# S-expressions and the bracketed form LLLnode.repr prints read the same
+code = parse_lll("""
+; stores the first argument
+(seq (mstore 0 (calldataload 4))
+     (return 0 32))
+""")
+assert code.to_list() == ['seq', ['mstore', [0], ['calldataload', [4]]], ['return', [0], [32]]]
+assert parse_lll("['seq', ['mstore', 0, ['calldataload', 4]], ['return', 0, 32]]").to_list() == code.to_list()
+assert parse_lll("[seq, (mstore 0 [calldataload 4]), ['return' 0, 32]]").to_list() == code.to_list()
+assert compile_lll.compile_to_assembly(code) == \
+    compile_lll.compile_to_assembly(LLLnode.from_list(['seq', ['mstore', 0, ['calldataload', 4]], ['return', 0, 32]]))
+
+# Atoms: integers in decimal or hex, None, quoted and bare strings
+code = parse_lll("(seq (mstore 0x20 -5) (mstore 0 0xff) (with 'my var' 1 \"my var\") None)")
+assert code.to_list() == ['seq', ['mstore', [32], [-5]], ['mstore', [0], [255]], ['with', ['my var'], [1], ['my var']], [None]]
+assert parse_lll('5').to_list() == [5] and parse_lll('(x)').to_list() == ['x']
+
+# Whole contracts round-trip against to_list, through both repr and to_sexpr
+lll = parser.parse_tree_to_lll(parser.parse(crowdfund), cache=None)
+assert parse_lll(repr(lll)).to_list() == lll.to_list()
+assert parse_lll(to_sexpr(lll)).to_list() == lll.to_list()
+for code in (['seq', ['with', 'x', 1, ['mstore', 'x', '12']], ['sstore', 'None', '0x1']], 'seq', ['seq', 'a b', "it's"]):
+    node = LLLnode.from_list(code, validate=False)
+    assert parse_lll(to_sexpr(node), validate=False).to_list() == node.to_list(), to_sexpr(node)
+assert to_sexpr(LLLnode.from_list(['mstore', 0, ['add', 'x', 1]])) == '(mstore 0 (add x 1))'
+
+# Deep nesting does not hit the recursion limit
+deep = parse_lll('(add 1 ' * 5000 + '2' + ')' * 5000)
+assert compile_lll.compile_to_assembly(deep)[-1] == 'ADD'
+
+# Errors say where they are, and nodes are validated unless told otherwise
+for bad, where in (('(add 1', 'line 1, column 1'), ('(add 1 2))', 'line 1, column 10'), ('()', 'line 1, column 1'),
+                   ('(seq\n  (add 1 2 3))', 'line 2, column 3'), ('((add 1 2) 3)', 'line 1, column 1'),
+                   ('(add 1 2]', 'line 1, column 9'), ("(seq 'x)", 'line 1, column 6'), ('a b', 'line 1, column 4')):
+    try:
+        parse_lll(bad)
+        raise AssertionError("Expected an exception: %r" % bad)
+    except LLLSyntaxException as e:
+        assert str(e).startswith(where), (bad, str(e))
+assert parse_lll('(add 1 2 3)', validate=False).to_list() == ['add', [1], [2], [3]]
+
+# LLL text compiles without the frontend
+artifacts = compiler_plugin.mk_lll_artifacts("(return 0 (lll (seq (mstore 0 (calldataload 4)) (return 0 32)) 0))")
+assert artifacts['abi'] == [] and artifacts['runtime_bytecode'] == \
+    compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(parse_lll("(seq (mstore 0 (calldataload 4)) (return 0 32))")))
+assert compiler_plugin.mk_lll_artifacts(repr(lll))['bytecode'] == compiler_plugin.mk_artifacts(crowdfund, optimizer=optimizer.Optimizer([]))['bytecode']
+
+print('Passed LLL reader tests')
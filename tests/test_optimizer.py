@@ -0,0 +1,302 @@
+from viper import optimizer, compiler_plugin, compile_lll, parser
+from viper.parser import LLLnode
+import os
+
+crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+
+# Passes are registered by name and run in pipeline order, unless disabled
+calls = []
+
+@optimizer.register_pass('test_a')
+def pass_a(lll, stats):
+    calls.append('a')
+    stats.counters['seen'] += 1
+    return lll
+
+@optimizer.register_pass('test_b')
+def pass_b(lll, stats):
+    calls.append('b')
+    return LLLnode.from_list(['seq', lll, ['pass']])
+
+opt = optimizer.Optimizer(['test_b', 'test_a'], measure=True)
+lll = LLLnode.from_list(['sstore', 0, ['add', 1, 2]])
+assert repr(opt.optimize(lll)) == repr(LLLnode.from_list(['seq', lll, ['pass']]))
+assert calls == ['b', 'a']
+opt.disable('test_b')
+assert opt.enabled_passes == ['test_a']
+assert opt.optimize(lll) is lll and calls == ['b', 'a', 'a']
+
+# Stats record runs, time, node counts, gas and code size
+a, b = opt.stats['test_a'], opt.stats['test_b']
+assert a.runs == 2 and b.runs == 1 and a.counters['seen'] == 2
+assert b.nodes_before == 5 and b.nodes_after == 7 and b.nodes_delta == 2
+assert b.gas_delta == 0 and b.size_delta == 0 and b.gas_before == compile_lll.gas_estimate(lll)
+assert b.size_before == len(compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lll)))
+assert [s['name'] for s in opt.stats.as_dict()] == ['test_b', 'test_a']
+assert 'test_a' in opt.stats.report()
+try:
+    optimizer.Optimizer(['no_such_pass'])
+    raise AssertionError("Expected an exception")
+except Exception as e:
+    assert 'no_such_pass' in str(e)
+
+# Flattening seqs leaves the compiled code unchanged, and keeps valencies
+for code in (['seq', ['seq', ['mstore', 0, 1], ['pass']], ['seq'], ['seq', ['mstore', 0, 2], ['mload', 32]]],
+             ['seq', ['pass'], ['seq', ['mstore', 0, 1], ['seq']]],
+             ['seq', ['mstore', 0, 1], ['pass']]):
+    lll = LLLnode.from_list(code)
+    flat = optimizer.flatten_seq(lll, optimizer.PassStats('flatten_seq'))
+    assert flat.valency == lll.valency
+    assert compile_lll.compile_to_assembly(flat) == compile_lll.compile_to_assembly(lll)
+flat = optimizer.flatten_seq(LLLnode.from_list(code), optimizer.PassStats('flatten_seq'))
+assert repr(flat) == repr(LLLnode.from_list(['seq', ['mstore', 0, 1], ['pass']]))
+
+# Constant folding follows EVM arithmetic on 256-bit words
+def fold(code):
+    return optimizer.fold_constants(LLLnode.from_list(code), optimizer.PassStats('fold_constants')).to_list()
+
+W = 2**256
+for code, value in ((['add', 2**256 - 1, 2], 1), (['sub', 0, 1], W - 1), (['mul', 2**255, 2], 0),
+                    (['sdiv', -7, 2], W - 3), (['sdiv', -2**255, -1], 2**255), (['sdiv', 1, 0], 0),
+                    (['div', -1, 2], 2**255 - 1), (['smod', -7, 3], W - 1), (['smod', 7, -3], 1),
+                    (['mod', 5, 0], 0), (['lt', -1, 1], 0), (['slt', -1, 1], 1), (['eq', -1, W - 1], 1),
+                    (['iszero', ['sub', 3, 3]], 1), (['not', 0], W - 1), (['exp', 2, 256], 0),
+                    (['sge', -1, 0], 0), (['ceil32', 33], 64), (['ceil32', 0], 0)):
+    assert fold(code) == [value], (code, fold(code))
+
+# Clamps whose bounds and value are known are dropped, loads of the reserved
+# memory slots counting as known; clamps on unknown values are kept
+assert fold(['clamp', ['mload', parser.MINNUM_POS], -5, ['mload', parser.MAXNUM_POS]]) == [W - 5]
+assert fold(['uclamplt', 3, ['mload', parser.ADDRSIZE_POS]]) == [3]
+assert fold(['seq', ['assert', ['eq', 1, 1]], ['clamp_nonzero', 4]]) == ['seq', ['pass'], [4]]
+code = ['clamp', ['mload', parser.MINNUM_POS], ['calldataload', 4], ['mload', parser.MAXNUM_POS]]
+assert fold(code) == LLLnode.from_list(code).to_list()
+assert fold(['mload', parser.MAXNUM_POS]) == ['mload', [parser.MAXNUM_POS]]
+# A clamp that always fails is a compile-time error where it is always
+# reached, and fails at run time where it might not be; asserts that always
+# fail are left to fail at run time
+for code in (['clamp', ['mload', parser.MINNUM_POS], 2**128, ['mload', parser.MAXNUM_POS]], ['uclamplt', 5, 3],
+             ['clamp_nonzero', ['sub', 2, 2]]):
+    try:
+        fold(code)
+        raise AssertionError("Expected an exception: %r" % code)
+    except parser.ConstantClampException:
+        pass
+    assert fold(['seq', ['if', ['calldataload', 0], ['mstore', 0, 1]], ['if', ['calldataload', 4], ['mstore', 0, code]]]) == \
+        ['seq', ['if', ['calldataload', [0]], ['mstore', [0], [1]]],
+                ['if', ['calldataload', [4]], ['mstore', [0], ['seq', ['assert', [0]], fold(code[2 if code[0] == 'clamp' else 1])]]]]
+    assert fold(['seq', ['if', ['calldataload', 0], ['return', 0, 0]], ['mstore', 0, code]])[2][2][0] == 'seq'
+    assert fold(['repeat', 256, 0, 3, ['mstore', 0, code]])[4][2][0] == 'seq'
+assert fold(['seq', ['assert', ['eq', 1, 2]], ['mstore', 0, ['uclamplt', 5, 3]]]) == \
+    ['seq', ['assert', [0]], ['mstore', [0], ['seq', ['assert', [0]], [5]]]]
+
+# Numbers bound by with statements are propagated, minding shadowing and
+# the separate scope of lll code
+assert fold(['with', 'x', ['add', 1, 2], ['mul', 'x', 'x']]) == [9]
+assert fold(['with', 'x', 1, ['with', 'x', ['calldataload', 'x'], ['add', 'x', 'x']]]) == \
+    ['with', ['x'], ['calldataload', [1]], ['add', ['x'], ['x']]]
+assert fold(['with', 'x', 2, ['lll', ['seq', ['mstore', 0, 'x'], ['return', 0, 32]], 'x']]) == \
+    ['lll', ['seq', ['mstore', [0], ['x']], ['return', [0], [32]]], [2]]
+
+# Literal arithmetic in a contract folds away, and a constant out-of-bounds
+# index is a compile-time error
+code = "y: num[3]\ndef foo() -> num:\n    x = 3 * 1000\n    z = 1.5 * 2.0\n    return x + self.y[2]\n"
+unoptimized = compiler_plugin.mk_artifacts(code, optimizer=optimizer.Optimizer([]))
+optimized = compiler_plugin.mk_artifacts(code, optimizer=optimizer.Optimizer(['fold_constants']))
+assert len(optimized['bytecode']) < len(unoptimized['bytecode'])
+assert optimized['gas_estimates']['foo'] < unoptimized['gas_estimates']['foo']
+lll = compiler_plugin.lower_functions(code, optimizer=optimizer.Optimizer(['fold_constants']))[2][0][0]
+assert ['mstore', [256], [3000]] in lll.to_list()[2]
+try:
+    compiler_plugin.mk_artifacts("y: num[3]\ndef foo() -> num:\n    return self.y[3]\n")
+    raise AssertionError("Expected an exception")
+except parser.ConstantClampException:
+    pass
+# Code that fails only at run time, or only on some paths, still compiles
+for code in ("def foo():\n    assert False\n",
+             "def foo(x: num):\n    if x > 3:\n        assert 1 == 2\n",
+             "y: num[3]\ndef foo(x: num) -> num:\n    if x > 100:\n        return self.y[5]\n    return x\n"):
+    assert compiler_plugin.mk_artifacts(code)['bytecode']
+
+# Clamps are dropped where value ranges prove them satisfied: loop counters,
+# booleans, values already clamped and arithmetic that cannot overflow
+def eliminate(code):
+    stats = optimizer.PassStats('eliminate_clamps')
+    return optimizer.eliminate_clamps(LLLnode.from_list(code), stats).to_list(), stats.counters
+
+minnum, maxnum = ['mload', parser.MINNUM_POS], ['mload', parser.MAXNUM_POS]
+loop = ['repeat', 320, 0, 10, ['mstore', 0, ['sload', ['add', 5, ['uclamplt', ['mload', 320], 10]]]]]
+assert eliminate(loop) == (['repeat', [320], [0], [10], ['mstore', [0], ['sload', ['add', [5], ['mload', [320]]]]]],
+                           {'uclamplt_removed': 1})
+assert eliminate(['uclamplt', ['lt', ['calldataload', 4], 3], 2])[0] == ['lt', ['calldataload', [4]], [3]]
+clamped = ['uclamplt', ['calldataload', 4], 100]
+assert eliminate(['with', 'x', clamped, ['clamp', minnum, ['sub', ['add', 'x', 'x'], 5], maxnum]]) == \
+    (['with', ['x'], ['uclamplt', ['calldataload', [4]], [100]], ['sub', ['add', ['x'], ['x']], [5]]], {'clamp_removed': 1})
+assert eliminate(['seq', ['assert', ['add', ['iszero', 'x'], 1]], ['clamp_nonzero', ['mod', 'x', 7]]])[0] == \
+    ['seq', ['pass'], ['clamp_nonzero', ['mod', ['x'], [7]]]]
+# Kept: the counter may be overwritten in the body, the value may be out of
+# range, or a dropped bound has side effects
+check = ['mstore', 0, ['uclamplt', ['mload', 320], 10]]
+for code in (['repeat', 320, 0, 10, ['seq', ['mstore', ['add', 300, 20], 50], check]],
+             ['repeat', 320, 0, 10, ['seq', ['calldatacopy', 0, 0, 'x'], check]],
+             ['repeat', 320, 0, 11, check],
+             ['clamp', minnum, ['mul', ['clamp', minnum, 'x', maxnum], 2**200], maxnum],
+             ['uclamplt', ['lt', 'x', 3], ['seq', ['sstore', 0, 1], 2]]):
+    assert eliminate(code) == (LLLnode.from_list(code).to_list(), {}), code
+
+# In a contract, a loop over a list loses its index check
+code = "y: num[10]\ndef foo() -> num:\n    s = 0\n    for i in range(10):\n        s += self.y[i]\n    return s\n"
+with_ranges = compiler_plugin.mk_artifacts(code)
+opt = optimizer.Optimizer()
+opt.disable('eliminate_clamps')
+without_ranges = compiler_plugin.mk_artifacts(code, optimizer=opt)
+assert len(with_ranges['bytecode']) < len(without_ranges['bytecode'])
+assert 'uclamplt' not in repr(compiler_plugin.lower_functions(code)[2][0][0])
+
+# Address computations used more than once in a seq are computed once, in
+# a with statement around the statements from the first using them on
+def share(code):
+    stats = optimizer.PassStats('share_subexpressions')
+    code = ['with', 'x', ['calldataload', 4], code]
+    return optimizer.share_subexpressions(LLLnode.from_list(code), stats).to_list()[3], stats.counters
+
+addr = ['sha3_32', ['add', ['sha3_32', 0], ['mload', 288]]]
+code, counters = share(['seq', ['if', 'x', ['return', 0, 0]],
+                        ['sstore', 0, ['add', ['sload', ['add', addr, 0]], ['sload', ['add', addr, 1]]]],
+                        ['sstore', ['add', addr, 2], 0]])
+assert code == LLLnode.from_list(['seq', ['if', 'x', ['return', 0, 0]],
+                                  ['with', '_cse_0', addr,
+                                      ['seq', ['sstore', 0, ['add', ['sload', ['add', '_cse_0', 0]], ['sload', ['add', '_cse_0', 1]]]],
+                                              ['sstore', ['add', '_cse_0', 2], 0]]]]).to_list()
+assert counters == {'subexpressions_shared': 1, 'uses_replaced': 3}
+# Parts of shared subexpressions used elsewhere are shared too, outside them
+code, counters = share(['seq', ['sstore', ['sha3_32', ['add', ['sha3_32', 0], 'x']], 1],
+                        ['sstore', ['sha3_32', ['add', ['sha3_32', 0], 'x']], 2], ['sstore', ['add', ['sha3_32', 0], 'x'], 3]])
+assert code == LLLnode.from_list(['seq', ['with', '_cse_1', ['add', ['sha3_32', 0], 'x'], ['with', '_cse_0', ['sha3_32', '_cse_1'],
+                                  ['seq', ['sstore', '_cse_0', 1], ['sstore', '_cse_0', 2], ['sstore', '_cse_1', 3]]]]]).to_list()
+assert counters == {'subexpressions_shared': 2, 'uses_replaced': 4}
+# Checks can be shared once they are sure to have been evaluated
+code = ['seq', ['sstore', ['uclamplt', 'x', 5], 1], ['sstore', ['uclamplt', 'x', 5], 2]]
+assert share(code)[0] == LLLnode.from_list(['seq', ['with', '_cse_0', ['uclamplt', 'x', 5],
+                                            ['seq', ['sstore', '_cse_0', 1], ['sstore', '_cse_0', 2]]]]).to_list()
+# Not shared: values read from memory written in the seq, variables bound
+# differently, and checks that might otherwise not be evaluated
+for code in (['seq', ['sstore', ['sha3_32', ['mload', 256]], 1], ['mstore', 256, 5], ['sstore', ['sha3_32', ['mload', 256]], 2]],
+             ['seq', ['sstore', ['sha3_32', 'x'], 1], ['with', 'x', 5, ['sstore', ['sha3_32', 'x'], 2]]],
+             ['seq', ['if', 'x', ['sstore', ['uclamplt', 'x', 5], 1]], ['sstore', ['uclamplt', 'x', 5], 2]],
+             ['seq', ['seq', ['if', 'x', ['return', 0, 0]], ['sstore', ['uclamplt', 'x', 5], 1]], ['sstore', ['uclamplt', 'x', 5], 2]]):
+    assert share(code) == (LLLnode.from_list(code).to_list(), {}), code
+
+# Storage-heavy functions get cheaper
+code = """
+balances: num[address]
+
+def move(to: address, value: num):
+    self.balances[msg.sender] = self.balances[msg.sender] - value
+    self.balances[to] = self.balances[to] + value
+"""
+opt = optimizer.Optimizer()
+opt.disable('share_subexpressions')
+assert compiler_plugin.mk_artifacts(code)['gas_estimates']['move'] < \
+    compiler_plugin.mk_artifacts(code, optimizer=opt)['gas_estimates']['move']
+
+def forward(code):
+    stats = optimizer.PassStats('forward_storage')
+    code = ['with', 'x', ['calldataload', 4], code]
+    return optimizer.forward_storage(LLLnode.from_list(code), stats).to_list()[3], stats.counters
+
+# Storage read or written earlier in a seq is not read again
+slot = ['add', ['sha3_64', 2, 'x'], 1]
+code, counters = forward(['seq', ['mstore', 0, ['sload', 0]], ['sstore', slot, ['add', ['sload', 0], 'x']],
+                          ['sstore', 1, 5], ['mstore', 32, ['add', ['sload', 0], ['add', ['sload', slot], ['sload', 1]]]]])
+assert code == LLLnode.from_list(['seq', ['with', '_fwd_0', ['sload', 0],
+                                  ['seq', ['mstore', 0, '_fwd_0'],
+                                          ['with', '_fwd_1', ['add', '_fwd_0', 'x'],
+                                              ['seq', ['sstore', slot, '_fwd_1'], ['sstore', 1, 5],
+                                                      ['mstore', 32, ['add', '_fwd_0', ['add', '_fwd_1', 5]]]]]]]]).to_list()
+assert counters == {'sloads_removed': 4}
+# Nothing is known past a write to the same slot, maybe the same slot, or a call
+for stmt in (['seq', ['sstore', 0, 'x'], ['pass']], ['sstore', ['add', 'x', 1], 1], ['sstore', ['sload', 5], 1],
+             ['pop', ['call', 0, 'x', 0, 0, 0, 0, 0]], ['if', 'x', ['sstore', 0, 1]]):
+    code = ['seq', ['mstore', 0, ['sload', 0]], stmt, ['mstore', 0, ['sload', 0]]]
+    assert forward(code) == (LLLnode.from_list(code).to_list(), {}), stmt
+code = ['seq', ['mstore', 0, ['sload', ['sha3_64', 2, 'x']]], ['sstore', ['sha3_64', 3, 'x'], 1], ['sstore', ['add', ['sha3_64', 2, 'x'], 1], 1],
+        ['sstore', 2, 1], ['mstore', 0, ['sload', ['sha3_64', 2, 'x']]]]
+assert forward(code)[1] == {'sloads_removed': 1}
+
+def eliminate_stores(code):
+    stats = optimizer.PassStats('eliminate_dead_stores')
+    code = ['with', 'x', ['calldataload', 4], code]
+    return optimizer.eliminate_dead_stores(LLLnode.from_list(code), stats).to_list()[3], stats.counters
+
+# Stores overwritten before they can be read are dropped, keeping the effects
+# of their values
+slot = ['add', ['sha3_64', 2, 'x'], 1]
+code, counters = eliminate_stores(['seq', ['sstore', slot, 1], ['mstore', 256, ['sload', 0]], ['sstore', 1, ['clamp_nonzero', 'x']],
+                                   ['mstore', 288, ['sload', 3]], ['sstore', slot, 2], ['sstore', 1, 3], ['mstore', 256, 4], ['return', 256, 32]])
+assert code == LLLnode.from_list(['seq', ['pop', ['clamp_nonzero', 'x']], ['mstore', 288, ['sload', 3]],
+                                  ['sstore', slot, 2], ['sstore', 1, 3], ['mstore', 256, 4], ['return', 256, 32]]).to_list()
+assert counters == {'sstores_removed': 2, 'mstores_removed': 1}
+# Not dropped: stores that may be read, or that are followed by a call or an
+# exit, or by a write to an address that may differ
+for stmt, removed in ((['mstore', 0, ['sload', 0]], {'mstores_removed': 1}), (['mstore', 0, ['sload', ['add', 'x', 1]]], {'mstores_removed': 1}),
+                      (['log0', 224, 64], {'sstores_removed': 1}), (['pop', ['call', 0, 'x', 0, 0, 0, 0, 0]], {}), (['if', 'x', ['return', 0, 0]], {})):
+    code = ['seq', ['sstore', 0, 1], ['mstore', 256, 1], stmt, ['sstore', 0, 2], ['mstore', 256, 2]]
+    assert eliminate_stores(code)[1] == removed, stmt
+code = ['seq', ['sstore', ['sha3_64', 0, ['mload', 256]], 1], ['mstore', 256, 'x'], ['sstore', ['sha3_64', 0, ['mload', 256]], 2]]
+assert eliminate_stores(code) == (LLLnode.from_list(code).to_list(), {})
+
+def eliminate_code(code):
+    stats = optimizer.PassStats('eliminate_dead_code')
+    return optimizer.eliminate_dead_code(LLLnode.from_list(code), stats).to_list(), stats.counters
+
+# Constant ifs take their branch, and statements after leaving the code are dropped
+code, counters = eliminate_code(['seq', ['if', 1, ['mstore', 0, 1], ['mstore', 0, 2]], ['if', 0, ['mstore', 0, 3]],
+                                 ['if', ['calldataload', 0], ['return', 0, 32], ['seq', ['assert', 0], ['mstore', 0, 4]]],
+                                 ['mstore', 0, 5], ['stop']])
+assert code == LLLnode.from_list(['seq', ['mstore', 0, 1], 'pass', ['if', ['calldataload', 0], ['return', 0, 32], ['seq', ['assert', 0]]]]).to_list()
+assert counters == {'ifs_folded': 2, 'statements_dropped': 3}
+# Kept: what might be reached, the value of a seq, and what follows a loop
+# that breaks
+loop = ['repeat', 256, 0, 5, ['seq', ['break'], ['mstore', 0, 1]]]
+for code, expected in ((['seq', ['if', ['calldataload', 0], ['return', 0, 0]], ['stop']], None),
+                       (['with', 'x', ['seq', ['stop'], 5], 'x'], None),
+                       (['seq', loop, ['stop']], ['seq', ['repeat', 256, 0, 5, ['seq', ['break']]], ['stop']])):
+    assert eliminate_code(code)[0] == LLLnode.from_list(expected or code).to_list(), code
+# Functions lose their unreachable code, down to the assembly
+code = """
+a: num
+
+def foo(x: num) -> num:
+    if x > 3:
+        return 1
+    else:
+        return 2
+    self.a = x
+    return 3
+"""
+opt = optimizer.Optimizer()
+assert len(compiler_plugin.mk_artifacts(code, optimizer=opt)['bytecode']) < \
+    len(compiler_plugin.mk_artifacts(code, optimizer=optimizer.Optimizer(disabled=['eliminate_dead_code']))['bytecode'])
+assert opt.stats['eliminate_dead_code'].counters['statements_dropped'] == 2
+# Including after an assert that always fails, which the default pipeline
+# leaves to fail at run time
+code = "a: num\ndef foo(x: num):\n    assert False\n    self.a = x\n    self.a = x + 1\n"
+opt = optimizer.Optimizer()
+artifacts = compiler_plugin.mk_artifacts(code, optimizer=opt)
+assert opt.stats['eliminate_dead_code'].counters['statements_dropped'] == 2
+assert 'SSTORE' not in artifacts['assembly'][4]
+assert len(artifacts['bytecode']) < \
+    len(compiler_plugin.mk_artifacts(code, optimizer=optimizer.Optimizer(disabled=['eliminate_dead_code']))['bytecode'])
+
+# The default pipeline runs on every compiled function, without modifying
+# the cached, unoptimized LLL
+opt = optimizer.Optimizer(measure=True)
+before = repr(parser.parse_tree_to_lll(parser.parse(crowdfund)))
+artifacts = compiler_plugin.mk_artifacts(crowdfund, optimizer=opt)
+assert repr(parser.parse_tree_to_lll(parser.parse(crowdfund))) == before
+assert opt.stats['fold_constants'].runs == opt.stats['eliminate_dead_code'].runs == opt.stats['eliminate_clamps'].runs == opt.stats['forward_storage'].runs == \
+    opt.stats['share_subexpressions'].runs == opt.stats['flatten_seq'].runs == opt.stats['eliminate_dead_stores'].runs == len(artifacts['abi'])
+assert compiler_plugin.mk_artifacts(crowdfund, optimizer=optimizer.Optimizer([]))['abi'] == artifacts['abi']
+
+print('Passed optimizer tests')
@@ -0,0 +1,79 @@
+from viper import parser, compile_lll, compiler_plugin
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+
+many_funcs = "x: num[10]\n"
+for i in range(40):
+    many_funcs += """
+def f%d(a: num) -> num:
+    o = a
+    for i in range(10):
+        o = o + self.x[i] * %d
+    return o
+""" % (i, i)
+
+def compile_lll_to_evm(lll):
+    return compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lll))
+
+# Parallel lowering gives byte-identical output to serial lowering
+with ProcessPoolExecutor(4) as pool:
+    for code in (crowdfund, many_funcs):
+        serial = parser.parse_tree_to_lll(parser.parse(code), cache=None)
+        parallel = parser.parse_tree_to_lll(parser.parse(code), cache=None, executor=pool)
+        assert repr(serial) == repr(parallel)
+        assert compile_lll_to_evm(serial) == compile_lll_to_evm(parallel)
+    # Cached functions are not sent to the pool again
+    cache = parser.FunctionCache()
+    parser.parse_tree_to_lll(parser.parse(many_funcs), cache=cache, executor=pool)
+    parser.parse_tree_to_lll(parser.parse(many_funcs), cache=cache, executor=pool)
+    assert cache.misses == 40 and cache.hits == 40
+
+c = compiler_plugin.Compiler(jobs=2)
+try:
+    assert c.compile(many_funcs) == compiler_plugin.Compiler().compile(many_funcs)
+finally:
+    c.close()
+
+print('Passed parallel lowering tests')
+
+from viper.parser import TypeMismatchException
+
+bad_code = """
+def foo() -> num:
+    return msg.sender
+"""
+
+sources = {'crowdfund': crowdfund, 'many_funcs': many_funcs, 'bad': bad_code}
+c = compiler_plugin.Compiler()
+results = dict(c.compile_many(sources, jobs=2))
+assert sorted(results) == ['bad', 'crowdfund', 'many_funcs']
+# A failing contract reports its error without affecting the others
+assert isinstance(results['bad'], TypeMismatchException)
+assert results['crowdfund'] == compiler_plugin.mk_artifacts(crowdfund)
+assert results['many_funcs']['bytecode'] == c.compile(many_funcs)
+# Lazy iterators of plain sources are named by position
+results = dict(c.compile_many((code for code in [crowdfund, bad_code]), jobs=2))
+assert results[0]['abi'] == c.mk_full_signature(crowdfund) and isinstance(results[1], Exception)
+
+print('Passed batch compile tests')
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Assembly does not depend on what was compiled before in the process...
+def assemble(code):
+    return compile_lll.compile_to_assembly(parser.parse_tree_to_lll(parser.parse(code), cache=None))
+
+first = assemble(crowdfund)
+assemble(many_funcs)
+assert assemble(crowdfund) == first
+assert '_sym_1' in first
+
+# ...so compiling on many threads at once matches compiling serially
+codes = [crowdfund, many_funcs] * 8
+expected = [assemble(code) for code in codes]
+with ThreadPoolExecutor(8) as pool:
+    assert list(pool.map(assemble, codes)) == expected
+
+print('Passed concurrent compile tests')
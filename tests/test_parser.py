@@ -1,6 +1,8 @@
 from viper import parser, compile_lll
-from viper import compiler_plugin
+from viper import compiler_plugin, optimizer
 from ethereum import tester as t
+from ethereum import utils
+import random
 # from ethereum.slogging import LogRecorder, configure_logging, set_level
 # config_string = ':info,eth.vm.log:trace,eth.vm.op:trace,eth.vm.stack:trace,eth.vm.exit:trace,eth.pb.msg:trace,eth.pb.tx:debug'
 # configure_logging(config_string=config_string)
@@ -292,6 +294,57 @@ assert c.phooey() == 20736
 
 print('Passed fractional multiplication test')
 
+overflow_test = """
+def sub(a: num, b: num) -> num:
+    return a * 4 - b * 4
+
+def mul(a: num, b: num) -> num:
+    return a * b
+
+def dmul(a: num, b: num) -> num:
+    return floor(a * 1.5 * b)
+"""
+
+c = s.abi_contract(overflow_test, language='viper')
+assert c.sub(2**124, 2**124 - 2) == 8
+assert c.mul(2**64, 2**62) == 2**126
+assert c.dmul(2**100, 2) == 3 * 2**100
+# A decimal product that overflows a word fails
+for f, args in ((c.dmul, (2**127 - 1, 2**127 - 1)),):
+    try:
+        f(*args)
+        success = True
+    except t.TransactionFailed:
+        success = False
+    assert not success
+
+print('Passed arithmetic overflow test')
+
+constant_failure_test = """
+y: num[3]
+
+def foo(x: num) -> num:
+    if x > 100:
+        return self.y[5]
+    return x
+
+def bar():
+    assert False
+"""
+
+# Checks that always fail compile, and fail when they are reached
+c = s.abi_contract(constant_failure_test, language='viper')
+assert c.foo(7) == 7
+for f, args in ((c.foo, (101,)), (c.bar, ())):
+    try:
+        f(*args)
+        success = True
+    except t.TransactionFailed:
+        success = False
+    assert not success
+
+print('Passed constant failure test')
+
 break_test = """
 def log(n: num) -> num:
     c = n * 1.0
@@ -570,6 +623,51 @@ assert c.foo() == 1023, c.foo()
 assert c.fop() == 1023, c.fop()
 print('Passed packing test')
 
+storage_layout_test = """
+a: num
+b: {x: num, y: num[3]}
+c: num[address]
+d: {owner: address, votes: num}[num]
+
+def set():
+    self.a = 1
+    self.b.y[2] = 2
+    self.c[msg.sender] = 3
+    self.d[5].votes = 4
+"""
+
+# Globals take up consecutive slots, struct members in alphabetical order and
+# list elements in order; mapping values are stored from sha3(slot ++ key)
+def mapping_slot(slot, key):
+    return utils.big_endian_to_int(utils.sha3(utils.zpad(utils.encode_int(slot), 32) + utils.zpad(key, 32)))
+
+c = s.abi_contract(storage_layout_test, language='viper')
+c.set(sender=t.k0)
+for slot, value in ((0, 1), (4, 2), (mapping_slot(5, t.a0), 3), (mapping_slot(6, utils.encode_int(5)) + 1, 4)):
+    assert s.state.get_storage_data(c.address, slot) == value, slot
+
+print('Passed storage layout test')
+
+storage_forwarding_test = """
+x: num
+y: num[num]
+
+def foo(a: num) -> num:
+    self.x = a
+    self.y[a] = self.x + 1
+    self.y[a + 1] = self.y[a] * 2
+    self.y[self.x] = self.y[a] + self.y[a + 1]
+    return self.x * 100 + self.y[a] + self.y[a + 1] * 1000
+"""
+
+# Storage values read back within a function are the ones last written:
+# y[a] is rewritten to 3 * (a + 1) through self.y[self.x], y[a + 1] is 2 * (a + 1)
+c = s.abi_contract(storage_forwarding_test, language='viper')
+for a in (3, -7, 0, -1, 2**64):
+    assert c.foo(a) == a * 100 + 3 * (a + 1) + 2000 * (a + 1), (a, c.foo(a))
+
+print('Passed storage forwarding test')
+
 multi_setter_test = """
 foo: num[3]
 bar: num[3][3]
@@ -824,3 +922,55 @@ moo_result = c.foo(b'cow')
 assert moo_result == b'cow'
 
 print('Passed basic bytes test')
+
+# Random sequences of reads and writes of storage and memory behave the
+# same with and without the optimizer
+t.languages['viper_unoptimized'] = compiler_plugin.Compiler(optimizer=optimizer.Optimizer([]))
+rng = random.Random(5)
+
+def random_expr(depth):
+    choice = rng.randint(0, 12 if depth else 10)
+    if choice > 10:
+        return '(%s + %s)' % (random_expr(depth - 1), random_expr(depth - 1))
+    return [str(rng.randint(0, 9)), 'x', 'self.a', 'self.b', 'self.c[%d]' % rng.randint(0, 2), 'self.m[x]',
+            'self.m[%d]' % rng.randint(0, 4), 'self.g.x', 'self.g.y', 'v', 'w[%d]' % rng.randint(0, 2)][choice]
+
+def random_stmt():
+    choice = rng.randint(0, 12)
+    if choice == 12:
+        return 'send(msg.sender, 0)'
+    elif choice == 11:
+        return 'if x > %d:\n        %s' % (rng.randint(0, 4), random_stmt().replace('\n', '\n    '))
+    elif choice == 10:
+        return 'self.g = {x: %s, y: %s}' % (random_expr(1), random_expr(1))
+    elif choice == 9:
+        return '%s = [%s, %s, %s]' % (rng.choice(['self.c', 'w']), random_expr(1), random_expr(1), random_expr(1))
+    target = ['self.a', 'self.b', 'self.c[%d]' % rng.randint(0, 2), 'self.m[x]', 'self.m[%d]' % rng.randint(0, 4),
+              'self.g.x', 'self.g.y', 'v', 'w[%d]' % rng.randint(0, 2)][choice % 9]
+    return '%s = %s' % (target, random_expr(2))
+
+for i in range(12):
+    code = """
+a: num
+b: num
+c: num[3]
+m: num[num]
+g: {x: num, y: num}
+
+def foo(x: num) -> num:
+    v: num
+    w: num[3]
+    %s
+    return v + w[0] * 3 + w[1] * 5 + w[2] * 7
+
+def check() -> num:
+    return self.a + self.b * 11 + self.c[0] * 13 + self.c[1] * 17 + self.c[2] * 19 + self.g.x * 23 + self.g.y * 29 + \\
+        self.m[0] * 31 + self.m[1] * 37 + self.m[2] * 41 + self.m[3] * 43 + self.m[4] * 47
+""" % '\n    '.join(random_stmt() for j in range(rng.randint(4, 12)))
+    optimized = s.abi_contract(code, language='viper')
+    unoptimized = s.abi_contract(code, language='viper_unoptimized')
+    for x in (rng.randint(0, 4), rng.randint(0, 4)):
+        assert optimized.foo(x) == unoptimized.foo(x), code
+        assert optimized.check() == unoptimized.check(), code
+
+print('Passed randomized optimizer tests')
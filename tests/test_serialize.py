@@ -0,0 +1,69 @@
+from viper.parser import LLLnode, LLLInterner
+from viper.types import BaseType, ListType, MappingType, StructType, ByteArrayType, NullType
+from viper import compile_lll, parser, serialize
+import os, pickle
+
+crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+
+def same_tree(a, b):
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if (a.value, a.valency, a.opcode, a.location, a.typ, len(a.args)) != \
+           (b.value, b.valency, b.opcode, b.location, b.typ, len(b.args)):
+            return False
+        stack.extend(zip(a.args, b.args))
+    return True
+
+# LLL trees round-trip exactly, and are far smaller than when pickled
+lll = parser.parse_tree_to_lll(parser.parse(crowdfund), cache=None)
+blob = serialize.dumps_lll(lll)
+loaded = serialize.loads_lll(blob)
+assert same_tree(lll, loaded)
+assert repr(loaded) == repr(lll)
+assert compile_lll.compile_to_assembly(loaded) == compile_lll.compile_to_assembly(lll)
+assert len(blob) * 4 < len(pickle.dumps(lll))
+
+# Loading reads from any buffer without copying it
+assert same_tree(serialize.loads_lll(memoryview(bytearray(blob))), lll)
+
+# Big and negative numbers, variables, opcodes in other cases and types
+code = LLLnode.from_list(['seq', ['mstore', 0, 2**256 - 1], ['MSTORE', 32, -5],
+                              ['with', 'x', ['sload', 7], ['add', 'x', 'x']]],
+                         typ=BaseType('num', {'wei': 1, 'sec': -2}, True), location='memory')
+code.args[0].typ = MappingType(BaseType('address'), StructType({'a': ListType(BaseType('num', None), 3), 'b': ByteArrayType(64)}))
+assert same_tree(serialize.loads_lll(serialize.dumps_lll(code)), code)
+null = LLLnode(None, [], NullType())
+assert same_tree(serialize.loads_lll(serialize.dumps_lll(null)), null)
+
+# Shared subtrees are written once and stay shared
+dag = LLLInterner().intern(lll)
+dag_blob = serialize.dumps_lll(dag)
+assert len(dag_blob) < len(blob)
+loaded = serialize.loads_lll(dag_blob)
+assert same_tree(loaded, lll)
+x = LLLnode.from_list(['add', 1, 2])
+loaded = serialize.loads_lll(serialize.dumps_lll(LLLnode.from_list(['mul', x, x])))
+assert loaded.args[0] is loaded.args[1]
+
+# Assembly round-trips, nested assembly included
+asm = compile_lll.compile_to_assembly(lll)
+assert any(isinstance(item, list) for item in asm)
+assert serialize.loads_assembly(serialize.dumps_assembly(asm)) == asm
+for asm in ([], [[]], [[], 'STOP'], [[[1], []], 'BLANK', '_sym_3', 255, 'PUSH2', 1, 0]):
+    assert serialize.loads_assembly(serialize.dumps_assembly(asm)) == asm
+
+# Malformed blobs are rejected
+for bad in (b'', b'VLLB', blob[:-1], blob + b'\x00', b'XXXX' + blob[4:], blob[:4] + b'\x63' + blob[5:]):
+    try:
+        serialize.loads_lll(bad)
+        raise AssertionError("Expected an exception")
+    except ValueError:
+        pass
+try:
+    serialize.loads_assembly(blob)
+    raise AssertionError("Expected an exception")
+except ValueError:
+    pass
+
+print('Passed serialization tests')
@@ -0,0 +1,42 @@
+from viper import compiler_plugin, optimizer, server
+import asyncio, os, tempfile
+
+crowdfund = open(os.path.join(os.path.dirname(__file__), '..', 'examples', 'crowdfund.vy')).read()
+
+async def run(path):
+    srv = server.CompileServer(workers=2)
+    await srv.start(path)
+    client = server.CompileClient(path)
+    try:
+        # Artifacts match a local compilation, over one reused connection
+        expected = compiler_plugin.mk_artifacts(crowdfund)
+        results = await asyncio.gather(*[client.compile(crowdfund) for i in range(4)])
+        for o in results:
+            assert bytes.fromhex(o['bytecode'][2:]) == expected['bytecode']
+            assert bytes.fromhex(o['runtime_bytecode'][2:]) == expected['runtime_bytecode']
+            assert o['abi'] == expected['abi'] and o['gas_estimates'] == expected['gas_estimates']
+        # Compile errors come back as a typed error
+        o = await client.compile("def foo() -> num:\n    return msg.sender\n")
+        assert o['error']['type'] == 'TypeMismatchException'
+        # Stats report the requests served, their latency and the queue depth
+        stats = await client.stats()
+        assert stats['workers'] == 2 and stats['queue_depth'] == 0
+        assert stats['requests'] == 5 and stats['errors'] == 1
+        assert 0 < stats['latency']['p50'] <= stats['latency']['max']
+        assert (await client.request('GET', '/nothing'))['error']['type'] == 'NotFound'
+        # Options choose the optimizer passes; unknown ones are rejected
+        o = await client.compile(crowdfund, {'optimize': False})
+        assert bytes.fromhex(o['bytecode'][2:]) == compiler_plugin.mk_artifacts(crowdfund, optimizer=optimizer.Optimizer([]))['bytecode']
+        assert bytes.fromhex(o['bytecode'][2:]) != expected['bytecode']
+        o = await client.compile(crowdfund, {'disable_passes': ['fold_constants']})
+        assert bytes.fromhex(o['bytecode'][2:]) == compiler_plugin.mk_artifacts(crowdfund, optimizer=optimizer.Optimizer(disabled=['fold_constants']))['bytecode']
+        for options in ({'optimise': False}, {'disable_passes': ['nothing']}, {'disable_passes': 'fold_constants'}):
+            assert (await client.compile(crowdfund, options))['error']['type'] == 'BadRequest'
+    finally:
+        client.close()
+        await srv.close()
+
+with tempfile.TemporaryDirectory() as d:
+    asyncio.get_event_loop().run_until_complete(run(os.path.join(d, 'viper.sock')))
+
+print('Passed compile server tests')
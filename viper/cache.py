@@ -0,0 +1,204 @@
+import hashlib, json, os
+from . import __version__
+
+# Identifies the compiler that produced an artifact: the version plus a digest
+# of the compiler sources, so that a cache never serves artifacts built by
+# different compiler code under the same version number
+_fingerprint = []
+
+def compiler_fingerprint():
+    if not _fingerprint:
+        h = hashlib.sha256(__version__.encode('utf-8'))
+        srcdir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(srcdir)):
+            if name.endswith('.py'):
+                with open(os.path.join(srcdir, name), 'rb') as f:
+                    h.update(name.encode('utf-8') + b'\x00' + f.read())
+        _fingerprint.append(__version__ + '-' + h.hexdigest()[:16])
+    return _fingerprint[0]
+
+# Content hash of a compilation: source, compiler fingerprint and options.
+# Options set to None are the same as options not given at all
+def mk_cache_key(code, options=None):
+    options = sorted((k, repr(v)) for k, v in (options or {}).items() if v is not None)
+    blob = json.dumps([compiler_fingerprint(), code, options])
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+# Converts compiler artifacts to and from their JSON form
+def encode_artifacts(artifacts):
+    o = dict(artifacts)
+    for k, v in artifacts.items():
+        if isinstance(v, bytes):
+            o[k] = {'hex': v.hex()}
+    return json.dumps(o, sort_keys=True).encode('utf-8')
+
+def decode_artifacts(blob):
+    o = json.loads(blob.decode('utf-8'))
+    for k, v in o.items():
+        if isinstance(v, dict) and list(v.keys()) == ['hex']:
+            o[k] = bytes.fromhex(v['hex'])
+    return o
+
+# On-disk cache of compiler artifacts, one file per cache key. Writes go to a
+# temporary file that is atomically renamed into place, so any number of
+# processes can share a cache directory. Reads touch the file, and once the
+# directory grows beyond max_size bytes the least recently used files are
+# removed until it is back under 3/4 of max_size
+class DiskCache():
+    def __init__(self, path, max_size=256 * 2**20):
+        self.path = path
+        self.max_size = max_size
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, key):
+        blob = self.get_blob(key)
+        if blob is None:
+            return None
+        try:
+            return decode_artifacts(blob)
+        except ValueError:
+            # Corrupted entry, eg. from a full disk; drop it
+            self.remove(self.filename(key))
+            return None
+
+    def put(self, key, artifacts):
+        self.put_blob(key, encode_artifacts(artifacts))
+
+    def get_blob(self, key):
+        fn = self.filename(key)
+        try:
+            with open(fn, 'rb') as f:
+                blob = f.read()
+            os.utime(fn)
+            return blob
+        except FileNotFoundError:
+            return None
+
+    def put_blob(self, key, blob):
+        import tempfile
+        fn = self.filename(key)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, fn)
+        except BaseException:
+            self.remove(tmp)
+            raise
+        if self.size is None:
+            self.size = self.scan()[1]
+        else:
+            self.size += len(blob)
+        if self.size > self.max_size:
+            self.evict()
+
+    # Lists (mtime, size, filename) of all entries, and their total size
+    def scan(self):
+        entries = []
+        for sub in os.listdir(self.path):
+            subdir = os.path.join(self.path, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not name.endswith('.json'):
+                    continue
+                fn = os.path.join(subdir, name)
+                try:
+                    st = os.stat(fn)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fn))
+        return entries, sum(e[1] for e in entries)
+
+    def evict(self):
+        entries, total = self.scan()
+        for mtime, size, fn in sorted(entries):
+            if total <= self.max_size * 3 // 4:
+                break
+            self.remove(fn)
+            total -= size
+        self.size = total
+
+    def clear(self):
+        for mtime, size, fn in self.scan()[0]:
+            self.remove(fn)
+        self.size = 0
+
+    @staticmethod
+    def remove(fn):
+        try:
+            os.remove(fn)
+        except FileNotFoundError:
+            pass
+
+# Is a string a well-formed cache key?
+def is_cache_key(key):
+    return len(key) == 64 and all(c in '0123456789abcdef' for c in key)
+
+# Remote entries are sent as the hex SHA256 digest of the payload, a newline
+# and the payload itself
+def seal_blob(blob):
+    return hashlib.sha256(blob).hexdigest().encode('ascii') + b'\n' + blob
+
+def unseal_blob(sealed):
+    digest, _, blob = sealed.partition(b'\n')
+    if hashlib.sha256(blob).hexdigest().encode('ascii') != digest:
+        raise ValueError("Cache entry does not match its digest")
+    return blob
+
+# Remote cache backend speaking plain HTTP: GET <url>/<key> fetches and
+# PUT <url>/<key> stores an entry. Every hit is checked against its digest, and
+# network or verification failures count as misses (and are tallied in
+# errors) so that the caller falls back to compiling locally
+class HTTPCache():
+    def __init__(self, url, timeout=5):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.errors = 0
+
+    def get(self, key):
+        import http.client, urllib.request, urllib.error
+        try:
+            with urllib.request.urlopen(self.url + '/' + key, timeout=self.timeout) as r:
+                return decode_artifacts(unseal_blob(r.read()))
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                self.errors += 1
+            return None
+        except (OSError, ValueError, http.client.HTTPException):
+            self.errors += 1
+            return None
+
+    def put(self, key, artifacts):
+        import http.client, urllib.request
+        req = urllib.request.Request(self.url + '/' + key, method='PUT',
+                                     data=seal_blob(encode_artifacts(artifacts)),
+                                     headers={'Content-Type': 'application/octet-stream'})
+        try:
+            urllib.request.urlopen(req, timeout=self.timeout).close()
+        except (OSError, http.client.HTTPException):
+            self.errors += 1
+
+# Chains caches, eg. a local DiskCache in front of a shared HTTPCache. Hits in
+# a later cache are copied into the earlier ones, and stores go to all of them
+class TieredCache():
+    def __init__(self, caches):
+        self.caches = caches
+
+    def get(self, key):
+        for i, cache in enumerate(self.caches):
+            o = cache.get(key)
+            if o is not None:
+                for earlier in self.caches[:i]:
+                    earlier.put(key, o)
+                return o
+        return None
+
+    def put(self, key, artifacts):
+        for cache in self.caches:
+            cache.put(key, artifacts)
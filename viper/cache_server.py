@@ -0,0 +1,83 @@
+import argparse, http.server, socketserver
+from .cache import DiskCache, is_cache_key, seal_blob, unseal_blob
+
+# Minimal shared build cache: serves GET /<key> and PUT /<key> for
+# cache.HTTPCache clients out of a DiskCache directory. Uploads are checked
+# against their digest before being stored, and entries are resealed on the
+# way out so clients can verify them in turn
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    cache = None
+    max_entry_size = 16 * 2**20
+
+    def get_key(self):
+        key = self.path.strip('/')
+        if not is_cache_key(key):
+            self.send_error(400, "Malformed cache key")
+            return None
+        return key
+
+    def do_GET(self):
+        key = self.get_key()
+        if key is None:
+            return
+        blob = self.cache.get_blob(key)
+        if blob is None:
+            self.send_error(404)
+            return
+        body = seal_blob(blob)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        key = self.get_key()
+        if key is None:
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.max_entry_size:
+            self.send_error(413)
+            return
+        try:
+            blob = unseal_blob(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400, "Entry does not match its digest")
+            return
+        self.cache.put_blob(key, blob)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class CacheServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, path, max_size=1024 * 2**20, verbose=False):
+        handler = type('Handler', (CacheRequestHandler,), {'cache': DiskCache(path, max_size)})
+        self.verbose = verbose
+        http.server.HTTPServer.__init__(self, address, handler)
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Shared viper build cache server")
+    p.add_argument('dir', help="directory to keep cache entries in")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--max-size', type=int, default=1024, help="cache size bound, in MB")
+    p.add_argument('-v', '--verbose', action='store_true')
+    args = p.parse_args(argv)
+    server = CacheServer((args.host, args.port), args.dir, args.max_size * 2**20, args.verbose)
+    print('Serving viper build cache from %s at %s' % (args.dir, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
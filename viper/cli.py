@@ -0,0 +1,216 @@
+import argparse, json, os, sys, time
+from . import compiler_plugin, optimizer
+
+# Command-line compiler:
+#
+#   viper [-f bytecode,abi,...] [-o OUTDIR] [--jobs N] [--watch] PATH...
+#   viper serve [server options]     (see viper.server)
+#
+# Each path is a source file or a directory searched for *.vy and *.lll
+# files. *.lll files hold LLL text (see viper.lll_reader), which is compiled
+# as it is, without going through the frontend or the optimizer. The
+# selected outputs of each source are written as JSON to OUTDIR/<name>.json,
+# where name is the source's path relative to the directory it was found in,
+# or its filename if it was given as a file, without the extension. Without
+# OUTDIR, they are printed to stdout as one object keyed by filename. The
+# time taken by each file is reported on stderr, and with --optimizer-stats,
+# what each optimizer pass did
+
+# Output format name => artifact name
+FORMATS = {
+    'bytecode': 'bytecode',
+    'bytecode_runtime': 'runtime_bytecode',
+    'abi': 'abi',
+    'asm': 'assembly',
+    'gas': 'gas_estimates',
+}
+
+SOURCE_EXTENSIONS = ('.vy', '.lll')
+LLL_EXTENSIONS = ('.lll',)
+
+# Expands paths into the list of source files to compile
+def find_sources(paths):
+    o = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                o.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(SOURCE_EXTENSIONS))
+        else:
+            o.append(path)
+    return o
+
+# Output names of the sources in paths, by filename: the path of each
+# relative to the directory it was found in, or its basename if it was given
+# as a file, without the extension
+def get_output_names(paths):
+    o = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for fn in find_sources([path]):
+                o.setdefault(fn, os.path.splitext(os.path.relpath(fn, path))[0])
+        else:
+            o.setdefault(path, os.path.splitext(os.path.basename(path))[0])
+    return o
+
+# Output name => the sources that would be written to it, for those that
+# more than one source would be
+def get_collisions(names):
+    o = {}
+    for fn, name in names.items():
+        o.setdefault(os.path.normcase(name), []).append(fn)
+    return {name: sorted(fns) for name, fns in o.items() if len(fns) > 1}
+
+def read_source(filename):
+    with open(filename) as f:
+        return f.read()
+
+# Picks the requested outputs from a source's artifacts, as JSON-ready values
+def select_outputs(artifacts, formats):
+    o = {}
+    for fmt in formats:
+        v = artifacts[FORMATS[fmt]]
+        o[fmt] = '0x' + v.hex() if isinstance(v, bytes) else v
+    return o
+
+def output_filename(outdir, name):
+    return os.path.join(outdir, name + '.json')
+
+def write_output(outdir, name, o):
+    filename = output_filename(outdir, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(o, f, indent=4)
+        f.write('\n')
+
+def report(filename, seconds, error=None):
+    if error is None:
+        sys.stderr.write('%s: %.3fs\n' % (filename, seconds))
+    else:
+        sys.stderr.write('%s: %s: %s\n' % (filename, error.__class__.__name__, error))
+
+def is_lll_source(filename):
+    return filename.endswith(LLL_EXTENSIONS)
+
+def compile_file(compiler, filename):
+    if is_lll_source(filename):
+        return compiler_plugin.mk_lll_artifacts(read_source(filename))
+    return compiler.get_artifacts(read_source(filename))
+
+# Compiles filenames, yielding (filename, artifacts or exception, seconds).
+# Serially, seconds is the time taken by that file; with a pool of workers
+# the files are compiled concurrently, and seconds is the time since the
+# batch started at which the file was done. LLL files are quick to compile
+# and always compiled serially
+def compile_files(compiler, filenames, jobs=None):
+    if jobs and jobs > 1 and len(filenames) > 1:
+        for o in compile_files(compiler, [fn for fn in filenames if is_lll_source(fn)]):
+            yield o
+        t0 = time.time()
+        sources = ((fn, read_source(fn)) for fn in filenames if not is_lll_source(fn))
+        for fn, o in compiler.compile_many(sources, jobs=jobs):
+            yield fn, o, time.time() - t0
+    else:
+        for fn in filenames:
+            t0 = time.time()
+            try:
+                o = compile_file(compiler, fn)
+            except Exception as e:
+                o = e
+            yield fn, o, time.time() - t0
+
+# Compiles filenames and writes their outputs, under the output names in
+# names (by default, see get_output_names); returns the number of failures
+def build(compiler, filenames, formats, outdir=None, jobs=None, names=None):
+    names = names or get_output_names(filenames)
+    results, failures = {}, 0
+    for fn, o, seconds in compile_files(compiler, filenames, jobs):
+        if isinstance(o, Exception):
+            report(fn, seconds, o)
+            failures += 1
+            continue
+        report(fn, seconds)
+        if outdir is not None:
+            write_output(outdir, names[fn], select_outputs(o, formats))
+        else:
+            results[fn] = select_outputs(o, formats)
+    if outdir is None and results:
+        print(json.dumps({fn: results[fn] for fn in filenames if fn in results}, indent=4))
+    return failures
+
+def get_mtimes(paths):
+    o = {}
+    for fn in find_sources(paths):
+        try:
+            o[fn] = os.stat(fn).st_mtime
+        except FileNotFoundError:
+            pass
+    return o
+
+# Rebuilds the sources that were added or modified since the last poll, until
+# interrupted
+def watch(compiler, paths, formats, outdir=None, jobs=None, interval=0.5):
+    mtimes = get_mtimes(paths)
+    while True:
+        time.sleep(interval)
+        new_mtimes = get_mtimes(paths)
+        changed = [fn for fn, mtime in new_mtimes.items() if mtimes.get(fn) != mtime]
+        mtimes = new_mtimes
+        names = get_output_names(paths)
+        if outdir is not None:
+            for name, fns in get_collisions(names).items():
+                sys.stderr.write('%s: written by more than one source: %s\n' % (output_filename(outdir, name), ', '.join(fns)))
+                changed = [fn for fn in changed if fn not in fns]
+        if changed:
+            build(compiler, sorted(changed), formats, outdir, jobs, names)
+
+def parse_formats(s):
+    formats = [fmt.strip() for fmt in s.split(',') if fmt.strip()]
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise argparse.ArgumentTypeError("Unknown output format: %s (expecting %s)" % (fmt, ', '.join(sorted(FORMATS))))
+    return formats
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['serve']:
+        from . import server
+        return server.main(argv[1:])
+    p = argparse.ArgumentParser(prog='viper', description="Viper compiler")
+    p.add_argument('paths', nargs='+', help="source files, or directories to search for *.vy and *.lll files")
+    p.add_argument('-f', '--format', type=parse_formats, default=['bytecode', 'abi'],
+                   help="comma-separated outputs: %s (default: bytecode,abi)" % ', '.join(sorted(FORMATS)))
+    p.add_argument('-o', '--output-dir', default=None, help="write <name>.json per source here instead of to stdout")
+    p.add_argument('-j', '--jobs', type=int, default=None, help="compile this many files at once")
+    p.add_argument('--watch', action='store_true', help="after building, recompile files as they change")
+    p.add_argument('--cache-dir', default=None, help="on-disk artifact cache")
+    p.add_argument('--no-optimize', action='store_true', help="skip all optimizer passes")
+    p.add_argument('--disable-pass', action='append', default=[], metavar='NAME',
+                   help="skip this optimizer pass (one of: %s)" % ', '.join(optimizer.default_pipeline))
+    p.add_argument('--optimizer-stats', action='store_true',
+                   help="report time, node count, gas and code size changes of each optimizer pass (without --jobs)")
+    args = p.parse_args(argv)
+    for name in args.disable_pass:
+        if name not in optimizer.registry:
+            p.error("unknown optimizer pass: %s" % name)
+    names = get_output_names(args.paths)
+    if args.output_dir is not None:
+        for name, fns in get_collisions(names).items():
+            p.error("%s would be written by more than one source: %s" % (output_filename(args.output_dir, name), ', '.join(fns)))
+        os.makedirs(args.output_dir, exist_ok=True)
+    opt = optimizer.Optimizer([] if args.no_optimize else None, args.disable_pass, measure=args.optimizer_stats)
+    compiler = compiler_plugin.Compiler(cache_dir=args.cache_dir, optimizer=opt)
+    try:
+        failures = build(compiler, find_sources(args.paths), args.format, args.output_dir, args.jobs, names)
+        if args.optimizer_stats:
+            sys.stderr.write(opt.stats.report() + '\n')
+        if args.watch:
+            watch(compiler, args.paths, args.format, args.output_dir, args.jobs)
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        compiler.close()
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,138 +1,354 @@
 from .parser import LLLnode
-from .opcodes import opcodes, pseudo_opcodes
+from .opcodes import opcodes, opcode_names, opcode_records, num_real_opcodes
 
 def num_to_bytearray(x):
-    o = []
-    while x > 0:
-        o.insert(0, x % 256)
-        x //= 256
-    return o
+    if x <= 0:
+        return []
+    return list(x.to_bytes((x.bit_length() + 7) // 8, 'big'))
 
 PUSH_OFFSET = 0x5f
 DUP_OFFSET = 0x7f
 SWAP_OFFSET = 0x8f
 
-# Estimates gas consumption
-def gas_estimate(code, depth=0):
+# Estimates gas consumption. The tree is walked with an explicit stack rather
+# than recursively, so deep trees do not hit the recursion limit: each node is
+# first expanded into the (child, depth) pairs it needs estimates of (see
+# gas_estimate_args), and once those are done its own estimate is made out of
+# theirs (see gas_estimate_node)
+#
+# With dag (see dag_info), the estimate of each node that has several parents
+# is memoized
+def gas_estimate(code, depth=0, dag=None):
+    memo = {}
+    results = []
+    stack = [(code, depth, None)]
+    while stack:
+        node, depth, nargs = stack.pop()
+        if nargs is not None:
+            n = len(results) - nargs
+            results[n:] = [gas_estimate_node(node, depth, results[n:])]
+            if dag is not None and dag[id(node)][0] > 1:
+                memo[gas_memo_key(node, depth, dag)] = results[-1]
+        elif dag is not None and dag[id(node)][0] > 1 and gas_memo_key(node, depth, dag) in memo:
+            results.append(memo[gas_memo_key(node, depth, dag)])
+        elif isinstance(node.value, int):
+            results.append(3)
+        # Shortcut for opcodes applied to numbers, eg. (mload 64)
+        elif node.opcode is not None and all(isinstance(arg.value, int) for arg in node.args):
+            results.append(gas_estimate_node(node, depth, [3] * len(node.args)))
+        else:
+            args = gas_estimate_args(node, depth)
+            if args:
+                stack.append((node, depth, len(args)))
+                for arg, arg_depth in reversed(args):
+                    stack.append((arg, arg_depth, None))
+            else:
+                results.append(gas_estimate_node(node, depth, []))
+    return results[0]
+
+def gas_estimate_args(code, depth):
+    if isinstance(code.value, int):
+        return []
+    elif code.opcode is not None:
+        return [(c, depth + i) for i, c in enumerate(code.args[::-1])]
+    elif isinstance(code.value, str) and code.value == 'if':
+        if len(code.args) not in (2, 3):
+            raise Exception("If statement must have 2 or 3 child elements")
+        return [(c, depth + 1) for c in code.args]
+    elif isinstance(code.value, str) and code.value == 'with':
+        return [(code.args[1], depth + 1), (code.args[2], depth + 1)]
+    elif isinstance(code.value, str) and code.value == 'repeat':
+        return [(code.args[2], depth + 1)]
+    elif isinstance(code.value, str) and code.value == 'seq':
+        return [(c, depth + 1) for c in code.args]
+    elif isinstance(code.value, str):
+        return []
+    else:
+        raise Exception("Gas estimate failed: "+repr(code))
+
+def gas_estimate_node(code, depth, args_gas):
     if isinstance(code.value, int):
         return 3
-    elif isinstance(code.value, str) and (code.value.upper() in opcodes or code.value.upper() in pseudo_opcodes):
-        decl = opcodes.get(code.value.upper(), pseudo_opcodes.get(code.value.upper(), None))
-        o = sum([gas_estimate(c, depth + i) for i, c in enumerate(code.args[::-1])]) + decl[3]
+    elif code.opcode is not None:
+        name = opcode_names[code.opcode]
+        o = sum(args_gas) + opcode_records[code.opcode][3]
         # Dynamic gas costs
-        if code.value.upper() == 'CALL' and code.args[2].value != 0:
+        if name == 'CALL' and code.args[2].value != 0:
             o += 34000
-        if code.value.upper() == 'SSTORE' and code.args[1].value != 0:
+        if name == 'SSTORE' and code.args[1].value != 0:
             o += 15000
-        if code.value.upper() in ('SUICIDE', 'SELFDESTRUCT'):
+        if name in ('SUICIDE', 'SELFDESTRUCT'):
             o += 25000
-        if code.value.upper() == 'BREAK':
+        if name == 'BREAK':
             o += opcodes['POP'][3] * depth
         return o
-    elif isinstance(code.value, str) and code.value == 'if':
+    elif code.value == 'if':
         if (len(code.args) == 2):
-            return gas_estimate(code.args[0], depth + 1) + gas_estimate(code.args[1], depth + 1) + 17
-        elif (len(code.args) == 3):
-            return gas_estimate(code.args[0], depth + 1) + max(gas_estimate(code.args[1], depth + 1), gas_estimate(code.args[2], depth + 1))+ 31
+            return args_gas[0] + args_gas[1] + 17
         else:
-            raise Exception("If statement must have 2 or 3 child elements")
-    elif isinstance(code.value, str) and code.value == 'with':
-        return gas_estimate(code.args[1], depth + 1) + gas_estimate(code.args[2], depth + 1) + 5
-    elif isinstance(code.value, str) and code.value == 'repeat':
-        return (gas_estimate(code.args[2], depth + 1) + 50) * code.args[0].value + 30
-    elif isinstance(code.value, str) and code.value == 'seq':
-        return sum([gas_estimate(c, depth + 1) for c in code.args])
-    elif isinstance(code.value, str):
-        return 3
+            return args_gas[0] + max(args_gas[1], args_gas[2]) + 31
+    elif code.value == 'with':
+        return args_gas[0] + args_gas[1] + 5
+    elif code.value == 'repeat':
+        return (args_gas[0] + 50) * code.args[0].value + 30
+    elif code.value == 'seq':
+        return sum(args_gas)
     else:
-        raise Exception("Gas estimate failed: "+repr(code))
+        return 3
+
+# Only the gas of breaks depends on their depth
+def gas_memo_key(node, depth, dag):
+    return (id(node), depth) if dag[id(node)][3] else id(node)
+
+# Statements that allocate jump labels
+LABEL_STATEMENTS = ('if', 'repeat', 'lll')
+
+# Works out, for every node of a DAG (eg. from parser.LLLInterner), keyed by
+# id: (number of references from parents, sorted tuple of its free
+# with-variables, whether it allocates or jumps to labels, whether it breaks)
+def dag_info(code):
+    info = {}
+    refs = {id(code): 1}
+    stack = [(code, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            if id(node) in info:
+                continue
+            info[id(node)] = None
+            for arg in node.args:
+                refs[id(arg)] = refs.get(id(arg), 0) + 1
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in node.args if id(arg) not in info)
+            continue
+        args = [info[id(arg)] for arg in node.args]
+        if node.value == 'with':
+            free = set(args[1][1]) | (set(args[2][1]) - {node.args[0].value})
+        elif isinstance(node.value, str) and node.opcode is None and not node.args and \
+                node.value not in LABEL_STATEMENTS + ('with', 'seq', 'multi'):
+            free = {node.value}
+        else:
+            free = set().union(*[arg[1] for arg in args])
+        breaks = node.opcode is not None and opcode_names[node.opcode] == 'BREAK' or any(arg[3] for arg in args)
+        labels = breaks or node.value in LABEL_STATEMENTS or any(arg[2] for arg in args)
+        info[id(node)] = [0, tuple(sorted(free)), labels, breaks]
+    for k, v in info.items():
+        v[0] = refs[k]
+    return info
+
+# DAG-aware gas estimate and compilation, for LLL whose identical subtrees are
+# shared (see parser.LLLInterner): the result of each shared node is worked out
+# once and reused wherever the node appears in the same context
+def gas_estimate_dag(code, depth=0):
+    return gas_estimate(code, depth, dag_info(code))
 
-next_symbol = [0]
+def compile_dag_to_assembly(code, withargs=None, break_dest=None, height=0, symbols=None):
+    return compile_to_assembly(code, withargs, break_dest, height, symbols, dag_info(code))
 
-def mksymbol():
-    next_symbol[0] += 1
-    return '_sym_'+str(next_symbol[0])
+# Allocates a new jump label. Labels are numbered per compilation (symbols is
+# the counter of the compilation at hand), so the same code always compiles
+# to the same assembly and concurrent compilations do not interfere
+def mksymbol(symbols):
+    symbols[0] += 1
+    return '_sym_'+str(symbols[0])
 
 def is_symbol(i):
     return isinstance(i, str) and i[:5] == '_sym_'
 
-# Compiles LLL to assembly
-def compile_to_assembly(code, withargs={}, break_dest=None, height=0):
-    # Opcodes
-    if isinstance(code.value, str) and code.value.upper() in opcodes:
-        o = []
-        for i, c in enumerate(code.args[::-1]):
-            o.extend(compile_to_assembly(c, withargs, break_dest, height + i))
-        o.append(code.value.upper())
-        return o
-    # Numbers
-    elif isinstance(code.value, int):
-        if code.value <= -2**255:
-            raise Exception("Value too low: %d" % code.value)
-        elif code.value >= 2**256:
-            raise Exception("Value too high: %d" % code.value)
-        bytez = num_to_bytearray(code.value % 2**256) or [0]
-        return ['PUSH'+str(len(bytez))] + bytez
-    # Variables connected to with statements
-    elif isinstance(code.value, str) and code.value in withargs:
-        if height - withargs[code.value] > 16:
-            raise Exception("With statement too deep")
-        return ['DUP'+str(height - withargs[code.value])]
-    # Pass statements
-    elif code.value == 'pass':
-        return []
+# Compiles LLL to assembly. Rather than recursing, the tree is walked with an
+# explicit stack of work items, which all write to one output list:
+#   (node, withargs, break_dest, height, out): compiles a node into out
+#   (out, items): appends fixed items, eg. an opcode once its arguments
+#     are compiled
+#   a generator from compile_statement: resumed once the child it asked for
+#     last has been compiled
+#   (key, out, start): memoizes what a node compiled to (out[start:])
+#
+# With dag (see dag_info), the output of each node that has several parents
+# and uses no labels is memoized, keyed by the stack offsets of its free
+# variables, and reused
+def compile_to_assembly(code, withargs=None, break_dest=None, height=0, symbols=None, dag=None):
+    if withargs is None:
+        withargs = {}
+    if symbols is None:
+        symbols = [0]
+    memo = {}
+    o = []
+    stack = [(code, withargs, break_dest, height, o)]
+    while stack:
+        task = stack.pop()
+        if type(task) is not tuple:
+            child = next(task, None)
+            if child is not None:
+                stack.append(task)
+                stack.append(child)
+            continue
+        if len(task) == 2:
+            task[0].extend(task[1])
+            continue
+        if len(task) == 3:
+            memo[task[0]] = task[1][task[2]:]
+            continue
+        code, withargs, break_dest, height, out = task
+        # Nodes made during compilation (eg. by expanding sle) are not in dag
+        if dag is not None and id(code) in dag:
+            refs, free, labels, breaks = dag[id(code)]
+            if refs > 1 and not labels:
+                key = (id(code),) + tuple([height - withargs[v] if v in withargs else None for v in free])
+                if key in memo:
+                    out.extend(memo[key])
+                    continue
+                stack.append((key, out, len(out)))
+        # Opcodes; the arguments are compiled last to first
+        if code.opcode is not None and code.opcode < num_real_opcodes:
+            # Shortcut for opcodes applied to numbers, eg. (mload 64)
+            if all(isinstance(c.value, int) for c in code.args):
+                for c in code.args[::-1]:
+                    compile_number(c.value, out)
+                out.append(opcode_names[code.opcode])
+                continue
+            stack.append((out, (opcode_names[code.opcode],)))
+            n = len(code.args)
+            for j, c in enumerate(code.args):
+                stack.append((c, withargs, break_dest, height + n - 1 - j, out))
+        # Numbers
+        elif isinstance(code.value, int):
+            compile_number(code.value, out)
+        # Variables connected to with statements
+        elif isinstance(code.value, str) and code.value in withargs:
+            if height - withargs[code.value] > 16:
+                raise Exception("With statement too deep")
+            out.append('DUP'+str(height - withargs[code.value]))
+        # Pass statements
+        elif code.value == 'pass':
+            pass
+        # Seq (used to piece together multiple statements)
+        elif code.value == 'seq':
+            # By position: in a DAG the last statement may also appear earlier
+            for i in reversed(range(len(code.args))):
+                arg = code.args[i]
+                if arg.valency == 1 and i != len(code.args) - 1:
+                    stack.append((out, ('POP',)))
+                stack.append((arg, withargs, break_dest, height, out))
+        # Assert (if false, exit)
+        elif code.value == 'assert':
+            stack.append((out, ('ISZERO', 'PC', 'JUMPI')))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # Unsigned clamp, check less-than
+        elif code.value == 'uclamplt':
+            if isinstance(code.args[0].value, int) and isinstance(code.args[1].value, int):
+                if 0 <= code.args[0].value < code.args[1].value:
+                    stack.append((code.args[0], withargs, break_dest, height, out))
+                else:
+                    out.append('INVALID')
+                continue
+            # Stack: num num bound
+            stack.append((out, ('DUP2', 'LT', 'ISZERO', 'PC', 'JUMPI')))
+            stack.append((code.args[1], withargs, break_dest, height + 1, out))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # Signed clamp, check against upper and lower bounds
+        elif code.value == 'clamp':
+            stack.append((out, ('SWAP1', 'SGT', 'PC', 'JUMPI', 'DUP1', 'SWAP2', 'SWAP1', 'SLT', 'PC', 'JUMPI')))
+            stack.append((code.args[2], withargs, break_dest, height + 2, out))
+            stack.append((out, ('DUP1',)))
+            stack.append((code.args[1], withargs, break_dest, height + 1, out))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # Checks that a value is nonzero
+        elif code.value == 'clamp_nonzero':
+            stack.append((out, ('DUP1', 'ISZERO', 'PC', 'JUMPI')))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # SHA3 a single value
+        elif code.value == 'sha3_32':
+            stack.append((out, ('PUSH1', 192, 'MSTORE', 'PUSH1', 192, 'PUSH1', 32, 'SHA3')))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # SHA3 two values, eg. a mapping's slot and a key
+        elif code.value == 'sha3_64':
+            stack.append((out, ('PUSH1', 224, 'MSTORE', 'PUSH1', 192, 'MSTORE', 'PUSH1', 64, 'PUSH1', 192, 'SHA3')))
+            stack.append((code.args[1], withargs, break_dest, height + 1, out))
+            stack.append((code.args[0], withargs, break_dest, height, out))
+        # <= operator
+        elif code.value == 'sle':
+            stack.append((LLLnode.from_list(['iszero', ['sgt', code.args[0], code.args[1]]], validate=False),
+                          withargs, break_dest, height, out))
+        # >= operator
+        elif code.value == 'sge':
+            stack.append((LLLnode.from_list(['iszero', ['slt', code.args[0], code.args[1]]], validate=False),
+                          withargs, break_dest, height, out))
+        # eg. 95 -> 96, 96 -> 96, 97 -> 128
+        elif code.value == "ceil32":
+            stack.append((LLLnode.from_list(['with', '_val', code.args[0],
+                                                ['sub', ['add', '_val', 31],
+                                                        ['mod', ['sub', '_val', 1], 32]]], validate=False),
+                          withargs, break_dest, height, out))
+        else:
+            statement = compile_statement(code, withargs, break_dest, height, out, symbols)
+            child = next(statement, None)
+            if child is not None:
+                stack.append(statement)
+                stack.append(child)
+    return o
+
+MIN_NUMBER = -2**255
+MAX_NUMBER = 2**256
+
+def compile_number(value, o):
+    if value <= MIN_NUMBER:
+        raise Exception("Value too low: %d" % value)
+    elif value >= MAX_NUMBER:
+        raise Exception("Value too high: %d" % value)
+    bytez = num_to_bytearray(value % MAX_NUMBER) or [0]
+    o.append('PUSH'+str(len(bytez)))
+    o.extend(bytez)
+
+# Compiles the statements that allocate jump labels or bind variables, writing
+# to o. Each child to be compiled is yielded as (node, withargs, break_dest,
+# height, out), and compile_to_assembly resumes the generator once it is done
+def compile_statement(code, withargs, break_dest, height, o, symbols):
     # If statements (2 arguments, ie. if x: y)
-    elif code.value == 'if' and len(code.args) == 2:
-        o = []
-        o.extend(compile_to_assembly(code.args[0], withargs, break_dest, height))
-        end_symbol = mksymbol()
+    if code.value == 'if' and len(code.args) == 2:
+        yield code.args[0], withargs, break_dest, height, o
+        end_symbol = mksymbol(symbols)
         o.extend(['ISZERO', end_symbol, 'JUMPI'])
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height))
+        yield code.args[1], withargs, break_dest, height, o
         o.extend([end_symbol, 'JUMPDEST'])
-        return o
     # If statements (3 arguments, ie. if x: y, else: z)
     elif code.value == 'if' and len(code.args) == 3:
-        o = []
-        o.extend(compile_to_assembly(code.args[0], withargs, break_dest, height))
-        mid_symbol = mksymbol()
-        end_symbol = mksymbol()
+        yield code.args[0], withargs, break_dest, height, o
+        mid_symbol = mksymbol(symbols)
+        end_symbol = mksymbol(symbols)
         o.extend(['ISZERO', mid_symbol, 'JUMPI'])
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height))
+        yield code.args[1], withargs, break_dest, height, o
         o.extend([end_symbol, 'JUMP', mid_symbol, 'JUMPDEST'])
-        o.extend(compile_to_assembly(code.args[2], withargs, break_dest, height))
+        yield code.args[2], withargs, break_dest, height, o
         o.extend([end_symbol, 'JUMPDEST'])
-        return o
     # Repeat statements (compiled from for loops)
     # Repeat(memloc, start, rounds, body)
     elif code.value == 'repeat':
-        o = []
         loops = num_to_bytearray(code.args[2].value) or [2]
-        start, end = mksymbol(), mksymbol()
-        o.extend(compile_to_assembly(code.args[0]))
-        o.extend(compile_to_assembly(code.args[1]))
+        start, end = mksymbol(symbols), mksymbol(symbols)
+        yield code.args[0], {}, None, 0, o
+        yield code.args[1], {}, None, 0, o
         o.extend(['PUSH'+str(len(loops))] + loops)
         # stack: memloc, startvalue, rounds
         o.extend(['DUP2', 'DUP4', 'MSTORE', 'ADD', start, 'JUMPDEST'])
         # stack: memloc, exit_index
-        o.extend(compile_to_assembly(code.args[3], withargs, (end, height + 1), height + 1))
+        yield code.args[3], withargs, (end, height + 1), height + 1, o
         # stack: memloc, exit_index
         o.extend(['DUP2', 'MLOAD', 'PUSH1', 1, 'ADD', 'DUP1', 'DUP4', 'MSTORE'])
         # stack: len(loops), index memory address, new index
         o.extend(['DUP2', 'EQ', 'ISZERO', start, 'JUMPI', end, 'JUMPDEST', 'POP', 'POP'])
-        return o
     # Break from inside a for loop
     elif code.value == 'break':
         if not break_dest:
             raise Exception("Invalid break")
         dest, break_height = break_dest
-        return ['POP'] * (height - break_height) + [dest, 'JUMP']
+        o.extend(['POP'] * (height - break_height) + [dest, 'JUMP'])
     # With statements
     elif code.value == 'with':
-        o = []
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height))
+        yield code.args[1], withargs, break_dest, height, o
         old = withargs.get(code.args[0].value, None)
         withargs[code.args[0].value] = height
-        o.extend(compile_to_assembly(code.args[2], withargs, break_dest, height + 1))
+        yield code.args[2], withargs, break_dest, height + 1, o
         if code.args[2].valency:
             o.extend(['SWAP1', 'POP'])
         else:
@@ -141,78 +357,62 @@ def compile_to_assembly(code, withargs={}, break_dest=None, height=0):
             withargs[code.args[0].value] = old
         else:
             del withargs[code.args[0].value]
-        return o
     # LLL statement (used to contain code inside code)
     elif code.value == 'lll':
-        o = []
-        begincode = mksymbol()
-        endcode = mksymbol()
+        begincode = mksymbol(symbols)
+        endcode = mksymbol(symbols)
         o.extend([endcode, 'JUMP', begincode, 'BLANK'])
-        o.append(compile_to_assembly(code.args[0], {}, None, 0)) # Append is intentional
+        inner = []
+        o.append(inner) # Append is intentional
+        yield code.args[0], {}, None, 0, inner
         o.extend([endcode, 'JUMPDEST', begincode, endcode, 'SUB', begincode])
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height))
+        yield code.args[1], withargs, break_dest, height, o
         o.extend(['CODECOPY', begincode, endcode, 'SUB'])
-        return o
-    # Seq (used to piece together multiple statements)
-    elif code.value == 'seq':
-        o = []
-        for arg in code.args:
-            o.extend(compile_to_assembly(arg, withargs, break_dest, height))
-            if arg.valency == 1 and arg != code.args[-1]:
-                print(arg, 'sss')
-                o.append('POP')
-        return o
-    # Assert (if false, exit)
-    elif code.value == 'assert':
-        o = compile_to_assembly(code.args[0], withargs, break_dest, height)
-        o.extend(['ISZERO', 'PC', 'JUMPI'])
-        return o
-    # Unsigned clamp, check less-than
-    elif code.value == 'uclamplt':
-        if isinstance(code.args[0].value, int) and isinstance(code.args[1].value, int):
-            if 0 <= code.args[0].value < code.args[1].value:
-                return compile_to_assembly(code.args[0], withargs, break_dest, height)
-            else:
-                return ['INVALID']
-        o = compile_to_assembly(code.args[0], withargs, break_dest, height)
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height + 1))
-        o.extend(['DUP2'])
-        # Stack: num num bound
-        o.extend(['LT', 'ISZERO', 'PC', 'JUMPI'])
-        return o
-    # Signed clamp, check against upper and lower bounds
-    elif code.value == 'clamp':
-        o = compile_to_assembly(code.args[0], withargs, break_dest, height)
-        o.extend(compile_to_assembly(code.args[1], withargs, break_dest, height + 1))
-        o.extend(['DUP1'])
-        o.extend(compile_to_assembly(code.args[2], withargs, break_dest, height + 2))
-        o.extend(['SWAP1', 'SGT', 'PC', 'JUMPI'])
-        o.extend(['DUP1', 'SWAP2', 'SWAP1', 'SLT', 'PC', 'JUMPI'])
-        return o
-    # Checks that a value is nonzero
-    elif code.value == 'clamp_nonzero':
-        o = compile_to_assembly(code.args[0], withargs, break_dest, height)
-        o.extend(['DUP1', 'ISZERO', 'PC', 'JUMPI'])
-        return o
-    # SHA3 a single value
-    elif code.value == 'sha3_32':
-        o = compile_to_assembly(code.args[0], withargs, break_dest, height)
-        o.extend(['PUSH1', 192, 'MSTORE', 'PUSH1', 192, 'PUSH1', 32, 'SHA3'])
-        return o
-    # <= operator
-    elif code.value == 'sle':
-        return compile_to_assembly(LLLnode.from_list(['iszero', ['sgt', code.args[0], code.args[1]]]), withargs, break_dest, height)
-    # >= operator
-    elif code.value == 'sge':
-        return compile_to_assembly(LLLnode.from_list(['iszero', ['slt', code.args[0], code.args[1]]]), withargs, break_dest, height)
-    # eg. 95 -> 96, 96 -> 96, 97 -> 128
-    elif code.value == "ceil32":
-        return compile_to_assembly(LLLnode.from_list(['with', '_val', code.args[0],
-                                                        ['sub', ['add', '_val', 31],
-                                                                ['mod', ['sub', '_val', 1], 32]]]), withargs, break_dest, height)
     else:
         raise Exception("Weird code element: "+repr(code))
 
+# Opcodes after which the next instruction can only be reached by a jump
+TERMINATORS = ('JUMP', 'RETURN', 'STOP', 'INVALID', 'SUICIDE', 'SELFDESTRUCT')
+
+def is_label(assembly, i):
+    return is_symbol(assembly[i]) and i + 1 < len(assembly) and assembly[i + 1] in ('JUMPDEST', 'BLANK')
+
+# Drops the instructions of an assembly that no path reaches, ie. those
+# between a terminator and the next label, and the labels no jump or push
+# refers to, until there are none left, and does the same in the nested
+# assemblies of lll statements. Counts what it dropped in counters
+def eliminate_unreachable(assembly, counters=None):
+    if counters is None:
+        counters = {}
+    while True:
+        referenced = set(item for i, item in enumerate(assembly) if is_symbol(item) and not is_label(assembly, i))
+        o = []
+        reachable = True
+        i = 0
+        while i < len(assembly):
+            item = assembly[i]
+            if is_label(assembly, i):
+                if assembly[i + 1] == 'JUMPDEST' and item not in referenced:
+                    counters['labels_dropped'] = counters.get('labels_dropped', 0) + 1
+                else:
+                    o.extend(assembly[i:i + 2])
+                    reachable = True
+                i += 2
+                continue
+            # Push data goes with its push
+            n = int(item[4:]) + 1 if isinstance(item, str) and item[:4] == 'PUSH' else 1
+            if isinstance(item, list):
+                o.append(eliminate_unreachable(item, counters))
+            elif reachable:
+                o.extend(assembly[i:i + n])
+                reachable = item not in TERMINATORS
+            else:
+                counters['instructions_dropped'] = counters.get('instructions_dropped', 0) + 1
+            i += n
+        if len(o) == len(assembly):
+            return o
+        assembly = o
+
 # Assembles assembly into EVM
 def assembly_to_evm(assembly):
     posmap = {}
@@ -1,29 +1,242 @@
+import functools, os
 from . import parser
 from . import compile_lll
 
 def memsize_to_gas(memsize):
     return (memsize // 32) * 3 + (memsize // 32) ** 2 // 512
 
-initial_gas = compile_lll.gas_estimate(parser.mk_initial())
-function_gas = compile_lll.gas_estimate(parser.parse_func(parser.parse('def foo(): pass')[0], {}))
+# Gas used by the contract header, and by the dispatch check of each function
+# that comes before the one being called. Worked out on first use rather than
+# at import time
+@functools.lru_cache(maxsize=None)
+def get_initial_gas():
+    return compile_lll.gas_estimate(parser.mk_initial())
 
+@functools.lru_cache(maxsize=None)
+def get_function_gas():
+    return compile_lll.gas_estimate(parser.parse_func(parser.parse('def foo(): pass')[0], {}))
+
+# Returns optimizer, or if it is None an optimizer.Optimizer running the
+# default pipeline. The optimizer module is only imported here, so callers
+# that never optimize don't pay for loading it
+def get_optimizer(optimizer=None):
+    if optimizer is None:
+        from .optimizer import Optimizer
+        optimizer = Optimizer()
+    return optimizer
+
+# Lowers the functions of a source and optimizes their LLL with optimizer
+# (by default, an optimizer.Optimizer running the default pipeline). Returns
+# the function definitions, their signatures and their (lll, varz)
+def lower_functions(code, executor=None, optimizer=None):
+    _defs, _globals = parser.get_defs_and_globals(parser.parse(code))
+    sigs = parser.mk_signature_table(_defs)
+    lowered = parser.parse_funcs(_defs, _globals, parser.function_cache, executor, sigs)
+    optimizer = get_optimizer(optimizer)
+    return _defs, sigs, [(optimizer.optimize(lll), varz) for lll, varz in lowered]
+
+def mk_bytecode(code, executor=None, optimizer=None):
+    optimizer = get_optimizer(optimizer)
+    _defs, sigs, lowered = lower_functions(code, executor, optimizer)
+    lll = parser.mk_contract_lll(_defs, [lll for lll, varz in lowered])
+    return compile_lll.assembly_to_evm(optimizer.optimize_assembly(compile_lll.compile_to_assembly(lll)))
+
+# Gas estimate of a function from its LLL and memory layout; index is the
+# position of the function in the contract. With dag, the LLL may share
+# subtrees (see parser.LLLInterner)
+def mk_function_gas_estimate(lll, varz, index, dag=False):
+    gascost = (compile_lll.gas_estimate_dag(lll) if dag else compile_lll.gas_estimate(lll)) + get_initial_gas()
+    return gascost + memsize_to_gas(varz.get("_next_mem", parser.RESERVED_MEMORY)) + get_function_gas() * index
+
+def mk_gas_estimates(code, optimizer=None):
+    _defs, sigs, lowered = lower_functions(code, optimizer=optimizer)
+    return {_def.name: mk_function_gas_estimate(lll, varz, i) for i, (_def, (lll, varz)) in enumerate(zip(_defs, lowered))}
+
+# Compiles a source in a single pass through the frontend and the optimizer,
+# returning the bytecode, runtime bytecode, ABI, assembly and per-function gas
+# estimates. With share, identical LLL subtrees are shared within and between
+# functions, which takes less memory on big contracts; the output is the same
+def mk_artifacts(code, executor=None, share=False, optimizer=None):
+    optimizer = get_optimizer(optimizer)
+    _defs, sigs, lowered = lower_functions(code, executor, optimizer)
+    if share:
+        interner = parser.LLLInterner()
+        lowered = [(interner.intern(lll), varz) for lll, varz in lowered]
+        contract = interner.intern(parser.mk_contract_lll(_defs, [lll for lll, varz in lowered]))
+        assembly = compile_lll.compile_dag_to_assembly(contract)
+    else:
+        assembly = compile_lll.compile_to_assembly(parser.mk_contract_lll(_defs, [lll for lll, varz in lowered]))
+    assembly = optimizer.optimize_assembly(assembly)
+    bytecode, runtime_bytecode = assemble(assembly)
+    return {
+        'bytecode': bytecode,
+        'runtime_bytecode': runtime_bytecode,
+        'abi': parser.mk_full_signature_from_defs(_defs, sigs),
+        'assembly': assembly,
+        'gas_estimates': {_def.name: mk_function_gas_estimate(lll, varz, i, share)
+                          for i, (_def, (lll, varz)) in enumerate(zip(_defs, lowered))},
+    }
+
+# Returns the deployment and runtime bytecode of an assembly
+def assemble(assembly):
+    # The runtime code is the only sub-assembly of the deployment code
+    runtime = [item for item in assembly if isinstance(item, list)]
+    return compile_lll.assembly_to_evm(assembly), compile_lll.assembly_to_evm(runtime[0]) if runtime else b''
+
+# Compiles LLL text (see lll_reader) as it is, skipping the frontend and the
+# optimizer. The artifacts are those of mk_artifacts, with an empty ABI and
+# no gas estimates as there are no functions
+def mk_lll_artifacts(code):
+    from . import lll_reader
+    assembly = compile_lll.compile_to_assembly(lll_reader.parse_lll(code))
+    bytecode, runtime_bytecode = assemble(assembly)
+    return {
+        'bytecode': bytecode,
+        'runtime_bytecode': runtime_bytecode,
+        'abi': [],
+        'assembly': assembly,
+        'gas_estimates': {},
+    }
+
+# Compiles one source of a batch; returns (name, artifacts) or, if the
+# compilation failed, (name, exception)
+def compile_worker(name, code, optimizer=None):
+    try:
+        return name, mk_artifacts(code, optimizer=optimizer)
+    except Exception as e:
+        return name, e
+
+# Names the sources given to compile_many: a dict of name => source, an
+# iterable of (name, source) pairs, or an iterable of sources (named by index)
+def iter_named_sources(sources):
+    if isinstance(sources, dict):
+        sources = sources.items()
+    for i, item in enumerate(sources):
+        if isinstance(item, str):
+            yield i, item
+        else:
+            yield item
+
+# Compiler plugin, as used by pyethereum's tester. If cache_dir is given (or
+# the VIPER_CACHE_DIR environment variable is set), the bytecode, ABI and gas
+# estimates of each compiled source are kept in an on-disk cache of at most
+# cache_size bytes (default VIPER_CACHE_SIZE, or 256 MB). If cache_url (or
+# VIPER_CACHE_URL) points at a shared cache server, artifacts are also fetched
+# from and uploaded to it; a custom cache backend can be passed as cache.
+# With jobs > 1, functions are lowered in parallel on a pool of that many
+# worker processes, started on first use. LLL is optimized with optimizer (by
+# default the default pipeline of optimizer.Optimizer), whose stats add up
+# over everything compiled in this process
 class Compiler():
+    def __init__(self, cache_dir=None, cache_size=None, cache_url=None, cache=None, jobs=None, optimizer=None):
+        cache_dir = cache_dir or os.environ.get('VIPER_CACHE_DIR')
+        cache_size = cache_size or int(os.environ.get('VIPER_CACHE_SIZE', 256 * 2**20))
+        cache_url = cache_url or os.environ.get('VIPER_CACHE_URL')
+        caches = [cache] if cache else []
+        if cache_dir or cache_url:
+            from .cache import DiskCache, HTTPCache, TieredCache
+        if cache_dir:
+            caches.append(DiskCache(cache_dir, cache_size))
+        if cache_url:
+            caches.append(HTTPCache(cache_url))
+        self.cache = caches[0] if len(caches) == 1 else TieredCache(caches) if caches else None
+        self.jobs = jobs
+        self.pool = None
+        self.optimizer = get_optimizer(optimizer)
+
+    # Process pool for parallel lowering, or None if running serially
+    @property
+    def executor(self):
+        if self.pool is None and self.jobs and self.jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(self.jobs)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
     def compile(self, code, *args, **kwargs):
-        lll = parser.parse_tree_to_lll(parser.parse(code))
-        return compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lll))
+        if self.cache:
+            return self.get_artifacts(code, **kwargs)['bytecode']
+        return mk_bytecode(code, self.executor, self.optimizer)
 
     def mk_full_signature(self, code, *args, **kwargs):
-        o = parser.mk_full_signature(parser.parse(code))
-        return o
+        if self.cache:
+            return self.get_artifacts(code, **kwargs)['abi']
+        return parser.mk_full_signature(parser.parse(code))
 
     def gas_estimate(self, code, *args, **kwargs):
-        code = parser.parse(code)
-        _defs, _globals = parser.get_defs_and_globals(code)
-        o = {}
-        for i, _def in enumerate(_defs):
-            name, args, output_type, const, sig, method_id = parser.get_func_details(_def)
-            varz = {}
-            kode = parser.parse_func(_def, _globals, varz)
-            gascost = compile_lll.gas_estimate(kode) + initial_gas
-            o[name] = gascost + memsize_to_gas(varz.get("_next_mem", parser.RESERVED_MEMORY)) + function_gas * i
+        if self.cache:
+            return self.get_artifacts(code, **kwargs)['gas_estimates']
+        return mk_gas_estimates(code, self.optimizer)
+
+    # Compiles many sources on a pool of worker processes (this compiler's pool
+    # if it has one, otherwise a pool of jobs or os.cpu_count() workers),
+    # yielding (name, artifacts) or (name, exception) for each source as soon
+    # as it is done. At most a few sources per worker are read ahead from the
+    # input, so sources can be a lazy iterator. Optimizer stats of sources
+    # compiled on worker processes are not collected
+    def compile_many(self, sources, jobs=None, **kwargs):
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        own_pool = self.executor is None
+        workers = (jobs or os.cpu_count()) if own_pool else self.jobs
+        pool = ProcessPoolExecutor(workers) if own_pool else self.executor
+        window = 2 * workers
+        pending = {}
+        try:
+            sources = iter_named_sources(sources)
+            exhausted = False
+            while not exhausted or pending:
+                while not exhausted and len(pending) < window:
+                    try:
+                        name, code = next(sources)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    key = self.cache_key(code, kwargs) if self.cache else None
+                    o = self.cache.get(key) if self.cache else None
+                    if o is not None:
+                        yield name, o
+                    else:
+                        pending[pool.submit(compile_worker, name, code, self.optimizer)] = (name, key)
+                if not pending:
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, key = pending.pop(future)
+                    try:
+                        name, o = future.result()
+                    except Exception as e:
+                        o = e
+                    if self.cache and not isinstance(o, Exception):
+                        self.cache.put(key, o)
+                    yield name, o
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_pool:
+                pool.shutdown()
+
+    # Returns all artifacts of a source (see mk_artifacts), going through the
+    # cache if there is one
+    def get_artifacts(self, code, **kwargs):
+        if not self.cache:
+            return mk_artifacts(code, self.executor, optimizer=self.optimizer)
+        key = self.cache_key(code, kwargs)
+        o = self.cache.get(key)
+        if o is None:
+            o = mk_artifacts(code, self.executor, optimizer=self.optimizer)
+            self.cache.put(key, o)
         return o
+
+    # Cache key of a source. The default optimizer pipeline is covered by the
+    # compiler fingerprint, any other one goes into the key
+    def cache_key(self, code, options):
+        from .cache import mk_cache_key
+        from .optimizer import default_pipeline
+        passes = self.optimizer.enabled_passes
+        if passes != default_pipeline:
+            options = dict(options, optimizer_passes=passes)
+        return mk_cache_key(code, options)
@@ -0,0 +1,151 @@
+import ast, re
+from .parser import LLLnode
+from .types import NullType
+
+# Reads LLL written as text into LLLnode trees, and writes trees back out. Two
+# notations are accepted, and can be mixed:
+#
+#   s-expressions:     (seq (mstore 0 (calldataload 4)) (return 0 32))
+#   LLLnode.repr():    ['seq', ['mstore', 0, ['calldataload', 4]], ['return', 0, 32]]
+#
+# Lists are delimited by parentheses or square brackets, and atoms separated
+# by whitespace or commas. Atoms are decimal or 0x-prefixed hex integers,
+# None (the null value), quoted strings, or bare words, which are strings.
+# A ; starts a comment that runs to the end of the line. A list is a node
+# whose value is its first atom and whose arguments are the rest, and an atom
+# on its own is a node without arguments, so that reading the text of a
+# node gives back a node with the same to_list(). Text is read in a single
+# pass, with an explicit stack rather than recursion, so reading takes time
+# linear in its length however deeply nested the LLL is
+
+class LLLSyntaxException(Exception):
+    pass
+
+TOKEN = re.compile(r'''
+    (?P<space>[\s,]+|;[^\n]*)
+    |(?P<open>[(\[])
+    |(?P<close>[)\]])
+    |(?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+    |(?P<atom>[^\s,;()\[\]'"]+)
+''', re.VERBOSE)
+
+INTEGER = re.compile(r'-?(0x[0-9a-fA-F]+|[0-9]+)$')
+
+# Words that can be written without quotes: not numbers, None or anything
+# containing a delimiter
+BARE_WORD = re.compile(r'''[^\s,;()\[\]'"]+$''')
+
+def error(text, pos, message):
+    line = text.count('\n', 0, pos) + 1
+    column = pos - text.rfind('\n', 0, pos)
+    return LLLSyntaxException("line %d, column %d: %s" % (line, column, message))
+
+def parse_atom(word):
+    if INTEGER.match(word):
+        return int(word, 16) if 'x' in word else int(word)
+    elif word == 'None':
+        return None
+    return word
+
+def parse_string(token):
+    return token[1:-1] if '\\' not in token else ast.literal_eval(token)
+
+# Makes a node out of a list read from text: its value and its argument nodes
+def make_node(text, pos, items, validate):
+    if not items:
+        raise error(text, pos, "Empty list")
+    if isinstance(items[0], LLLnode):
+        raise error(text, pos, "A list must start with an atom")
+    try:
+        return LLLnode(items[0], items[1:], NullType() if items[0] is None else None, None, validate)
+    except Exception as e:
+        raise error(text, pos, str(e))
+
+def make_leaf(text, pos, value, validate):
+    try:
+        return LLLnode(value, [], NullType() if value is None else None, None, validate)
+    except Exception as e:
+        raise error(text, pos, str(e))
+
+# Reads the single LLL expression in text. Nodes are validated as by
+# LLLnode.from_list, unless validate is False
+def parse_lll(text, validate=True):
+    # Open lists, with the position where each started and its items so far:
+    # the value, if read yet, and the nodes of its arguments
+    stack = []
+    items = []
+    pos = 0
+    for m in TOKEN.finditer(text):
+        if m.start() != pos:
+            raise error(text, pos, "Unexpected character: %r" % text[pos])
+        kind = m.lastgroup
+        if kind == 'space':
+            pass
+        elif kind == 'open':
+            stack.append((pos, items))
+            items = []
+        elif kind == 'close':
+            if not stack:
+                raise error(text, pos, "Unmatched %r" % m.group())
+            start, outer = stack.pop()
+            if (text[start] == '(') != (m.group() == ')'):
+                raise error(text, pos, "Mismatched %r" % m.group())
+            outer.append(make_node(text, start, items, validate))
+            items = outer
+        else:
+            value = parse_string(m.group()) if kind == 'string' else parse_atom(m.group())
+            # The first atom of a list is its value, any other is a node
+            if items or not stack:
+                items.append(make_leaf(text, pos, value, validate))
+            else:
+                items.append(value)
+        pos = m.end()
+    if pos != len(text):
+        raise error(text, pos, "Unexpected character: %r" % text[pos])
+    if stack:
+        raise error(text, stack[-1][0], "Unclosed %r" % text[stack[-1][0]])
+    if len(items) != 1:
+        raise error(text, pos, "Expected a single expression, found %d" % len(items))
+    return items[0]
+
+def format_atom(value):
+    if isinstance(value, str) and BARE_WORD.match(value) and not INTEGER.match(value) and value != 'None':
+        return value
+    return repr(value)
+
+# Writes a node as an s-expression, laid out like LLLnode.repr: subtrees
+# shorter than 80 characters on one line, bigger ones with one argument per
+# line, indented by two spaces
+def to_sexpr(node):
+    flat = {}
+    stack = [(node, False)]
+    while stack:
+        n, expanded = stack.pop()
+        if id(n) in flat:
+            continue
+        if not expanded and n.args:
+            stack.append((n, True))
+            stack.extend((arg, False) for arg in n.args)
+            continue
+        subs = [flat[id(arg)] for arg in n.args]
+        x = None
+        if not n.args:
+            x = format_atom(n.value)
+        elif None not in subs:
+            x = '(' + ' '.join([format_atom(n.value)] + subs) + ')'
+            if len(x) >= 80:
+                x = None
+        flat[id(n)] = x
+    lines = []
+    stack = [(node, 0)]
+    while stack:
+        n, indent = stack.pop()
+        if isinstance(n, str):
+            lines[-1] += n
+        elif flat[id(n)] is not None:
+            lines.append(' ' * indent + flat[id(n)])
+        else:
+            lines.append(' ' * indent + '(' + format_atom(n.value))
+            stack.append((')', indent))
+            stack.extend((arg, indent + 2) for arg in reversed(n.args))
+    return '\n'.join(lines)
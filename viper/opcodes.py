@@ -81,4 +81,24 @@ pseudo_opcodes = {
     'SLE': [None, 2, 1, 10],
     'SGE': [None, 2, 1, 10],
     'CEIL32': [None, 1, 1, 20],
+    'SHA3_64': [None, 2, 1, 60],
 }
+
+# Every opcode and pseudo-opcode is interned as a small integer ID, so that
+# LLL nodes look up their record once: opcode_names[id] is the uppercase name
+# and opcode_records[id] the [byte, nargs, valency, gas] record. Real opcodes
+# come first, so an ID below num_real_opcodes is an EVM instruction
+opcode_names = list(opcodes) + [name for name in pseudo_opcodes if name not in opcodes]
+opcode_records = [opcodes.get(name) or pseudo_opcodes[name] for name in opcode_names]
+num_real_opcodes = len(opcodes)
+# Keyed by both the uppercase and the lowercase name; see get_opcode_id
+opcode_ids = {}
+for i, name in enumerate(opcode_names):
+    opcode_ids[name] = opcode_ids[name.lower()] = i
+
+# Returns the opcode ID of a (case-insensitive) name, or None
+def get_opcode_id(name):
+    i = opcode_ids.get(name)
+    if i is None and not name.islower():
+        i = opcode_ids.get(name.upper())
+    return i
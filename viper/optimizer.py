@@ -0,0 +1,1136 @@
+import collections, time
+from .parser import LLLnode, mk_initial, ConstantClampException
+from .types import NullType
+from .opcodes import opcode_records
+from . import compile_lll
+
+# LLL optimizer, run on the LLL of each function between lowering
+# (parser.parse_funcs) and assembly (compile_lll.compile_to_assembly).
+#
+# A pass is a function pass_fn(lll, stats) returning the optimized LLL. It
+# must build new nodes rather than modify the ones it is given, as lowered
+# functions are shared through the function cache; unchanged subtrees can be
+# reused as they are. stats is the PassStats of the pass, whose counters a
+# pass can use to report what it did (eg. stats.counters['folded'] += 1).
+# Passes are registered by name, and run in the order given by their names in
+# the pipeline, skipping any that are disabled
+
+# Pass name => pass function
+registry = {}
+
+# Registers a pass under a name, for use as a decorator:
+#
+#   @register_pass('flatten_seq')
+#   def flatten_seq(lll, stats): ...
+def register_pass(name):
+    def register(pass_fn):
+        if name in registry:
+            raise Exception("Pass already registered: %s" % name)
+        registry[name] = pass_fn
+        return pass_fn
+    return register
+
+# Names of the passes run by default, in order
+default_pipeline = [
+    'fold_constants',
+    'eliminate_dead_code',
+    'eliminate_clamps',
+    'forward_storage',
+    'share_subexpressions',
+    'flatten_seq',
+    'eliminate_dead_stores',
+]
+
+# What one pass did over all the LLL it was run on: wall time, node counts
+# before and after, and, if the optimizer measures them, estimated gas and
+# code size before and after
+class PassStats():
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.time = 0.0
+        self.nodes_before = 0
+        self.nodes_after = 0
+        self.gas_before = 0
+        self.gas_after = 0
+        self.size_before = 0
+        self.size_after = 0
+        self.counters = collections.Counter()
+
+    @property
+    def nodes_delta(self):
+        return self.nodes_after - self.nodes_before
+
+    @property
+    def gas_delta(self):
+        return self.gas_after - self.gas_before
+
+    @property
+    def size_delta(self):
+        return self.size_after - self.size_before
+
+    def as_dict(self):
+        return {'name': self.name, 'runs': self.runs, 'time': self.time,
+                'nodes_before': self.nodes_before, 'nodes_after': self.nodes_after,
+                'gas_before': self.gas_before, 'gas_after': self.gas_after,
+                'size_before': self.size_before, 'size_after': self.size_after,
+                'counters': dict(self.counters)}
+
+# Stats of all passes, by name in pipeline order
+class OptimizerStats(collections.OrderedDict):
+    def get_pass(self, name):
+        if name not in self:
+            self[name] = PassStats(name)
+        return self[name]
+
+    def as_dict(self):
+        return [s.as_dict() for s in self.values()]
+
+    # One line per pass, for printing
+    def report(self):
+        o = ['%-24s %6s %9s %8s %9s %9s  %s' % ('pass', 'runs', 'time', 'nodes', 'gas', 'size', 'counters')]
+        for s in self.values():
+            counters = ', '.join('%s=%d' % kv for kv in sorted(s.counters.items()))
+            o.append('%-24s %6d %8.4fs %+8d %+9d %+9d  %s' % (s.name, s.runs, s.time, s.nodes_delta, s.gas_delta, s.size_delta, counters))
+        return '\n'.join(o)
+
+# Number of nodes in a tree (shared subtrees count once per use)
+def count_nodes(lll):
+    o = 0
+    stack = [lll]
+    while stack:
+        node = stack.pop()
+        o += 1
+        stack.extend(node.args)
+    return o
+
+def estimate_size(lll):
+    return len(compile_lll.assembly_to_evm(compile_lll.compile_to_assembly(lll)))
+
+# Runs a pipeline of passes. passes is a list of pass names (default
+# default_pipeline), and disabled a collection of names to skip. With
+# measure, every pass also records the estimated gas and code size of the LLL
+# before and after it, which costs an extra compilation per pass
+class Optimizer():
+    def __init__(self, passes=None, disabled=(), measure=False):
+        self.pipeline = list(default_pipeline if passes is None else passes)
+        for name in self.pipeline:
+            if name not in registry:
+                raise Exception("Unknown optimizer pass: %s" % name)
+        self.disabled = set(disabled)
+        self.measure = measure
+        self.stats = OptimizerStats()
+
+    def enable(self, name):
+        self.disabled.discard(name)
+
+    def disable(self, name):
+        self.disabled.add(name)
+
+    # Names of the passes that will run, in order
+    @property
+    def enabled_passes(self):
+        return [name for name in self.pipeline if name not in self.disabled]
+
+    def optimize(self, lll):
+        for name in self.enabled_passes:
+            stats = self.stats.get_pass(name)
+            stats.runs += 1
+            stats.nodes_before += count_nodes(lll)
+            if self.measure:
+                stats.gas_before += compile_lll.gas_estimate(lll)
+                stats.size_before += estimate_size(lll)
+            t0 = time.time()
+            lll = registry[name](lll, stats)
+            stats.time += time.time() - t0
+            stats.nodes_after += count_nodes(lll)
+            if self.measure:
+                stats.gas_after += compile_lll.gas_estimate(lll)
+                stats.size_after += estimate_size(lll)
+        return lll
+
+    # Runs the assembly-level part of the passes that have one on the
+    # assembly of a whole contract
+    def optimize_assembly(self, assembly):
+        if 'eliminate_dead_code' in self.enabled_passes:
+            stats = self.stats.get_pass('eliminate_dead_code')
+            t0 = time.time()
+            assembly = compile_lll.eliminate_unreachable(assembly, stats.counters)
+            stats.time += time.time() - t0
+        return assembly
+
+# Rebuilds a node with new arguments, reusing it if they are unchanged
+def with_args(node, args):
+    if len(args) == len(node.args) and all(a is b for a, b in zip(args, node.args)):
+        return node
+    return LLLnode(node.value, args, node.typ, node.location, validate=False)
+
+# Applies fn to every node bottom-up (each node is given with its already
+# transformed arguments) and returns the new tree. Walks the tree with an
+# explicit stack, so deep trees do not hit the recursion limit
+def transform(lll, fn):
+    results = []
+    stack = [(lll, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded and node.args:
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in reversed(node.args))
+            continue
+        n = len(results) - len(node.args)
+        args = results[n:]
+        del results[n:]
+        results.append(fn(with_args(node, args)))
+    return results[0]
+
+# Merges nested seqs into their parent seq and drops pass statements from
+# seqs, except where either would change the valency of the seq. A seq left
+# with a single statement is replaced by it
+@register_pass('flatten_seq')
+def flatten_seq(lll, stats):
+    def flatten(node):
+        if node.value != 'seq':
+            return node
+        args = []
+        for i, arg in enumerate(node.args):
+            last = i == len(node.args) - 1
+            if arg.value == 'seq' and (arg.args or not last):
+                args.extend(arg.args)
+                stats.counters['flattened'] += 1
+            elif arg.value == 'pass' and not last:
+                stats.counters['passes_dropped'] += 1
+            else:
+                args.append(arg)
+        if len(args) == 1:
+            stats.counters['flattened'] += 1
+            return args[0]
+        return with_args(node, args)
+    return transform(lll, flatten)
+
+# EVM words are integers modulo 2**256; signed operations read them as two's
+# complement
+WORD = 2**256
+
+def unsigned(x):
+    return x % WORD
+
+def signed(x):
+    x %= WORD
+    return x - WORD if x >= 2**255 else x
+
+def evm_sdiv(a, b):
+    a, b = signed(a), signed(b)
+    if b == 0:
+        return 0
+    return (abs(a) // abs(b)) * (-1 if (a < 0) != (b < 0) else 1)
+
+def evm_smod(a, b):
+    a, b = signed(a), signed(b)
+    if b == 0:
+        return 0
+    return (abs(a) % abs(b)) * (-1 if a < 0 else 1)
+
+# Opcode => function computing its result (mod 2**256 is applied after) from
+# its arguments, for opcodes without side effects
+evm_functions = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'mul': lambda a, b: a * b,
+    'div': lambda a, b: unsigned(a) // unsigned(b) if unsigned(b) else 0,
+    'sdiv': evm_sdiv,
+    'mod': lambda a, b: unsigned(a) % unsigned(b) if unsigned(b) else 0,
+    'smod': evm_smod,
+    'exp': lambda a, b: pow(unsigned(a), unsigned(b), WORD),
+    'lt': lambda a, b: int(unsigned(a) < unsigned(b)),
+    'gt': lambda a, b: int(unsigned(a) > unsigned(b)),
+    'slt': lambda a, b: int(signed(a) < signed(b)),
+    'sgt': lambda a, b: int(signed(a) > signed(b)),
+    'sle': lambda a, b: int(signed(a) <= signed(b)),
+    'sge': lambda a, b: int(signed(a) >= signed(b)),
+    'eq': lambda a, b: int(unsigned(a) == unsigned(b)),
+    'iszero': lambda a: int(unsigned(a) == 0),
+    'and': lambda a, b: unsigned(a) & unsigned(b),
+    'or': lambda a, b: unsigned(a) | unsigned(b),
+    'xor': lambda a, b: unsigned(a) ^ unsigned(b),
+    'not': lambda a: WORD - 1 - unsigned(a),
+    # As compile_to_assembly expands it
+    'ceil32': lambda a: unsigned(a + 31) - unsigned(a - 1) % 32,
+}
+
+# The reserved memory slots that every contract sets up front (see
+# parser.mk_initial) and never writes again, by address
+_reserved_constants = {}
+
+def get_reserved_constants():
+    if not _reserved_constants:
+        for store in mk_initial().args:
+            if isinstance(store.args[1].value, int):
+                _reserved_constants[store.args[0].value] = unsigned(store.args[1].value)
+    return _reserved_constants
+
+# Value of a node known at compile time: a number, or a load of a reserved
+# memory slot. None if not known
+def get_constant(node):
+    if isinstance(node.value, int) and not node.args:
+        return unsigned(node.value)
+    if node.value == 'mload' and isinstance(node.args[0].value, int):
+        return get_reserved_constants().get(node.args[0].value)
+    return None
+
+# Evaluates the clamps whose arguments are all known: returns the value the
+# clamp passes on, or raises ConstantClampException if it always fails
+def fold_check(node, values):
+    if node.value == 'clamp':
+        ok = signed(values[0]) <= signed(values[1]) <= signed(values[2])
+        result = values[1]
+    elif node.value == 'uclamplt':
+        ok = values[0] < values[1]
+        result = values[0]
+    else:
+        ok = values[0] != 0
+        result = values[0]
+    if not ok:
+        raise ConstantClampException("%s always fails on %s" % (node.value, ', '.join([str(signed(v)) for v in values])))
+    return result
+
+CHECKS = ('clamp', 'uclamplt', 'clamp_nonzero')
+
+def mk_constant(value, node):
+    return LLLnode(value, [], node.typ, node.location, validate=False)
+
+# Whether a statement may leave the code, so that those after it may not run:
+# it has an exit, or an assert not known to pass
+def may_leave(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.value in EXIT_OPCODES or (node.value == 'assert' and not get_constant(node.args[0])):
+            return True
+        stack.extend(node.args if node.value != 'lll' else node.args[1:])
+    return False
+
+# Evaluates arithmetic on numbers at compile time, with EVM semantics, along
+# with the clamps and asserts that are then known to pass, which are
+# dropped. A clamp that always fails is a compile-time error where it is
+# always reached, and is otherwise replaced by an assert that fails at run
+# time, as is one in the branches of an if, the body of a loop, or after a
+# statement that may leave the code. The pass runs on one function at a
+# time, so the branch of a top-level if (its method ID check) is always
+# reached. Asserts that always fail are left as they are. Variables bound to
+# numbers by with statements are replaced by the numbers. Loads of the
+# reserved memory slots count as numbers when the whole expression folds
+@register_pass('fold_constants')
+def fold_constants(lll, stats):
+    results = []
+    # (node, env, phase, conditional), where env maps with variables bound to
+    # numbers to their values, and conditional is whether the node may not
+    # be reached when the function runs
+    stack = [(lll, {}, 0, False)]
+    while stack:
+        node, env, phase, conditional = stack.pop()
+        if phase == 0:
+            if not node.args:
+                if isinstance(node.value, str) and node.value in env:
+                    results.append(mk_constant(env[node.value], node))
+                    stats.counters['propagated'] += 1
+                else:
+                    results.append(node)
+            elif node.value == 'with':
+                stack.append((node, env, 1, conditional))
+                stack.append((node.args[1], env, 0, conditional))
+            elif node.value == 'lll':
+                # The inner code sees none of the enclosing variables
+                stack.append((node, env, 2, conditional))
+                stack.append((node.args[1], env, 0, conditional))
+                stack.append((node.args[0], {}, 0, conditional))
+            else:
+                stack.append((node, env, 2, conditional))
+                children = []
+                for i, arg in enumerate(node.args):
+                    if node.value == 'if' and i > 0:
+                        children.append(conditional or node is not lll)
+                    elif node.value == 'repeat' and i == 3:
+                        children.append(True)
+                    elif node.value == 'seq' and i > 0:
+                        children.append(children[-1] or may_leave(node.args[i - 1]))
+                    else:
+                        children.append(conditional)
+                stack.extend((arg, env, 0, c) for arg, c in reversed(list(zip(node.args, children))))
+        # With statement, once its initial value is folded
+        elif phase == 1:
+            var = node.args[0].value
+            value = get_constant(results[-1]) if isinstance(results[-1].value, int) else None
+            body_env = dict(env)
+            body_env.pop(var, None)
+            if value is not None:
+                body_env[var] = value
+            stack.append((node, env, 3, conditional))
+            stack.append((node.args[2], body_env, 0, conditional))
+        # With statement, once its body is folded
+        elif phase == 3:
+            body = results.pop()
+            initial = results.pop()
+            if isinstance(initial.value, int):
+                # All uses of the variable were replaced
+                results.append(body)
+            else:
+                results.append(with_args(node, [node.args[0], initial, body]))
+        else:
+            n = len(results) - len(node.args)
+            args = results[n:]
+            del results[n:]
+            results.append(fold_node(with_args(node, args), stats, conditional))
+    return results[0]
+
+def fold_node(node, stats, conditional=False):
+    fn = evm_functions.get(node.value)
+    if fn is None and node.value not in CHECKS and node.value != 'assert':
+        return node
+    values = [get_constant(arg) for arg in node.args]
+    if None in values:
+        return node
+    if fn is not None:
+        stats.counters['folded'] += 1
+        return mk_constant(unsigned(fn(*values)), node)
+    if node.value == 'assert':
+        if not values[0]:
+            return node
+        stats.counters['checks_removed'] += 1
+        return LLLnode('pass', [], None, None, validate=False)
+    try:
+        result = fold_check(node, values)
+    except ConstantClampException:
+        if not conditional:
+            raise
+        stats.counters['checks_failing'] += 1
+        return LLLnode.from_list(['seq', ['assert', 0], mk_constant(values[0 if node.value != 'clamp' else 1], node)],
+                                 typ=node.typ, location=node.location)
+    stats.counters['checks_removed'] += 1
+    return mk_constant(result, node)
+
+# Value ranges: a range is an interval (lo, hi) holding the value of an
+# expression read as a signed word, so any value is within FULL_RANGE. Values
+# that are also within [0, 2**255) read the same unsigned
+FULL_RANGE = (-2**255, 2**255 - 1)
+BOOL_RANGE = (0, 1)
+
+def mk_range(lo, hi):
+    if lo < FULL_RANGE[0] or hi > FULL_RANGE[1]:
+        return FULL_RANGE
+    return (lo, hi)
+
+def is_nonnegative(r):
+    return r[0] >= 0
+
+# Opcodes => positions of the address and the length of the memory they write
+memory_writes = {
+    'calldatacopy': (0, 2),
+    'codecopy': (0, 2),
+    'extcodecopy': (1, 3),
+    'call': (5, 6),
+    'callcode': (5, 6),
+    'delegatecall': (4, 5),
+}
+
+# Opcodes => position of the address and the length of the memory they write,
+# for those that always write the same number of bytes
+fixed_memory_writes = {
+    'mstore': (0, 32),
+    'mstore8': (0, 1),
+}
+
+# Pseudo-opcodes => the scratch memory they write
+scratch_memory_writes = {
+    'sha3_32': (192, 223),
+    'sha3_64': (192, 255),
+}
+
+# Range of the memory a node writes, as (first byte, last byte); FULL_RANGE
+# if it cannot be bounded, or None if the node writes no memory
+def get_write_range(node, ranges):
+    if node.value in scratch_memory_writes:
+        return scratch_memory_writes[node.value]
+    elif node.value == 'repeat':
+        addr_range, length_range = ranges[0], (32, 32)
+    elif node.value in fixed_memory_writes:
+        addr, length = fixed_memory_writes[node.value]
+        addr_range, length_range = ranges[addr], (length, length)
+    elif node.value in memory_writes:
+        addr, length = memory_writes[node.value]
+        addr_range, length_range = ranges[addr], ranges[length]
+    else:
+        return None
+    return get_memory_range(addr_range, length_range)
+
+# Range of the memory from an address to a length, None if the length is 0
+def get_memory_range(addr_range, length_range):
+    if not is_nonnegative(addr_range) or not is_nonnegative(length_range):
+        return FULL_RANGE
+    if length_range[1] == 0:
+        return None
+    return mk_range(addr_range[0], addr_range[1] + length_range[1] - 1)
+
+def ranges_overlap(a, b):
+    return a[0] <= b[1] and b[0] <= a[1]
+
+# Range of a node's value given those of its arguments, and env, which maps
+# with variables and the memory addresses of loop counters to their ranges
+def get_value_range(node, ranges, env):
+    value = node.value
+    if isinstance(value, int):
+        return (signed(value), signed(value))
+    if not node.args:
+        return env.get(value, FULL_RANGE) if isinstance(value, str) else FULL_RANGE
+    if value == 'mload' and isinstance(node.args[0].value, int):
+        known = get_reserved_constants().get(node.args[0].value)
+        if known is not None:
+            return (signed(known), signed(known))
+        return env.get(node.args[0].value, FULL_RANGE)
+    if value in ('lt', 'gt', 'slt', 'sgt', 'sle', 'sge', 'eq', 'iszero'):
+        return BOOL_RANGE
+    if value in ('with', 'seq') and node.valency:
+        return ranges[-1]
+    if value == 'if' and len(node.args) == 3 and node.valency:
+        return (min(ranges[1][0], ranges[2][0]), max(ranges[1][1], ranges[2][1]))
+    if len(ranges) != 2 and value not in ('clamp', 'clamp_nonzero', 'ceil32'):
+        return FULL_RANGE
+    a = ranges[0]
+    b = ranges[1] if len(ranges) > 1 else None
+    if value == 'add':
+        return mk_range(a[0] + b[0], a[1] + b[1])
+    elif value == 'sub':
+        return mk_range(a[0] - b[1], a[1] - b[0])
+    elif value == 'mul':
+        corners = [x * y for x in a for y in b]
+        return mk_range(min(corners), max(corners))
+    elif value in ('div', 'sdiv') and is_nonnegative(a) and is_nonnegative(b):
+        # Division by zero gives zero
+        return (a[0] // b[1] if b[0] else 0, a[1] // b[0] if b[0] else a[1])
+    elif value in ('mod', 'smod') and is_nonnegative(a) and b[0] > 0:
+        return (0, min(a[1], b[1] - 1))
+    elif value == 'and' and (is_nonnegative(a) or is_nonnegative(b)):
+        return (0, min([r[1] for r in (a, b) if is_nonnegative(r)]))
+    elif value in ('or', 'xor') and is_nonnegative(a) and is_nonnegative(b):
+        return (0, 2 ** max(a[1].bit_length(), b[1].bit_length()) - 1)
+    elif value == 'ceil32' and is_nonnegative(a):
+        return mk_range(a[0], a[1] + 31)
+    # Checks pass on the part of their argument's range that satisfies them
+    elif value == 'clamp':
+        lo, hi = max(a[0], ranges[1][0]), min(ranges[1][1], ranges[2][1])
+        return (lo, hi) if lo <= hi else ranges[1]
+    elif value == 'uclamplt' and is_nonnegative(b):
+        lo, hi = (a[0], min(a[1], b[1] - 1)) if is_nonnegative(a) else (0, b[1] - 1)
+        return (lo, hi) if lo <= hi else a
+    elif value == 'clamp_nonzero':
+        return a
+    return FULL_RANGE
+
+# Opcodes with arguments that only read state, so can be dropped when their
+# value is not needed
+PURE_OPCODES = set(evm_functions) | {'mload', 'calldataload', 'sload', 'balance'}
+
+# Bounds of checks are dropped along with the checks, so must have no effects:
+# made of numbers, variables, opcodes without arguments that just push a
+# value (eg. caller), and the arithmetic and reads above
+def is_pure(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.args:
+            if node.value not in PURE_OPCODES:
+                return False
+            stack.extend(node.args)
+        elif node.opcode is not None and opcode_records[node.opcode][1:3] != [0, 1]:
+            return False
+    return True
+
+# Whether a check on arguments with these ranges always passes
+def check_passes(node, ranges):
+    if node.value == 'clamp':
+        return ranges[1][0] >= ranges[0][1] and ranges[1][1] <= ranges[2][0] and \
+            is_pure(node.args[0]) and is_pure(node.args[2])
+    elif node.value == 'uclamplt':
+        return is_nonnegative(ranges[0]) and ranges[0][1] < ranges[1][0] and is_pure(node.args[1])
+    elif node.value == 'clamp_nonzero':
+        return ranges[0][0] > 0 or ranges[0][1] < 0
+    elif node.value == 'assert':
+        return (ranges[0][0] > 0 or ranges[0][1] < 0) and is_pure(node.args[0])
+    return False
+
+# Tracks the range of values each expression can take, and drops the clamps
+# and asserts that always pass. Ranges come from numbers (and the reserved
+# memory slots), comparisons, arithmetic that provably does not overflow,
+# checks (a clamped value is within its bounds afterwards), with variables,
+# and loop counters: in the body of a repeat, the counter is within its
+# start range plus the number of rounds, unless the body may write to it,
+# in which case the body is analyzed again without that fact
+@register_pass('eliminate_clamps')
+def eliminate_clamps(lll, stats):
+    results = []
+    # Memory written by the nodes built so far, and the checks dropped, both
+    # cut back when a loop body is analyzed again
+    writes = []
+    removed = []
+    stack = [(lll, {}, 'visit', None)]
+    while stack:
+        node, env, phase, info = stack.pop()
+        if phase == 'visit':
+            if not node.args:
+                results.append((node, get_value_range(node, [], env)))
+            elif node.value == 'with':
+                stack.append((node, env, 'with', None))
+                stack.append((node.args[1], env, 'visit', None))
+            elif node.value == 'repeat':
+                stack.append((node, env, 'repeat', None))
+                stack.extend((arg, env, 'visit', None) for arg in reversed(node.args[:3]))
+            elif node.value == 'lll':
+                stack.append((node, env, 'build', None))
+                stack.append((node.args[1], env, 'visit', None))
+                stack.append((node.args[0], {}, 'visit', None))
+            else:
+                stack.append((node, env, 'build', None))
+                stack.extend((arg, env, 'visit', None) for arg in reversed(node.args))
+        elif phase == 'with':
+            body_env = dict(env)
+            body_env[node.args[0].value] = results[-1][1]
+            results.insert(len(results) - 1, (node.args[0], FULL_RANGE))
+            stack.append((node, env, 'build', None))
+            stack.append((node.args[2], body_env, 'visit', None))
+        elif phase == 'repeat':
+            memloc, start, rounds = results[-3:]
+            body_env = env
+            if isinstance(memloc[0].value, int) and isinstance(rounds[0].value, int):
+                body_env = dict(env)
+                body_env[memloc[0].value] = mk_range(start[1][0], start[1][1] + rounds[0].value - 1)
+            stack.append((node, env, 'repeat_body', (len(writes), len(removed), body_env is not env)))
+            stack.append((node.args[3], body_env, 'visit', None))
+        elif phase == 'repeat_body':
+            mark, removed_mark, assumed = info
+            memloc = results[-4][0].value
+            if assumed and any(w is FULL_RANGE or ranges_overlap(w, (memloc, memloc + 31)) for w in writes[mark:]):
+                results.pop()
+                del writes[mark:]
+                del removed[removed_mark:]
+                stack.append((node, env, 'repeat_body', (mark, removed_mark, False)))
+                stack.append((node.args[3], env, 'visit', None))
+                continue
+            stack.append((node, env, 'build', None))
+        else:
+            n = len(results) - len(node.args)
+            args = [r[0] for r in results[n:]]
+            ranges = [r[1] for r in results[n:]]
+            del results[n:]
+            write = get_write_range(node, ranges)
+            if write is not None:
+                writes.append(write)
+            if (node.value in CHECKS or node.value == 'assert') and check_passes(node, ranges):
+                removed.append(node.value)
+                if node.value == 'assert':
+                    results.append((LLLnode('pass', [], None, None, validate=False), FULL_RANGE))
+                else:
+                    results.append((args[0] if node.value != 'clamp' else args[1], get_value_range(node, ranges, env)))
+                continue
+            node = with_args(node, args)
+            results.append((node, get_value_range(node, ranges, env)))
+    for name in removed:
+        stats.counters[name + '_removed'] += 1
+    return results[0][0]
+
+# Opcodes address computations are made of, besides numbers, variables and
+# opcodes that just push a value (eg. caller), which have no effects other
+# than the sha3s writing their scratch memory, and statements that leave the
+# code
+CSE_OPCODES = ('sha3_32', 'sha3_64', 'add', 'sub', 'mul', 'uclamplt', 'mload', 'calldataload')
+EXIT_OPCODES = ('return', 'stop', 'selfdestruct', 'suicide', 'break', 'invalid', 'revert')
+
+# Most subexpressions bound in one seq, as each binding deepens the stack
+MAX_CSE_BINDINGS = 8
+
+# Ranges of the memory written anywhere in nodes, taking addresses and
+# lengths that are not numbers to be unbounded
+def get_memory_writes(nodes):
+    writes = []
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node.value == 'lll':
+            writes.append(FULL_RANGE)
+        ranges = [(arg.value, arg.value) if isinstance(arg.value, int) and not arg.args else FULL_RANGE
+                  for arg in node.args]
+        write = get_write_range(node, ranges)
+        if write is not None:
+            writes.append(write)
+        stack.extend(node.args)
+    return writes
+
+# What a subexpression is made of, by node id: a key equal for equal trees,
+# its size, the with variables it uses, whether it contains a check, the
+# memory it reads, whether it is made of CSE_OPCODES only, and whether it
+# computes an address. The nodes are kept, so that their ids stay theirs
+class CSEInfo():
+    def __init__(self):
+        self.keys = {}
+        self.info = {}
+        self.nodes = []
+
+    def get(self, lll):
+        stack = [(lll, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in self.info:
+                continue
+            if not expanded and node.args:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in node.args)
+                continue
+            args = [self.info[id(arg)] for arg in node.args]
+            key = self.keys.setdefault((node.value, tuple(a[0] for a in args)), len(self.keys))
+            if not node.args:
+                is_var = isinstance(node.value, str) and node.opcode is None and node.value not in ('pass', 'break')
+                pure = isinstance(node.value, int) or is_var or \
+                    (node.opcode is not None and opcode_records[node.opcode][1:3] == [0, 1])
+                info = (key, 1, frozenset([node.value]) if is_var else frozenset(), False, (), pure, False)
+            else:
+                pure = node.value in CSE_OPCODES and all(a[5] for a in args)
+                reads = sum((a[4] for a in args), ())
+                if node.value == 'mload':
+                    addr = node.args[0].value
+                    reads += ((addr, addr + 31) if isinstance(addr, int) and not node.args[0].args else FULL_RANGE,)
+                info = (key, 1 + sum(a[1] for a in args), frozenset().union(*(a[2] for a in args)),
+                        node.value == 'uclamplt' or any(a[3] for a in args), reads, pure,
+                        node.value in ('sha3_32', 'sha3_64', 'uclamplt') or any(a[6] for a in args))
+            self.info[id(node)] = info
+            self.nodes.append(node)
+        return self.info[id(lll)]
+
+# Calls fn(node, conditional) on each node of tree that is not under a with
+# binding any of the variables it uses, where conditional is whether it is
+# only evaluated on some paths through the tree. fn returns a replacement for
+# the node, or None to carry on into its arguments. Returns the new tree
+def walk_shareable(tree, cse_info, fn):
+    results = []
+    stack = [(tree, frozenset(), False, False)]
+    while stack:
+        node, bound, conditional, expanded = stack.pop()
+        if not expanded:
+            if not cse_info.get(node)[2] & bound:
+                replacement = fn(node, conditional)
+                if replacement is not None:
+                    results.append(replacement)
+                    continue
+            if not node.args:
+                results.append(node)
+                continue
+            stack.append((node, bound, conditional, True))
+            if node.value == 'lll':
+                stack.append((node.args[1], bound, conditional, False))
+                results.append(node.args[0])
+                continue
+            children = []
+            for i, arg in enumerate(node.args):
+                if node.value == 'with' and i == 2:
+                    children.append((arg, bound | {node.args[0].value}, conditional))
+                elif node.value == 'with' and i == 0:
+                    children.append((arg, bound, conditional))
+                else:
+                    branch = (node.value == 'if' and i > 0) or (node.value == 'repeat' and i == 3)
+                    children.append((arg, bound, conditional or branch))
+            # Arguments are visited in order, and the variable of a with is
+            # left as it is
+            stack.extend((arg, b, c, False) for arg, b, c in reversed(children))
+            continue
+        n = len(results) - len(node.args)
+        args = results[n:]
+        del results[n:]
+        results.append(with_args(node, args))
+    return results[0]
+
+def has_exit(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.value in EXIT_OPCODES:
+            return True
+        stack.extend(node.args if node.value != 'lll' else node.args[1:])
+    return False
+
+# Binds the biggest address computations used more than once in the
+# statements of a seq to with variables, up to limit of them: returns the new
+# seq, or None
+def share_in_seq(seq, cse_info, names, limit, counters):
+    stmts = list(seq.args)
+    # Subexpressions bound so far: [variable, value, index of the statement
+    # before which it is bound]
+    bindings = []
+    writes = get_memory_writes(stmts)
+    while len(bindings) < limit:
+        # Key => [uses, index of first use, whether the first use is always
+        # evaluated in its statement or binding, node]
+        uses = {}
+        items = [(i, stmt, True) for i, stmt in enumerate(stmts)] + [(b[2], b[1], False) for b in bindings]
+        for index, item, is_stmt in sorted(items, key=lambda x: x[0]):
+            exits = is_stmt and has_exit(item)
+            def count(node, conditional):
+                info = cse_info.get(node)
+                if node.args and info[5] and info[6]:
+                    if info[0] not in uses:
+                        uses[info[0]] = [0, index, not conditional and not exits, node]
+                    uses[info[0]][0] += 1
+                return None
+            walk_shareable(item, cse_info, count)
+        best = None
+        for key, (n, index, safe, node) in uses.items():
+            key, size, free, checks, reads = cse_info.get(node)[:5]
+            if n < 2 or (checks and not safe):
+                continue
+            if any(ranges_overlap(r, w) for r in reads for w in writes):
+                continue
+            if best is None or size > cse_info.get(best[3])[1]:
+                best = (key, index, safe, node)
+        if best is None:
+            break
+        key, index, safe, node = best
+        name = '_cse_%d' % len(names)
+        names.append(name)
+        var = LLLnode(name, [], None, None, validate=False)
+        replace = lambda n, conditional: var if cse_info.get(n)[0] == key else None
+        stmts = [walk_shareable(stmt, cse_info, replace) for stmt in stmts]
+        for b in bindings:
+            b[1] = walk_shareable(b[1], cse_info, replace)
+        bindings.append([name, node, index])
+        counters['subexpressions_shared'] += 1
+        counters['uses_replaced'] += uses[key][0]
+    if not bindings:
+        return None
+    return bind_before(seq, stmts, bindings)
+
+# Rebuilds a seq from its statements, with each binding [variable, value,
+# index] around the statements from stmts[index] on. Bindings before the
+# same statement are nested so that the later ones, which the values of
+# earlier ones may use, are outermost
+def bind_before(seq, stmts, bindings):
+    tail = []
+    for i in reversed(range(len(stmts))):
+        tail.insert(0, stmts[i])
+        for name, value, index in [b for b in bindings if b[2] == i]:
+            body = tail[0] if len(tail) == 1 else LLLnode('seq', tail, None, None, validate=False)
+            tail = [LLLnode('with', [LLLnode(name, [], None, None, validate=False), value, body], None, None, validate=False)]
+    return LLLnode('seq', tail, seq.typ, seq.location, validate=False)
+
+# Common subexpression elimination for address computations: storage
+# addresses (sha3s of a slot and key, plus offsets) and bounds-checked indices that
+# a seq computes more than once are computed once, before the first
+# statement using them, and bound to a with variable. A subexpression is
+# only shared if its memory reads are not written anywhere in the seq, and
+# one containing a check only if the statement first using it always
+# evaluates it and cannot leave the code first
+@register_pass('share_subexpressions')
+def share_subexpressions(lll, stats):
+    return bind_in_seqs(lll, share_in_seq, stats)
+
+# Runs rewrite(seq, cse_info, names, limit, counters) on every seq, bottom-up,
+# where rewrite binds at most limit with variables in the seq, named after
+# names, which it appends to. Variables can end up too deep in the stack for
+# DUP to reach, in which case fewer are bound per seq
+def bind_in_seqs(lll, rewrite, stats):
+    cse_info = CSEInfo()
+    limit = MAX_CSE_BINDINGS
+    while limit:
+        names = []
+        counters = collections.Counter()
+        def bind(node):
+            if node.value != 'seq':
+                return node
+            return rewrite(node, cse_info, names, limit, counters) or node
+        o = transform(lll, bind)
+        try:
+            if names:
+                compile_lll.compile_to_assembly(o)
+            stats.counters.update(counters)
+            return o
+        except Exception as e:
+            if 'too deep' not in str(e):
+                raise
+            limit //= 2
+    return lll
+
+# Opcodes after which no storage value is known any more, as the code they
+# run can call back into the contract and write its storage
+STORAGE_BARRIERS = ('call', 'callcode', 'delegatecall', 'create')
+
+# Which slots a storage address can be: ('slot', n) for the number n,
+# ('hash', base, offset) for the sha3_64 of the slot base and a key plus the
+# number offset, or None for any slot. A hash is taken never to equal a
+# number or another hash, so hashes of different bases or at different
+# offsets are different slots, whatever their keys
+def get_slot_class(node):
+    if isinstance(node.value, int) and not node.args:
+        return ('slot', node.value)
+    offset = 0
+    if node.value == 'add':
+        numbers = [arg for arg in node.args if isinstance(arg.value, int) and not arg.args]
+        if len(numbers) == 1:
+            offset = numbers[0].value
+            node = node.args[1] if node.args[0] is numbers[0] else node.args[0]
+    if node.value == 'sha3_64':
+        return ('hash', get_slot_class(node.args[0]), offset)
+    return None
+
+def may_alias(a, b):
+    if a is None or b is None:
+        return True
+    if a[0] != b[0]:
+        return False
+    if a[0] == 'slot':
+        return a[1] == b[1]
+    return a[2] == b[2] and may_alias(a[1], b[1])
+
+# The storage a node writes: whether it contains a barrier, and the slot
+# classes of its sstores
+def get_storage_writes(node):
+    barrier = False
+    stores = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.value in STORAGE_BARRIERS:
+            barrier = True
+        elif node.value == 'sstore':
+            stores.append(get_slot_class(node.args[0]))
+        stack.extend(node.args if node.value != 'lll' else node.args[1:])
+    return barrier, stores
+
+def kills(writes, cls):
+    return writes[0] or any(may_alias(store, cls) for store in writes[1])
+
+# Replaces sloads in the statements of a seq with the value they are known
+# to read: that of an earlier sload of the same address, bound to a with
+# variable before the statement first reading it, or that of an sstore to the
+# address that is a statement of the seq, and binds at most limit variables.
+# Returns the new seq, or None
+def forward_in_seq(seq, cse_info, names, limit, counters):
+    stmts = list(seq.args)
+    writes = get_memory_writes(stmts)
+    # Loads bound so far, as [variable, sload, index of the statement before
+    # which it is bound], and stores forwarded, by statement index => variable
+    bindings = []
+    stores = {}
+    changed = False
+    # Whether an address always reads the same slot wherever it is in the seq
+    def is_stable(addr):
+        info = cse_info.get(addr)
+        return info[5] and not any(ranges_overlap(r, w) for r in info[4] for w in writes)
+    while len(bindings) + len(stores) < limit:
+        storage_writes = [get_storage_writes(stmt) for stmt in stmts]
+        # Key of an sload => [(statement index, whether always evaluated)], node
+        loads = {}
+        for i, stmt in enumerate(stmts):
+            exits = has_exit(stmt)
+            def count(node, conditional):
+                if node.value == 'sload' and is_stable(node.args[0]):
+                    key = cse_info.get(node)[0]
+                    loads.setdefault(key, ([], node))[0].append((i, not conditional and not exits))
+                return None
+            walk_shareable(stmt, cse_info, count)
+        # The statements from start to the last before one that may write
+        # the slot an sload reads
+        def get_region(start, node):
+            cls = get_slot_class(node.args[0])
+            end = start
+            while end < len(stmts) and not kills(storage_writes[end], cls):
+                end += 1
+            return end
+        best = None
+        for key, (uses, node) in loads.items():
+            start, safe = uses[0]
+            end = get_region(start, node)
+            n = len([u for u in uses if u[0] < end])
+            if n < 2 or (cse_info.get(node)[3] and not safe):
+                continue
+            if best is None or n - 1 > best[0]:
+                best = (n - 1, key, start, end, node, None)
+        for i, stmt in enumerate(stmts):
+            if stmt.value != 'sstore' or i in stores or not is_stable(stmt.args[0]):
+                continue
+            node = LLLnode('sload', [stmt.args[0]], None, None, validate=False)
+            key = cse_info.get(node)[0]
+            if key not in loads:
+                continue
+            end = get_region(i + 1, node)
+            n = len([u for u in loads[key][0] if i < u[0] < end])
+            if n and (best is None or n > best[0]):
+                best = (n, key, i + 1, end, node, i)
+        if best is None:
+            break
+        n, key, start, end, node, store = best
+        value = stmts[store].args[1] if store is not None else None
+        if value is not None and isinstance(value.value, int) and not value.args:
+            var = value
+        else:
+            name = '_fwd_%d' % len(names)
+            names.append(name)
+            var = LLLnode(name, [], None, None, validate=False)
+            if store is None:
+                bindings.append([name, node, start])
+            else:
+                stores[store] = name
+        replace = lambda n, conditional: var if cse_info.get(n)[0] == key else None
+        stmts[start:end] = [walk_shareable(stmt, cse_info, replace) for stmt in stmts[start:end]]
+        changed = True
+        counters['sloads_removed'] += n
+    if not changed:
+        return None
+    # The value of a forwarded store is bound in place of the statement
+    # computing it, inside the loads bound before the same statement, which
+    # it may use
+    for i, name in stores.items():
+        stmt = stmts[i]
+        stmts[i] = LLLnode('sstore', [stmt.args[0], LLLnode(name, [], None, None, validate=False)], stmt.typ, stmt.location, validate=False)
+        bindings.insert(0, [name, stmt.args[1], i])
+    return bind_before(seq, stmts, bindings)
+
+# Storage forwarding: sloads of an address a seq has already read or written
+# earlier in its statements are replaced with the value read or written, as
+# long as no statement in between may write that slot or call out (see
+# get_slot_class for which addresses can be told apart). Addresses are only
+# forwarded under the same conditions as in share_subexpressions
+@register_pass('forward_storage')
+def forward_storage(lll, stats):
+    return bind_in_seqs(lll, forward_in_seq, stats)
+
+# Opcodes => positions of the address and the length of the memory they
+# read, besides those of mload and the scratch memory of the sha3s, and the
+# calls and exits, which eliminate_dead_stores takes to read all memory
+memory_reads = {
+    'sha3': (0, 1),
+    'log0': (0, 1),
+    'log1': (0, 1),
+    'log2': (0, 1),
+    'log3': (0, 1),
+    'log4': (0, 1),
+}
+
+# What a node may read that a store could have written: whether it calls out
+# or leaves the code, the slot classes of its sloads, and the ranges of the
+# memory it reads
+def get_store_reads(node):
+    barrier = False
+    sloads = []
+    reads = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        ranges = [(arg.value, arg.value) if isinstance(arg.value, int) and not arg.args else FULL_RANGE
+                  for arg in node.args]
+        if node.value in STORAGE_BARRIERS or node.value in EXIT_OPCODES:
+            barrier = True
+        elif node.value == 'sload':
+            sloads.append(get_slot_class(node.args[0]))
+        elif node.value == 'mload':
+            reads.append(get_memory_range(ranges[0], (32, 32)))
+        elif node.value in scratch_memory_writes:
+            reads.append(scratch_memory_writes[node.value])
+        elif node.value in memory_reads:
+            addr, length = memory_reads[node.value]
+            read = get_memory_range(ranges[addr], ranges[length])
+            if read is not None:
+                reads.append(read)
+        stack.extend(node.args if node.value != 'lll' else node.args[1:])
+    return barrier, sloads, reads
+
+# Drops the sstores and mstores among the statements of a seq that a later
+# statement of the seq overwrites before anything can read them: returns
+# the new seq, or None
+def eliminate_in_seq(seq, cse_info, counters):
+    stmts = list(seq.args)
+    store_reads = [get_store_reads(stmt) for stmt in stmts]
+    dead = []
+    for i, stmt in enumerate(stmts):
+        if stmt.value == 'sstore':
+            if not cse_info.get(stmt.args[0])[5]:
+                continue
+            cls = get_slot_class(stmt.args[0])
+            reads_slot = lambda reads: any(may_alias(sload, cls) for sload in reads[1])
+        elif stmt.value == 'mstore' and isinstance(stmt.args[0].value, int) and not stmt.args[0].args:
+            written = (stmt.args[0].value, stmt.args[0].value + 31)
+            reads_slot = lambda reads: any(ranges_overlap(r, written) for r in reads[2])
+        else:
+            continue
+        key = cse_info.get(stmt.args[0])[0]
+        for j in range(i + 1, len(stmts)):
+            if store_reads[j][0] or reads_slot(store_reads[j]):
+                break
+            if stmts[j].value == stmt.value and cse_info.get(stmts[j].args[0])[0] == key:
+                # The two addresses are the same if what they read from
+                # memory is not written in between
+                writes = get_memory_writes(stmts[i:j + 1])
+                if not any(ranges_overlap(r, w) for r in cse_info.get(stmt.args[0])[4] for w in writes):
+                    dead.append(i)
+                break
+    if not dead:
+        return None
+    for i in dead:
+        counters[stmts[i].value + 's_removed'] += 1
+        value = stmts[i].args[1]
+        stmts[i] = None if is_pure(value) else LLLnode('pop', [value], None, None, validate=False)
+    return LLLnode('seq', [stmt for stmt in stmts if stmt is not None], seq.typ, seq.location, validate=False)
+
+# Dead store elimination: an sstore or mstore whose slot or word is written
+# again later in the same seq is dropped, keeping the effects of computing its
+# value, as long as nothing in between may read it, call out or leave the
+# code. An sstore to an address that is not made of CSE_OPCODES, or an mstore
+# to an address that is not a number, is kept
+@register_pass('eliminate_dead_stores')
+def eliminate_dead_stores(lll, stats):
+    cse_info = CSEInfo()
+    def eliminate(node):
+        if node.value != 'seq':
+            return node
+        return eliminate_in_seq(node, cse_info, stats.counters) or node
+    return transform(lll, eliminate)
+
+# Whether a node, given whether each of its arguments does, leaves the code
+# (or its loop, for a break) on every path through it
+def always_exits(node, arg_exits):
+    if node.value in EXIT_OPCODES:
+        return True
+    elif node.value == 'assert' and get_constant(node.args[0]) == 0:
+        return True
+    elif node.value == 'if':
+        return arg_exits[0] or (len(node.args) == 3 and arg_exits[1] and arg_exits[2])
+    elif node.value == 'repeat':
+        return any(arg_exits[:3])
+    elif node.value == 'lll':
+        return arg_exits[1]
+    return any(arg_exits)
+
+# Dead code elimination: ifs on a constant condition are replaced by the
+# branch taken, and statements of a seq after one that always leaves the
+# code are dropped (except the last, if it is the value of the seq). The
+# labels and instructions this leaves unreachable in the assembly are
+# dropped by Optimizer.optimize_assembly
+@register_pass('eliminate_dead_code')
+def eliminate_dead_code(lll, stats):
+    # id(node) => whether it always exits, for the nodes built so far, which
+    # are kept so that their ids stay theirs
+    exits = {}
+    nodes = []
+    def eliminate(node):
+        if node.value == 'if' and get_constant(node.args[0]) is not None:
+            stats.counters['ifs_folded'] += 1
+            if get_constant(node.args[0]):
+                return node.args[1]
+            elif len(node.args) == 3:
+                return node.args[2]
+            node = LLLnode('pass', [], None, None, validate=False)
+        elif node.value == 'seq':
+            ends = [i for i, arg in enumerate(node.args) if exits[id(arg)]]
+            keep = len(node.args) - 1 if node.valency else len(node.args)
+            if ends and ends[0] + 1 < keep:
+                stats.counters['statements_dropped'] += keep - ends[0] - 1
+                args = node.args[:ends[0] + 1] + node.args[keep:]
+                node = LLLnode('seq', args, node.typ, node.location, validate=False)
+        exits[id(node)] = always_exits(node, [exits[id(arg)] for arg in node.args])
+        nodes.append(node)
+        return node
+    return transform(lll, eliminate)
@@ -1,18 +1,13 @@
-try:
-    from Crypto.Hash import keccak
-    sha3_256 = lambda x: keccak.new(digest_bits=256, data=x).digest()
-except ImportError:
-    import sha3
-    sha3_256 = lambda x: sha3._sha3.sha3_256(x).digest()
-
 import ast, tokenize, binascii
+import collections, functools, threading
 from io import BytesIO
-from .opcodes import opcodes, pseudo_opcodes
+from . import __version__
+from .opcodes import opcode_records, get_opcode_id
 import copy
 from .types import NodeType, BaseType, ListType, MappingType, StructType, \
     MixedType, NullType, ByteArrayType
 from .types import base_types, parse_type, canonicalize_type, is_base_type, \
-    is_numeric_type, get_size_of_type, is_varname_valid
+    is_numeric_type, get_size_of_type, get_storage_size_of_type, is_varname_valid
 from .types import combine_units, are_units_compatible, set_default_units
 from .types import InvalidTypeException, TypeMismatchException
 
@@ -21,6 +16,19 @@ try:
 except:
     raise Exception("Requires python 3.6 or higher for annotation support")
 
+# Keccak backend, loaded on first use as importing it is slow
+_keccak = []
+
+def sha3_256(x):
+    if not _keccak:
+        try:
+            from Crypto.Hash import keccak
+            _keccak.append(lambda x: keccak.new(digest_bits=256, data=x).digest())
+        except ImportError:
+            import sha3
+            _keccak.append(lambda x: sha3._sha3.sha3_256(x).digest())
+    return _keccak[0](x)
+
 # Converts code to parse tree
 def parse(code):
     return ast.parse(code).body
@@ -42,14 +50,34 @@ def hex_to_int(inp):
         o = o * 256 + b
     return o
 
+# Valency of a node that is a statement (if, with, repeat, seq, multi) or a
+# variable, given its already validated arguments
+def get_statement_valency(value, args):
+    if value == 'if' or value == 'with':
+        return args[-1].valency
+    elif value == 'repeat':
+        return 0
+    elif value == 'seq':
+        return args[-1].valency if args else 0
+    elif value == 'multi':
+        return sum([arg.valency for arg in args])
+    else:
+        return 1
+
 # Data structure for LLL parse tree
 class LLLnode():
-    def __init__(self, value, args=[], typ=None, location=None):
+    __slots__ = ('value', 'args', 'typ', 'location', 'valency', 'opcode')
+
+    # validate=False skips the argument checks below, for nodes built by
+    # compiler passes out of already validated nodes
+    def __init__(self, value, args=[], typ=None, location=None, validate=True):
         self.value = value
         self.args = args
         self.typ = typ
         assert isinstance(self.typ, NodeType) or self.typ is None, repr(self.typ)
         self.location = location
+        # ID of the opcode or pseudo-opcode (see opcodes.opcode_ids), if any
+        self.opcode = None
         # Determine this node's valency (1 if it pushes a value on the stack,
         # 0 otherwise) and checks to make sure the number and valencies of
         # children are correct
@@ -57,15 +85,19 @@ class LLLnode():
         if isinstance(self.value, int):
             self.valency = 1
         elif isinstance(self.value, str):
+            self.opcode = get_opcode_id(self.value)
             # Opcodes and pseudo-opcodes (eg. clamp)
-            if self.value.upper() in opcodes or self.value.upper() in pseudo_opcodes:
-                record = opcodes.get(self.value.upper(), pseudo_opcodes.get(self.value.upper(), None))
+            if self.opcode is not None:
+                record = opcode_records[self.opcode]
                 self.valency = record[2]
-                if len(self.args) != record[1]:
-                    raise Exception("Number of arguments mismatched: %r %r" % (self.value, self.args))
-                for arg in self.args:
-                    if arg.valency == 0:
-                        raise Exception("Can't have a zerovalent argument to an opcode or a pseudo-opcode! %r" % arg)
+                if validate:
+                    if len(self.args) != record[1]:
+                        raise Exception("Number of arguments mismatched: %r %r" % (self.value, self.args))
+                    for arg in self.args:
+                        if arg.valency == 0:
+                            raise Exception("Can't have a zerovalent argument to an opcode or a pseudo-opcode! %r" % arg)
+            elif not validate:
+                self.valency = get_statement_valency(self.value, self.args)
             # If statements
             elif self.value == 'if':
                 if len(self.args) == 3:
@@ -116,36 +148,127 @@ class LLLnode():
             raise Exception("Invalid value for LLL AST node: %r" % self.value)
         assert isinstance(self.args, list)
 
+    # The traversals below use explicit stacks rather than recursion, so that
+    # arbitrarily deep trees do not hit Python's recursion limit
+
     def to_list(self):
-        return [self.value] + [a.to_list() for a in self.args]
+        o = [self.value]
+        stack = [(self, o)]
+        while stack:
+            node, out = stack.pop()
+            for arg in node.args:
+                sub = [arg.value]
+                out.append(sub)
+                stack.append((arg, sub))
+        return o
 
+    # Pretty-prints the node: subtrees whose list form fits in less than 80
+    # characters go on one line, bigger ones are split with one argument per
+    # line, indented by two spaces
     def repr(self):
-        x = repr(self.to_list())
-        if len(x) < 80:
-            return x
-        o = '[' + repr(self.value) + ',\n  '
-        for arg in self.args:
-            sub = arg.repr().replace('\n', '\n  ').strip(' ')
-            o += sub + '\n  '
-        return o.rstrip(' ') + ']'
+        # First work out the one-line form of each subtree, or None if it is
+        # too long, bottom-up
+        flat = {}
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in flat:
+                continue
+            if not expanded and node.args:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in node.args)
+                continue
+            subs = [flat[id(arg)] for arg in node.args]
+            x = None
+            if None not in subs:
+                x = '[' + ', '.join([repr(node.value)] + subs) + ']'
+                if len(x) >= 80:
+                    x = None
+            flat[id(node)] = x
+        # Then lay out the lines top-down
+        lines = []
+        stack = [(self, 0)]
+        while stack:
+            node, indent = stack.pop()
+            if isinstance(node, str):
+                lines.append(' ' * indent + node)
+            elif flat[id(node)] is not None:
+                lines.append(' ' * indent + flat[id(node)])
+            else:
+                lines.append(' ' * indent + '[' + repr(node.value) + ',')
+                stack.append((']', indent))
+                stack.extend((arg, indent + 2) for arg in reversed(node.args))
+        return '\n'.join(lines)
 
     def __repr__(self):
         return self.repr()
 
     @classmethod
-    def from_list(cls, obj, typ=None, location=None):
+    def from_list(cls, obj, typ=None, location=None, validate=True):
         if isinstance(typ, str):
             typ = BaseType(typ)
-        if isinstance(obj, LLLnode):
-            return obj
-        elif not isinstance(obj, list):
-            return cls(obj, [], typ, location)
+        # Nodes are built bottom-up: a list is expanded into its elements, and
+        # once those are built, its node is made out of the last len(list) - 1
+        # results
+        results = []
+        stack = [(obj, typ, location, False)]
+        while stack:
+            o, typ, location, expanded = stack.pop()
+            if isinstance(o, LLLnode):
+                results.append(o)
+            elif not isinstance(o, list):
+                results.append(cls(o, [], typ, location, validate))
+            elif not expanded:
+                stack.append((o, typ, location, True))
+                stack.extend((x, None, None, False) for x in reversed(o[1:]))
+            else:
+                args = results[len(results) - len(o) + 1:]
+                del results[len(results) - len(o) + 1:]
+                results.append(cls(o[0], args, typ, location, validate))
+        return results[0]
+
+# Hash-consing LLL constructor: structurally identical subtrees (same value,
+# arguments, type and location) are built as one shared node, so that a tree
+# becomes a DAG. Nodes made by an interner must not be mutated afterwards
+class LLLInterner():
+    def __init__(self):
+        self.nodes = {}
+        self.hits = 0
+
+    # Arguments must themselves come from this interner
+    def node(self, value, args=[], typ=None, location=None, validate=True):
+        key = (value.__class__, value, tuple([id(arg) for arg in args]), typ.__class__, repr(typ), location)
+        o = self.nodes.get(key)
+        if o is None:
+            o = self.nodes[key] = LLLnode(value, args, typ, location, validate)
         else:
-            return cls(obj[0], [cls.from_list(o) for o in obj[1:]], typ, location)
+            self.hits += 1
+        return o
+
+    # Returns the DAG form of an (already validated) tree, built bottom-up
+    def intern(self, code):
+        interned = {}
+        stack = [(code, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in interned:
+                continue
+            if expanded or not node.args:
+                args = [interned[id(arg)] for arg in node.args]
+                interned[id(node)] = self.node(node.value, args, node.typ, node.location, validate=False)
+            else:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in node.args)
+        return interned[id(code)]
 
 # A decimal value can store multiples of 1/DECIMAL_DIVISOR
 DECIMAL_DIVISOR = 10000000000
 
+# Largest magnitudes of num and decimal values, and of a signed 256-bit word
+MAXNUM = 2**128 - 1
+MAXDECIMAL = MAXNUM * DECIMAL_DIVISOR
+MAX_WORD = 2**255 - 1
+
 # Number of bytes in memory used for system purposes, not for variables
 RESERVED_MEMORY = 256
 ADDRSIZE_POS = 32
@@ -163,10 +286,16 @@ class StructureException(Exception):
 class ConstancyViolationException(Exception):
     pass
 
-# Parse top-level functions and variables
+class ConstantClampException(Exception):
+    pass
+
+# Parse top-level functions and variables. Globals are laid out in storage in
+# the order they are declared, each taking up get_storage_size_of_type slots
+# from the first free one
 def get_defs_and_globals(code):
     _globals = {}
     _defs = []
+    next_slot = 0
     for item in code:
         if isinstance(item, ast.AnnAssign):
             if not isinstance(item.target, ast.Name):
@@ -175,11 +304,15 @@ def get_defs_and_globals(code):
                 raise VariableDeclarationException("Cannot declare a persistent variable twice!")
             if len(_defs):
                 raise StructureException("Global variables must all come before function definitions")
-            _globals[item.target.id] = (len(_globals), parse_type(item.annotation, 'storage'))
+            typ = parse_type(item.annotation, 'storage')
+            _globals[item.target.id] = (next_slot, typ)
+            next_slot += get_storage_size_of_type(typ)
         elif isinstance(item, ast.FunctionDef):
             _defs.append(item)
         else:
             raise StructureException("Invalid top-level statement")
+    if len(set([_def.name for _def in _defs])) < len(_defs):
+        raise VariableDeclarationException("Duplicate function name!")
     return _defs, _globals
 
 # Header code
@@ -238,15 +371,24 @@ def get_func_details(code):
     # Output type can only be base type or none
     assert isinstance(output_type, (BaseType, ByteArrayType, (None).__class__))
     # Get the four-byte method id
-    sig = name + '(' + ','.join([canonicalize_type(parse_type(arg.annotation, None)) for arg in code.args.args]) + ')'
-    method_id = fourbytes_to_int(sha3_256(bytes(sig, 'utf-8'))[:4])
-    return name, args, output_type, const, sig, method_id
+    sig = name + '(' + ','.join([canonicalize_type(typ) for nam, loc, typ in args]) + ')'
+    return name, args, output_type, const, sig, get_method_id(sig)
+
+# Four-byte method id of a canonical signature
+@functools.lru_cache(maxsize=4096)
+def get_method_id(sig):
+    return fourbytes_to_int(sha3_256(bytes(sig, 'utf-8'))[:4])
+
+# Per-compilation table of function details, so that they are worked out once
+# and shared between lowering, the ABI and gas estimation
+def mk_signature_table(_defs):
+    return {_def.name: get_func_details(_def) for _def in _defs}
 
 # Contains arguments, variables, etc
 class Context():
     def __init__(self, args=None, vars=None, globals=None, forvars=None, return_type=None, is_constant=False):
         self.args = args or {}
-        self.vars = vars or {}
+        self.vars = vars if vars is not None else {}
         self.globals = globals or {}
         self.forvars = forvars or {}
         self.return_type = return_type
@@ -269,13 +411,13 @@ class Context():
 def is_initializer(code):
     return code.name == '__init__'
 
-# Parses a function declaration
-def parse_func(code, _globals, _vars=None):
-    name, args, output_type, const, sig, method_id = get_func_details(code)
+# Parses a function declaration; details are as returned by get_func_details
+def parse_func(code, _globals, _vars=None, details=None):
+    name, args, output_type, const, sig, method_id = details or get_func_details(code)
     for arg in args:
         if arg[0] in _globals:
             raise VariableDeclarationException("Variable name duplicated between function arguments and globals: "+arg[0])
-    context = Context(args={a[0]: (a[1], a[2]) for a in args}, globals=_globals, vars=_vars or {}, return_type=output_type, is_constant=const)
+    context = Context(args={a[0]: (a[1], a[2]) for a in args}, globals=_globals, vars=_vars, return_type=output_type, is_constant=const)
     if name == '__init__':
         return parse_body(code.body, context)
     else:
@@ -284,12 +426,109 @@ def parse_func(code, _globals, _vars=None):
                                     ['seq'] + [parse_body(c, context) for c in code.body]
                                  ], typ=None)
 
+# Cache of lowered functions, so that recompiling a contract in which only a
+# few functions changed only re-lowers those functions. Entries are keyed on
+# the function's AST dump, the globals layout and the compiler version, and
+# the least recently used entries are evicted once there are more than maxsize
+class FunctionCache():
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def key(self, code, globals_key):
+        return (ast.dump(code), globals_key, __version__)
+
+    # Returns the cached (lll, vars) for a key, or None
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, key, lll, varz):
+        with self.lock:
+            self.entries[key] = (lll, varz)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    # Same interface as parse_func; _vars is filled in on a hit as well
+    def parse_func(self, code, _globals, _vars=None, details=None, globals_key=None):
+        key = self.key(code, get_globals_key(_globals) if globals_key is None else globals_key)
+        entry = self.get(key)
+        if entry is None:
+            entry = parse_func_with_vars(code, _globals, details)
+            self.put(key, *entry)
+        lll, varz = entry
+        if _vars is not None:
+            _vars.update(varz)
+        return lll
+
+# Process-wide function cache used by parse_tree_to_lll
+function_cache = FunctionCache()
+
+# Lowers a function, returning its LLL along with its memory layout. Top-level
+# so that it can be sent to worker processes
+def parse_func_with_vars(code, _globals, details=None):
+    varz = {}
+    return parse_func(code, _globals, varz, details), varz
+
+# Same as parse_func_with_vars, with the LLL in its compact binary form (see
+# viper.serialize), which is much smaller than the pickled tree
+def parse_func_serialized(code, _globals, details=None):
+    from .serialize import dumps_lll
+    lll, varz = parse_func_with_vars(code, _globals, details)
+    return dumps_lll(lll), varz
+
+# Lowers a list of functions, in order, returning (lll, vars) for each.
+# Functions found in the cache are reused; the rest are lowered on the
+# executor if one is given (eg. a concurrent.futures.ProcessPoolExecutor),
+# and otherwise in this process. sigs is a table from mk_signature_table
+def parse_funcs(_defs, _globals, cache=None, executor=None, sigs=None):
+    o = [None] * len(_defs)
+    if cache is not None:
+        globals_key = get_globals_key(_globals)
+        keys = [cache.key(_def, globals_key) for _def in _defs]
+        for i, key in enumerate(keys):
+            o[i] = cache.get(key)
+    todo = [i for i in range(len(_defs)) if o[i] is None]
+    details = [sigs[_defs[i].name] if sigs else None for i in todo]
+    if executor is not None and len(todo) > 1:
+        from .serialize import loads_lll
+        entries = ((loads_lll(blob), varz) for blob, varz in
+                   executor.map(parse_func_serialized, [_defs[i] for i in todo], [_globals] * len(todo), details))
+    else:
+        entries = (parse_func_with_vars(_defs[i], _globals, d) for i, d in zip(todo, details))
+    for i, entry in zip(todo, entries):
+        o[i] = entry
+        if cache is not None:
+            cache.put(keys[i], *entry)
+    return o
+
+# Serializes the globals layout, for use as part of a function cache key
+def get_globals_key(_globals):
+    return repr([(k, v[0], v[1]) for k, v in sorted(_globals.items())])
+
 # Get ABI signature
 def mk_full_signature(code):
-    o = []
     _defs, _globals = get_defs_and_globals(code)
+    return mk_full_signature_from_defs(_defs)
+
+def mk_full_signature_from_defs(_defs, sigs=None):
+    o = []
     for code in _defs:
-        name, args, output_type, const, sig, method_id = get_func_details(code)
+        name, args, output_type, const, sig, method_id = sigs[code.name] if sigs else get_func_details(code)
         o.append({
             "name": sig,
             "outputs": [{"type": canonicalize_type(output_type), "name": "out"}] if output_type else [],
@@ -299,24 +538,31 @@ def mk_full_signature(code):
         })
     return o
         
-# Main python parse tree => LLL method
-def parse_tree_to_lll(code):
+# Main python parse tree => LLL method. Functions are lowered through the
+# given FunctionCache (pass cache=None to always lower from scratch) and, if
+# an executor is given, in parallel on it; the output is the same either way.
+# With an interner, identical subtrees of the result are shared (see LLLInterner)
+def parse_tree_to_lll(code, cache=function_cache, executor=None, interner=None):
     _defs, _globals = get_defs_and_globals(code)
-    if len(set([_def.name for _def in _defs])) < len(_defs):
-        raise VariableDeclarationException("Duplicate function name!")
+    sigs = mk_signature_table(_defs)
+    lll = mk_contract_lll(_defs, [lll for lll, varz in parse_funcs(_defs, _globals, cache, executor, sigs)])
+    return interner.intern(lll) if interner is not None else lll
+
+# Puts the whole contract together from its functions and their LLL
+def mk_contract_lll(_defs, lowered):
     # Initialization function
-    initfunc = [_def for _def in _defs if is_initializer(_def)]
+    initfunc = [lll for _def, lll in zip(_defs, lowered) if is_initializer(_def)]
     # Regular functions
-    otherfuncs = [_def for _def in _defs if not is_initializer(_def)]
+    otherfuncs = [lll for _def, lll in zip(_defs, lowered) if not is_initializer(_def)]
     if not initfunc and not otherfuncs:
         return LLLnode.from_list('pass')
     if not initfunc and otherfuncs:
-        return LLLnode.from_list(['return', 0, ['lll', ['seq', mk_initial()] + [parse_func(_def, _globals) for _def in otherfuncs], 0]], typ=None)
+        return LLLnode.from_list(['return', 0, ['lll', ['seq', mk_initial()] + otherfuncs, 0]], typ=None)
     elif initfunc and not otherfuncs:
-        return LLLnode.from_list(['seq', mk_initial(), parse_func(initfunc[0], _globals), ['selfdestruct']], typ=None)
+        return LLLnode.from_list(['seq', mk_initial(), initfunc[0], ['selfdestruct']], typ=None)
     elif initfunc and otherfuncs:
-        return LLLnode.from_list(['seq', mk_initial(), parse_func(initfunc[0], _globals),
-                                    ['return', 0, ['lll', ['seq', mk_initial()] + [parse_func(_def, _globals) for _def in otherfuncs], 0]]],
+        return LLLnode.from_list(['seq', mk_initial(), initfunc[0],
+                                    ['return', 0, ['lll', ['seq', mk_initial()] + otherfuncs, 0]]],
                                  typ=None)
     
 # Parse a piece of code
@@ -343,7 +589,8 @@ def add_variable_offset(parent, key):
             raise TypeMismatchException("Member %s not found. Only the following available: %s" % (expr.attr, " ".join(attrs)))
         index = attrs.index(key)
         if location == 'storage':
-            return LLLnode.from_list(['add', ['sha3_32', parent], index],
+            offset = sum([get_storage_size_of_type(typ.members[attrs[i]]) for i in range(index)])
+            return LLLnode.from_list(['add', parent, offset],
                                      typ=subtype,
                                      location='storage')
         elif location == 'memory':
@@ -363,7 +610,12 @@ def add_variable_offset(parent, key):
             subtype = typ.valuetype
             sub = base_type_conversion(key, key.typ, typ.keytype)
         if location == 'storage':
-           return LLLnode.from_list(['add', ['sha3_32', parent], sub],
+            if isinstance(typ, MappingType):
+                return LLLnode.from_list(['sha3_64', parent, sub],
+                                         typ=subtype,
+                                         location='storage')
+            size = get_storage_size_of_type(subtype)
+            return LLLnode.from_list(['add', parent, ['mul', size, sub] if size > 1 else sub],
                                      typ=subtype,
                                      location='storage')
         elif location == 'memory':
@@ -493,76 +745,7 @@ def parse_expr(expr, context):
         return add_variable_offset(sub, index)
     # Arithmetic operations
     elif isinstance(expr, ast.BinOp):
-        left = parse_value_expr(expr.left, context)
-        right = parse_value_expr(expr.right, context)
-        if not is_numeric_type(left.typ) or not is_numeric_type(right.typ):
-            raise TypeMismatchException("Unsupported type for arithmetic op: "+typ)
-        ltyp, rtyp = left.typ.typ, right.typ.typ
-        if isinstance(expr.op, (ast.Add, ast.Sub)):
-            if left.typ.unit != right.typ.unit and left.typ.unit is not None and right.typ.unit is not None:
-                raise TypeMismatchException("Unit mismatch: %r %r" % (left.typ.unit, right.typ.unit))
-            if left.typ.positional and right.typ.positional and isinstance(expr.op, ast.Add):
-                raise TypeMismatchException("Cannot add two positional units!")
-            new_unit = left.typ.unit or right.typ.unit
-            new_positional = left.typ.positional ^ right.typ.positional # xor, as subtracting two positionals gives a delta
-            op = 'add' if isinstance(expr.op, ast.Add) else 'sub'
-            if ltyp == rtyp:
-                o = LLLnode.from_list([op, left, right], typ=BaseType(ltyp, new_unit, new_positional))
-            elif ltyp == 'num' and rtyp == 'decimal':
-                o = LLLnode.from_list([op, ['mul', left, DECIMAL_DIVISOR], right],
-                                      typ=BaseType('decimal', new_unit, new_positional))
-            elif ltyp == 'decimal' and rtyp == 'num':
-                o = LLLnode.from_list([op, left, ['mul', right, DECIMAL_DIVISOR]],
-                                      typ=BaseType('decimal', new_unit, new_positional))
-            else:
-                raise Exception("How did I get here? %r %r" % (ltyp, rtyp))
-        elif isinstance(expr.op, ast.Mult):
-            if left.typ.positional or right.typ.positional:
-                raise TypeMismatchException("Cannot multiply positional values!")
-            new_unit = combine_units(left.typ.unit, right.typ.unit)
-            if ltyp == rtyp == 'num':
-                o = LLLnode.from_list(['mul', left, right], typ=BaseType('num', new_unit))
-            elif ltyp == rtyp == 'decimal':
-                o = LLLnode.from_list(['with', 'r', right, ['with', 'l', left,
-                                        ['with', 'ans', ['mul', 'l', 'r'],
-                                            ['seq',
-                                                ['assert', ['or', ['eq', ['sdiv', 'ans', 'l'], 'r'], ['not', 'l']]],
-                                                ['sdiv', 'ans', DECIMAL_DIVISOR]]]]], typ=BaseType('decimal', new_unit))
-            elif (ltyp == 'num' and rtyp == 'decimal') or (ltyp == 'decimal' and rtyp == 'num'):
-                o = LLLnode.from_list(['with', 'r', right, ['with', 'l', left,
-                                        ['with', 'ans', ['mul', 'l', 'r'],
-                                            ['seq',
-                                                ['assert', ['or', ['eq', ['sdiv', 'ans', 'l'], 'r'], ['not', 'l']]],
-                                                'ans']]]], typ=BaseType('decimal', new_unit))
-        elif isinstance(expr.op, ast.Div):
-            if left.typ.positional or right.typ.positional:
-                raise TypeMismatchException("Cannot divide positional values!")
-            new_unit = combine_units(left.typ.unit, right.typ.unit, div=True)
-            if rtyp == 'num':
-                o = LLLnode.from_list(['sdiv', left, ['clamp_nonzero', right]], typ=BaseType(ltyp, new_unit))
-            elif ltyp == rtyp == 'decimal':
-                o = LLLnode.from_list(['with', 'l', left, ['with', 'r', ['clamp_nonzero', right],
-                                            ['sdiv', ['mul', 'l', DECIMAL_DIVISOR], 'r']]],
-                                      typ=BaseType('decimal', new_unit))
-            elif ltyp == 'num' and rtyp == 'decimal':
-                o = LLLnode.from_list(['sdiv', ['mul', left, DECIMAL_DIVISOR ** 2], ['clamp_nonzero', right]],
-                                      typ=BaseType('decimal', new_unit))
-        elif isinstance(expr.op, ast.Mod):
-            if left.typ.positional or right.typ.positional:
-                raise TypeMismatchException("Cannot use positional values as modulus arguments!")
-            if left.typ.unit != right.typ.unit and left.typ.unit is not None and right.typ.unit is not None:
-                raise TypeMismatchException("Modulus arguments must have same unit")
-            new_unit = left.typ.unit or right.typ.unit
-            if ltyp == rtyp:
-                o = LLLnode.from_list(['smod', left, ['clamp_nonzero', right]], typ=BaseType(ltyp, new_unit))
-            elif ltyp == 'decimal' and rtyp == 'num':
-                o = LLLnode.from_list(['smod', left, ['mul', ['clamp_nonzero', right], DECIMAL_DIVISOR]],
-                                      typ=BaseType('decimal', new_unit))
-            elif ltyp == 'num' and rtyp == 'decimal':
-                o = LLLnode.from_list(['smod', ['mul', left, DECIMAL_DIVISOR], right],
-                                      typ=BaseType('decimal', new_unit))
-        else:
-            raise Exception("Unsupported binop: %r" % expr.op)
+        return parse_arithmetic(expr, context)[0]
     # Comparison operations
     elif isinstance(expr, ast.Compare):
         left = parse_value_expr(expr.left, context)
@@ -650,7 +833,7 @@ def parse_expr(expr, context):
         elif isinstance(expr.func, ast.Name) and expr.func.id == "as_number":
             sub = parse_value_expr(expr.args[0], context)
             if is_base_type(sub.typ, ('num', 'decimal')):
-                return LLLnode(value=sub.value, args=sub.args, typ=BaseType(sub.typ.typ, {}))
+                return LLLnode(value=sub.value, args=sub.args, typ=BaseType(sub.typ.typ, {}), validate=False)
             else:
                 raise TypeMismatchException("as_number only accepts base types")
         else:
@@ -708,6 +891,125 @@ def parse_variable_location(expr, context):
         raise Exception("Looking for a variable location, instead got a value")
     return o
 
+# Each arithmetic expression on num and decimal values carries a bound on
+# its magnitude, so that products involving a decimal are only checked for
+# overflowing a word where the bounds of their operands allow it
+def numeric_bound(typ):
+    return MAXDECIMAL if is_base_type(typ, 'decimal') else MAXNUM
+
+# An operand of an arithmetic expression, with a bound on its magnitude
+def parse_arithmetic_operand(expr, context):
+    if isinstance(expr, ast.BinOp):
+        return parse_arithmetic(expr, context)
+    o = parse_value_expr(expr, context)
+    if isinstance(o.value, int) and not o.args:
+        return o, abs(o.value)
+    return o, numeric_bound(o.typ)
+
+# Multiplies l and r, failing if the product overflows a word, then applies
+# finish to the product, ans
+def mk_checked_mul(left, right, finish, typ):
+    return LLLnode.from_list(['with', 'r', right, ['with', 'l', left,
+                                ['with', 'ans', ['mul', 'l', 'r'],
+                                    ['seq',
+                                        ['assert', ['or', ['eq', ['sdiv', 'ans', 'l'], 'r'], ['iszero', 'l']]],
+                                        finish]]]], typ=typ)
+
+# Lowers an arithmetic expression: returns the LLL and a bound on the
+# magnitude of its value
+def parse_arithmetic(expr, context):
+    left, lbound = parse_arithmetic_operand(expr.left, context)
+    right, rbound = parse_arithmetic_operand(expr.right, context)
+    if not is_numeric_type(left.typ) or not is_numeric_type(right.typ):
+        raise TypeMismatchException("Unsupported types for arithmetic op: %r %r" % (left.typ, right.typ))
+    ltyp, rtyp = left.typ.typ, right.typ.typ
+    # Largest magnitude of any value the operation computes, given the bounds
+    # of its operands, and of its result
+    if isinstance(expr.op, (ast.Add, ast.Sub)):
+        lscale = DECIMAL_DIVISOR if ltyp == 'num' and rtyp == 'decimal' else 1
+        rscale = DECIMAL_DIVISOR if ltyp == 'decimal' and rtyp == 'num' else 1
+        worst = lambda l, r: l * lscale + r * rscale
+    elif isinstance(expr.op, ast.Mult):
+        worst = lambda l, r: l * r
+    elif isinstance(expr.op, ast.Div):
+        scale = {('decimal', 'decimal'): DECIMAL_DIVISOR, ('num', 'decimal'): DECIMAL_DIVISOR ** 2}.get((ltyp, rtyp), 1)
+        worst = lambda l, r: l * scale
+    elif isinstance(expr.op, ast.Mod):
+        lscale = DECIMAL_DIVISOR if ltyp == 'num' and rtyp == 'decimal' else 1
+        rscale = DECIMAL_DIVISOR if ltyp == 'decimal' and rtyp == 'num' else 1
+        worst = lambda l, r: max(l * lscale, r * rscale)
+    else:
+        raise Exception("Unsupported binop: %r" % expr.op)
+    bound = worst(lbound, rbound)
+    # Products involving a decimal that can overflow a word are checked, and
+    # then within a word
+    checked = bound > MAX_WORD and 'decimal' in (ltyp, rtyp)
+    bound = min(bound, MAX_WORD)
+    if isinstance(expr.op, (ast.Add, ast.Sub)):
+        if left.typ.unit != right.typ.unit and left.typ.unit is not None and right.typ.unit is not None:
+            raise TypeMismatchException("Unit mismatch: %r %r" % (left.typ.unit, right.typ.unit))
+        if left.typ.positional and right.typ.positional and isinstance(expr.op, ast.Add):
+            raise TypeMismatchException("Cannot add two positional units!")
+        new_unit = left.typ.unit or right.typ.unit
+        new_positional = left.typ.positional ^ right.typ.positional # xor, as subtracting two positionals gives a delta
+        op = 'add' if isinstance(expr.op, ast.Add) else 'sub'
+        if ltyp == rtyp:
+            o = LLLnode.from_list([op, left, right], typ=BaseType(ltyp, new_unit, new_positional))
+        elif ltyp == 'num' and rtyp == 'decimal':
+            o = LLLnode.from_list([op, ['mul', left, DECIMAL_DIVISOR], right],
+                                  typ=BaseType('decimal', new_unit, new_positional))
+        elif ltyp == 'decimal' and rtyp == 'num':
+            o = LLLnode.from_list([op, left, ['mul', right, DECIMAL_DIVISOR]],
+                                  typ=BaseType('decimal', new_unit, new_positional))
+        else:
+            raise Exception("How did I get here? %r %r" % (ltyp, rtyp))
+    elif isinstance(expr.op, ast.Mult):
+        if left.typ.positional or right.typ.positional:
+            raise TypeMismatchException("Cannot multiply positional values!")
+        new_unit = combine_units(left.typ.unit, right.typ.unit)
+        if ltyp == rtyp == 'decimal':
+            if checked:
+                o = mk_checked_mul(left, right, ['sdiv', 'ans', DECIMAL_DIVISOR], BaseType('decimal', new_unit))
+            else:
+                o = LLLnode.from_list(['sdiv', ['mul', left, right], DECIMAL_DIVISOR], typ=BaseType('decimal', new_unit))
+            bound //= DECIMAL_DIVISOR
+        else:
+            typ = BaseType('num' if ltyp == rtyp == 'num' else 'decimal', new_unit)
+            if checked:
+                o = mk_checked_mul(left, right, 'ans', typ)
+            else:
+                o = LLLnode.from_list(['mul', left, right], typ=typ)
+    elif isinstance(expr.op, ast.Div):
+        if left.typ.positional or right.typ.positional:
+            raise TypeMismatchException("Cannot divide positional values!")
+        new_unit = combine_units(left.typ.unit, right.typ.unit, div=True)
+        if rtyp == 'num':
+            o = LLLnode.from_list(['sdiv', left, ['clamp_nonzero', right]], typ=BaseType(ltyp, new_unit))
+        elif ltyp == rtyp == 'decimal':
+            o = LLLnode.from_list(['with', 'l', left, ['with', 'r', ['clamp_nonzero', right],
+                                        ['sdiv', ['mul', 'l', DECIMAL_DIVISOR], 'r']]],
+                                  typ=BaseType('decimal', new_unit))
+        elif ltyp == 'num' and rtyp == 'decimal':
+            o = LLLnode.from_list(['sdiv', ['mul', left, DECIMAL_DIVISOR ** 2], ['clamp_nonzero', right]],
+                                  typ=BaseType('decimal', new_unit))
+    elif isinstance(expr.op, ast.Mod):
+        if left.typ.positional or right.typ.positional:
+            raise TypeMismatchException("Cannot use positional values as modulus arguments!")
+        if left.typ.unit != right.typ.unit and left.typ.unit is not None and right.typ.unit is not None:
+            raise TypeMismatchException("Modulus arguments must have same unit")
+        new_unit = left.typ.unit or right.typ.unit
+        if ltyp == rtyp:
+            o = LLLnode.from_list(['smod', left, ['clamp_nonzero', right]], typ=BaseType(ltyp, new_unit))
+        elif ltyp == 'decimal' and rtyp == 'num':
+            o = LLLnode.from_list(['smod', left, ['mul', ['clamp_nonzero', right], DECIMAL_DIVISOR]],
+                                  typ=BaseType('decimal', new_unit))
+        elif ltyp == 'num' and rtyp == 'decimal':
+            o = LLLnode.from_list(['smod', ['mul', left, DECIMAL_DIVISOR], right],
+                                  typ=BaseType('decimal', new_unit))
+    else:
+        raise Exception("Unsupported binop: %r" % expr.op)
+    return o, bound
+
 # Parse an expression that results in a value
 def parse_value_expr(expr, context):
     return unwrap_location(parse_expr(expr, context))
@@ -718,7 +1020,7 @@ def base_type_conversion(orig, frm, to):
     if not isinstance(frm, (BaseType, NullType)) or not isinstance(to, BaseType):
         raise TypeMismatchException("Base type conversion from or to non-base type: %r %r" % (frm, to))
     elif is_base_type(frm, to.typ) and are_units_compatible(frm, to):
-        return LLLnode(orig.value, orig.args, typ=to)
+        return LLLnode(orig.value, orig.args, typ=to, validate=False)
     elif is_base_type(frm, 'num') and is_base_type(to, 'decimal') and are_units_compatible(frm, to):
         return LLLnode.from_list(['mul', orig, DECIMAL_DIVISOR], typ=BaseType('decimal', to.unit, to.positional))
     elif isinstance(frm, NullType):
@@ -0,0 +1,447 @@
+from .parser import LLLnode, get_statement_valency
+from .opcodes import opcode_names, opcode_records, get_opcode_id
+from .types import BaseType, ByteArrayType, ListType, MappingType, StructType, MixedType, NullType
+
+# Compact binary form of LLL trees and assembly, for moving them between
+# processes and caches without pickling. A blob is laid out as:
+#
+#   magic (4 bytes) | version (1 byte) | kind (1 byte)
+#   constant pool:  count, then each integer as a varint (length << 1 | sign)
+#                   followed by its magnitude in that many big-endian bytes
+#   symbol table:   count, then each string as a varint length and UTF-8 bytes
+#   type table:     count, then each type (see write_type)
+#   body:           count of records, then the records
+#
+# All counts and indices are unsigned LEB128 varints. Records hold an opcode
+# ID (see opcodes.opcode_names) or an index into the constant pool or the
+# symbol table.
+#
+# LLL trees are written in post-order, so that a reader builds each node out
+# of the last nargs nodes it built. A node record is a tag byte holding the
+# kind of the node's value and flags telling which of its argument count,
+# type (a type table index) and location (a symbol index) follow the value;
+# the rest are empty or None. A subtree shared by several parents
+# (eg. in the DAGs from parser.LLLInterner) is written once and then referred
+# to by its record number, and is shared again once loaded.
+#
+# Assembly records are items in order, each a varint holding the kind of the
+# item in the low 2 bits and its value above them; a nested assembly (from an lll
+# statement) is a record holding its length, followed by its items.
+#
+# Loading works off a memoryview of the blob, without copying it.
+
+MAGIC = b'VLLB'
+VERSION = 1
+
+KIND_LLL = 1
+KIND_ASSEMBLY = 2
+
+# Record kinds of LLL nodes, in the low 3 bits of the tag
+NODE_OPCODE = 0
+NODE_CONSTANT = 1
+NODE_SYMBOL = 2
+NODE_NULL = 3
+NODE_REF = 4
+# Tag flags for the optional fields of a node record
+HAS_ARGS = 8
+HAS_TYPE = 16
+HAS_LOCATION = 32
+
+# Record kinds of assembly items
+ASM_OPCODE = 0
+ASM_INT = 1
+ASM_SYMBOL = 2
+ASM_LIST = 3
+ASM_KIND_BITS = 2
+
+# Type table tags
+TYPE_BASE = 0
+TYPE_BYTEARRAY = 1
+TYPE_LIST = 2
+TYPE_MAPPING = 3
+TYPE_STRUCT = 4
+TYPE_MIXED = 5
+TYPE_NULL = 6
+
+# LLL spells opcodes in lowercase
+lowercase_names = [name.lower() for name in opcode_names]
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+# Returns the varint at pos, and the position after it
+def read_varint(data, pos):
+    b = data[pos]
+    o = b & 0x7f
+    shift = 7
+    while b & 0x80:
+        pos += 1
+        b = data[pos]
+        o |= (b & 0x7f) << shift
+        shift += 7
+    return o, pos + 1
+
+def zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+# Pools a blob's integers, strings and types, each numbered in order of first use
+class Tables():
+    def __init__(self):
+        self.constants = {}
+        self.symbols = {}
+        self.types = {}
+        # id(type) => index, to skip encoding the same type object again
+        self.type_ids = {}
+
+    def constant(self, value):
+        o = self.constants.get(value)
+        if o is None:
+            o = self.constants[value] = len(self.constants)
+        return o
+
+    def symbol(self, value):
+        o = self.symbols.get(value)
+        if o is None:
+            o = self.symbols[value] = len(self.symbols)
+        return o
+
+    # Types are pooled by their encoding, so equal types are written once
+    def type(self, typ):
+        o = self.type_ids.get(id(typ))
+        if o is None:
+            entry = self.write_type(typ)
+            o = self.types.get(entry)
+            if o is None:
+                o = self.types[entry] = len(self.types)
+            self.type_ids[id(typ)] = o
+        return o
+
+    def write_type(self, typ):
+        out = bytearray()
+        if isinstance(typ, BaseType):
+            out.append(TYPE_BASE)
+            write_varint(out, self.symbol(typ.typ))
+            units = sorted(typ.unit.items()) if typ.unit is not None else None
+            # Unit count + 1, or 0 for a unit of None
+            write_varint(out, 0 if units is None else len(units) + 1)
+            for k, v in units or []:
+                write_varint(out, self.symbol(k))
+                write_varint(out, zigzag(v))
+            out.append(1 if typ.positional else 0)
+        elif isinstance(typ, ByteArrayType):
+            out.append(TYPE_BYTEARRAY)
+            write_varint(out, typ.maxlen)
+        elif isinstance(typ, ListType):
+            out.append(TYPE_LIST)
+            write_varint(out, self.type(typ.subtype))
+            write_varint(out, typ.count)
+        elif isinstance(typ, MappingType):
+            out.append(TYPE_MAPPING)
+            write_varint(out, self.type(typ.keytype))
+            write_varint(out, self.type(typ.valuetype))
+        elif isinstance(typ, StructType):
+            out.append(TYPE_STRUCT)
+            write_varint(out, len(typ.members))
+            for k, v in typ.members.items():
+                write_varint(out, self.symbol(k))
+                write_varint(out, self.type(v))
+        elif isinstance(typ, MixedType):
+            out.append(TYPE_MIXED)
+        elif isinstance(typ, NullType):
+            out.append(TYPE_NULL)
+        else:
+            raise ValueError("Cannot serialize type: %r" % typ)
+        return bytes(out)
+
+    # Puts the header and the tables in front of a body
+    def pack(self, kind, count, body):
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        out.append(kind)
+        write_varint(out, len(self.constants))
+        for value in self.constants:
+            magnitude = abs(value)
+            nbytes = (magnitude.bit_length() + 7) // 8
+            write_varint(out, nbytes << 1 | (value < 0))
+            out += magnitude.to_bytes(nbytes, 'big')
+        write_varint(out, len(self.symbols))
+        for value in self.symbols:
+            b = value.encode('utf-8')
+            write_varint(out, len(b))
+            out += b
+        write_varint(out, len(self.types))
+        for entry in self.types:
+            out += entry
+        write_varint(out, count)
+        out += body
+        return bytes(out)
+
+# Reads a blob's header and tables, leaving pos at the start of the body
+class Reader():
+    def __init__(self, data, kind):
+        self.data = data if isinstance(data, memoryview) else memoryview(data)
+        self.pos = 0
+        if bytes(self.data[:4]) != MAGIC or len(self.data) < 6:
+            raise ValueError("Not a serialized LLL or assembly blob")
+        if self.data[4] != VERSION:
+            raise ValueError("Unsupported serialization version: %d" % self.data[4])
+        if self.data[5] != kind:
+            raise ValueError("Expecting a serialized %s" % ('LLL tree' if kind == KIND_LLL else 'assembly'))
+        self.pos = 6
+        data = self.data
+        self.constants = []
+        for i in range(self.varint()):
+            head = self.varint()
+            nbytes = head >> 1
+            value = int.from_bytes(data[self.pos:self.pos + nbytes], 'big')
+            self.constants.append(-value if head & 1 else value)
+            self.pos += nbytes
+        self.symbols = []
+        for i in range(self.varint()):
+            n = self.varint()
+            self.symbols.append(str(data[self.pos:self.pos + n], 'utf-8'))
+            self.pos += n
+        self.types = []
+        for i in range(self.varint()):
+            self.types.append(self.read_type())
+
+    def varint(self):
+        try:
+            o, self.pos = read_varint(self.data, self.pos)
+        except IndexError:
+            raise ValueError("Truncated serialized blob")
+        return o
+
+    def read_type(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == TYPE_BASE:
+            typ = self.symbols[self.varint()]
+            nunits = self.varint()
+            unit = None if nunits == 0 else {}
+            for i in range(nunits - 1):
+                k = self.symbols[self.varint()]
+                unit[k] = unzigzag(self.varint())
+            positional = bool(self.data[self.pos])
+            self.pos += 1
+            return BaseType(typ, unit, positional)
+        elif tag == TYPE_BYTEARRAY:
+            return ByteArrayType(self.varint())
+        elif tag == TYPE_LIST:
+            subtype = self.types[self.varint()]
+            return ListType(subtype, self.varint())
+        elif tag == TYPE_MAPPING:
+            keytype = self.types[self.varint()]
+            return MappingType(keytype, self.types[self.varint()])
+        elif tag == TYPE_STRUCT:
+            members = {}
+            for i in range(self.varint()):
+                k = self.symbols[self.varint()]
+                members[k] = self.types[self.varint()]
+            return StructType(members)
+        elif tag == TYPE_MIXED:
+            return MixedType()
+        elif tag == TYPE_NULL:
+            return NullType()
+        raise ValueError("Unknown type tag: %d" % tag)
+
+    def done(self):
+        if self.pos != len(self.data):
+            raise ValueError("Trailing data after serialized blob")
+
+def dumps_lll(code):
+    tables = Tables()
+    body = bytearray()
+    # id(node) => record number, for nodes already written
+    written = {}
+    count = 0
+    stack = [(code, False)]
+    while stack:
+        node, expanded = stack.pop()
+        count += 1
+        if id(node) in written:
+            body.append(NODE_REF)
+            write_varint(body, written[id(node)])
+            continue
+        if not expanded and node.args:
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in reversed(node.args))
+            count -= 1
+            continue
+        value = node.value
+        if isinstance(value, bool):
+            raise ValueError("Cannot serialize a boolean LLL value: %r" % node)
+        elif isinstance(value, int):
+            tag, payload = NODE_CONSTANT, tables.constant(value)
+        elif value is None:
+            tag, payload = NODE_NULL, None
+        elif node.opcode is not None and lowercase_names[node.opcode] == value:
+            tag, payload = NODE_OPCODE, node.opcode
+        else:
+            tag, payload = NODE_SYMBOL, tables.symbol(value)
+        if node.args:
+            tag |= HAS_ARGS
+        if node.typ is not None:
+            tag |= HAS_TYPE
+        if node.location is not None:
+            tag |= HAS_LOCATION
+        body.append(tag)
+        if payload is not None:
+            write_varint(body, payload)
+        if node.args:
+            write_varint(body, len(node.args))
+        if node.typ is not None:
+            write_varint(body, tables.type(node.typ))
+        if node.location is not None:
+            write_varint(body, tables.symbol(node.location))
+        written[id(node)] = len(written)
+    return tables.pack(KIND_LLL, count, body)
+
+def loads_lll(data):
+    r = Reader(data, KIND_LLL)
+    constants, symbols, types = r.constants, r.symbols, r.types
+    data = r.data
+    count, pos = r.varint(), r.pos
+    # Nodes are filled in directly, as LLLnode(..., validate=False) would
+    new_node = object.__new__
+    symbol_opcodes = [get_opcode_id(symbol) for symbol in symbols]
+    nodes = []
+    stack = []
+    try:
+        for i in range(count):
+            tag = data[pos]
+            kind = tag & 7
+            pos += 1
+            if kind != NODE_NULL:
+                # Varints are read inline when they fit in a byte, as nearly all do
+                payload = data[pos]
+                pos += 1
+                if payload & 0x80:
+                    payload, pos = read_varint(data, pos - 1)
+            if kind == NODE_REF:
+                stack.append(nodes[payload])
+                continue
+            node = new_node(LLLnode)
+            node.opcode = None
+            node.valency = 1
+            if kind == NODE_OPCODE:
+                node.value = lowercase_names[payload]
+                node.opcode = payload
+                node.valency = opcode_records[payload][2]
+            elif kind == NODE_CONSTANT:
+                node.value = constants[payload]
+            elif kind == NODE_SYMBOL:
+                node.value = symbols[payload]
+            elif kind == NODE_NULL:
+                node.value = None
+            else:
+                raise ValueError("Unknown LLL record kind: %d" % kind)
+            args = []
+            typ = location = None
+            if tag & HAS_ARGS:
+                nargs = data[pos]
+                pos += 1
+                if nargs & 0x80:
+                    nargs, pos = read_varint(data, pos - 1)
+                if nargs > len(stack):
+                    raise ValueError("Malformed serialized LLL")
+                args = stack[len(stack) - nargs:]
+                del stack[len(stack) - nargs:]
+            if tag & HAS_TYPE:
+                typ = data[pos]
+                pos += 1
+                if typ & 0x80:
+                    typ, pos = read_varint(data, pos - 1)
+                typ = types[typ]
+            if tag & HAS_LOCATION:
+                location, pos = read_varint(data, pos)
+                location = symbols[location]
+            node.args, node.typ, node.location = args, typ, location
+            if kind == NODE_SYMBOL:
+                # Either a statement or variable, or an opcode in another case
+                node.opcode = symbol_opcodes[payload]
+                if node.opcode is None:
+                    node.valency = get_statement_valency(node.value, args)
+                else:
+                    node.valency = opcode_records[node.opcode][2]
+            nodes.append(node)
+            stack.append(node)
+    except IndexError:
+        raise ValueError("Malformed serialized LLL")
+    r.pos = pos
+    r.done()
+    if len(stack) != 1:
+        raise ValueError("Malformed serialized LLL")
+    return stack[0]
+
+def dumps_assembly(assembly):
+    tables = Tables()
+    body = bytearray()
+    count = 0
+    stack = [iter(assembly)]
+    while stack:
+        item = next(stack[-1], stack)
+        if item is stack:
+            stack.pop()
+            continue
+        count += 1
+        if isinstance(item, list):
+            write_varint(body, len(item) << ASM_KIND_BITS | ASM_LIST)
+            stack.append(iter(item))
+        elif isinstance(item, bool):
+            raise ValueError("Cannot serialize a boolean assembly item: %r" % item)
+        elif isinstance(item, int):
+            write_varint(body, zigzag(item) << ASM_KIND_BITS | ASM_INT)
+        else:
+            opcode = get_opcode_id(item)
+            if opcode is not None and opcode_names[opcode] == item:
+                write_varint(body, opcode << ASM_KIND_BITS | ASM_OPCODE)
+            else:
+                write_varint(body, tables.symbol(item) << ASM_KIND_BITS | ASM_SYMBOL)
+    return tables.pack(KIND_ASSEMBLY, count, body)
+
+def loads_assembly(data):
+    r = Reader(data, KIND_ASSEMBLY)
+    symbols = r.symbols
+    data = r.data
+    count, pos = r.varint(), r.pos
+    o = []
+    # The list being filled and how many items it still lacks (None at the
+    # top level), and the same for each enclosing list
+    out, remaining = o, None
+    stack = []
+    try:
+        for i in range(count):
+            head = data[pos]
+            pos += 1
+            if head & 0x80:
+                head, pos = read_varint(data, pos - 1)
+            kind, payload = head & 3, head >> ASM_KIND_BITS
+            if kind == ASM_OPCODE:
+                out.append(opcode_names[payload])
+            elif kind == ASM_INT:
+                out.append(unzigzag(payload))
+            elif kind == ASM_SYMBOL:
+                out.append(symbols[payload])
+            else:
+                out.append([])
+            if remaining is not None:
+                remaining -= 1
+            if kind == ASM_LIST and payload:
+                stack.append((out, remaining))
+                out, remaining = out[-1], payload
+            while remaining == 0 and stack:
+                out, remaining = stack.pop()
+    except IndexError:
+        raise ValueError("Malformed serialized assembly")
+    r.pos = pos
+    r.done()
+    if stack or remaining:
+        raise ValueError("Malformed serialized assembly")
+    return o
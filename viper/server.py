@@ -0,0 +1,240 @@
+import argparse, asyncio, collections, json, os, time
+from . import compiler_plugin, optimizer
+
+# Long-running compile server. Requests are served over HTTP on a Unix socket
+# or a localhost TCP port, and compiled on a pool of worker processes that are
+# warmed up once at startup:
+#
+#   POST /compile  {"source": "...", "options": {...}}
+#       => {"bytecode": "0x..", "runtime_bytecode": "0x..", "abi": [..],
+#           "assembly": [..], "gas_estimates": {..}, "latency": seconds}
+#       or {"error": {"type": "TypeMismatchException", "message": ".."}}
+#       options: "optimize" (default true) and "disable_passes" (a list of
+#       optimizer pass names), as --no-optimize and --disable-pass of the
+#       viper command; any other option is rejected
+#   GET /stats
+#       => {"workers": n, "queue_depth": n, "requests": n, "errors": n,
+#           "latency": {"mean": .., "p50": .., "p90": .., "p99": .., "max": ..}}
+
+# Per-worker-process compilers, by the optimizer passes they run
+worker_compilers = {}
+
+def get_worker_compiler(passes, cache_dir=None):
+    if passes not in worker_compilers:
+        worker_compilers[passes] = compiler_plugin.Compiler(cache_dir=cache_dir, optimizer=optimizer.Optimizer(passes))
+    return worker_compilers[passes]
+
+def init_worker(cache_dir=None):
+    if not worker_compilers:
+        get_worker_compiler(tuple(optimizer.default_pipeline), cache_dir)
+        # Warm up: load the keccak backend and the lazily computed gas constants
+        compiler_plugin.mk_artifacts('def foo(x: num) -> num:\n    return x\n')
+
+# Returns the optimizer passes that the options of a request ask for, or
+# raises ValueError if they are not understood
+def get_requested_passes(options):
+    unknown = set(options) - {'optimize', 'disable_passes'}
+    if unknown:
+        raise ValueError("Unknown options: %s" % ', '.join(sorted(unknown)))
+    disabled = options.get('disable_passes', [])
+    if not isinstance(disabled, list) or not all(name in optimizer.registry for name in disabled):
+        raise ValueError("disable_passes must be a list of optimizer pass names (of: %s)" % ', '.join(optimizer.default_pipeline))
+    if not options.get('optimize', True):
+        return ()
+    return tuple(name for name in optimizer.default_pipeline if name not in disabled)
+
+def compile_request(source, passes, cache_dir=None):
+    init_worker(cache_dir)
+    try:
+        o = get_worker_compiler(passes, cache_dir).get_artifacts(source)
+    except Exception as e:
+        return {'error': {'type': e.__class__.__name__, 'message': str(e)}}
+    return {k: '0x' + v.hex() if isinstance(v, bytes) else v for k, v in o.items()}
+
+# Latencies of the most recent requests, for sizing the worker pool
+class LatencyStats():
+    def __init__(self, window=1000):
+        self.recent = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def add(self, latency, error=False):
+        self.recent.append(latency)
+        self.requests += 1
+        self.errors += bool(error)
+
+    def summary(self):
+        if not self.recent:
+            return {}
+        s = sorted(self.recent)
+        pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+        return {'mean': sum(s) / len(s), 'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': s[-1]}
+
+class CompileServer():
+    def __init__(self, workers=None, cache_dir=None):
+        from concurrent.futures import ProcessPoolExecutor
+        self.workers = workers or os.cpu_count()
+        self.cache_dir = cache_dir
+        try:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(cache_dir,))
+        except TypeError:
+            # Python 3.6 has no initializer; workers then warm up on their first request
+            self.pool = ProcessPoolExecutor(self.workers)
+        # Start the workers before taking requests
+        for f in [self.pool.submit(init_worker, cache_dir) for i in range(self.workers)]:
+            f.result()
+        self.queue_depth = 0
+        self.stats = LatencyStats()
+        self.server = None
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def compile(self, source, passes):
+        t0 = time.time()
+        self.queue_depth += 1
+        try:
+            o = await asyncio.get_event_loop().run_in_executor(self.pool, compile_request, source, passes, self.cache_dir)
+        finally:
+            self.queue_depth -= 1
+        o['latency'] = time.time() - t0
+        self.stats.add(o['latency'], 'error' in o)
+        return o
+
+    def get_stats(self):
+        return {'workers': self.workers, 'queue_depth': self.queue_depth, 'requests': self.stats.requests,
+                'errors': self.stats.errors, 'latency': self.stats.summary()}
+
+    async def respond(self, method, path, body):
+        if method == 'GET' and path == '/stats':
+            return 200, self.get_stats()
+        elif method == 'POST' and path == '/compile':
+            try:
+                req = json.loads(body.decode('utf-8'))
+                source, options = req['source'], req.get('options') or {}
+                if not isinstance(source, str) or not isinstance(options, dict):
+                    raise ValueError("Expecting a source string and an options object")
+                passes = get_requested_passes(options)
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {'error': {'type': 'BadRequest', 'message': str(e)}}
+            o = await self.compile(source, passes)
+            return (400 if 'error' in o else 200), o
+        else:
+            return 404, {'error': {'type': 'NotFound', 'message': path}}
+
+    # Serves HTTP/1.1 requests on one connection until the client closes it
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_http_message(reader)
+                if request is None:
+                    break
+                start_line, headers, body = request
+                method, path = start_line.split(' ')[:2]
+                status, o = await self.respond(method, path, body)
+                write_http_message(writer, 'HTTP/1.1 %d %s' % (status, 'OK' if status == 200 else 'Error'), o)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+# Reads one HTTP message, returning (start line, headers, body), or None at EOF
+async def read_http_message(reader):
+    start_line = (await reader.readline()).decode('latin-1').strip()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        k, _, v = line.partition(':')
+        headers[k.strip().lower()] = v.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return start_line, headers, body
+
+def write_http_message(writer, start_line, o):
+    body = json.dumps(o).encode('utf-8')
+    writer.write(('%s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' %
+                  (start_line, len(body))).encode('latin-1') + body)
+
+# Asyncio client for a compile server, given either its Unix socket path or
+# its host and port. One connection is kept open and reused
+class CompileClient():
+    def __init__(self, path=None, host='127.0.0.1', port=None):
+        self.path, self.host, self.port = path, host, port
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, method, path, o=None):
+        async with self.lock:
+            if self.conn is None:
+                if self.path is not None:
+                    self.conn = await asyncio.open_unix_connection(self.path)
+                else:
+                    self.conn = await asyncio.open_connection(self.host, self.port)
+            reader, writer = self.conn
+            try:
+                write_http_message(writer, '%s %s HTTP/1.1' % (method, path), o)
+                response = await read_http_message(reader)
+            except BaseException:
+                self.close()
+                raise
+            if response is None:
+                self.close()
+                raise ConnectionError("Compile server closed the connection")
+            return json.loads(response[2].decode('utf-8'))
+
+    # Compiles a source, returning its artifacts (with bytecode as 0x-prefixed
+    # hex strings) or a dict holding the error
+    async def compile(self, source, options=None):
+        return await self.request('POST', '/compile', {'source': source, 'options': options or {}})
+
+    async def stats(self):
+        return await self.request('GET', '/stats')
+
+    def close(self):
+        if self.conn is not None:
+            self.conn[1].close()
+            self.conn = None
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Viper compile server")
+    p.add_argument('--socket', help="serve on this Unix socket")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8766)
+    p.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per core)")
+    p.add_argument('--cache-dir', default=None, help="on-disk artifact cache shared by the workers")
+    args = p.parse_args(argv)
+    loop = asyncio.get_event_loop()
+    server = CompileServer(args.workers, args.cache_dir)
+    loop.run_until_complete(server.start(args.socket, args.host, args.port))
+    print('Viper compile server with %d workers listening on %s' % (server.workers, args.socket or '%s:%d' % server.address[:2]))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+        if args.socket:
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -270,6 +270,19 @@ def get_size_of_type(typ):
     else:
         raise Exception("Unexpected type: %r" % repr(typ))
 
+# Gets the number of storage slots a value of a given type takes up. Types
+# are laid out flat, as in memory, except that a mapping takes up a single
+# slot, s, and the value at key k is stored from the slot sha3(s ++ k) on
+def get_storage_size_of_type(typ):
+    if isinstance(typ, (BaseType, ByteArrayType, MappingType)):
+        return 1
+    elif isinstance(typ, ListType):
+        return get_storage_size_of_type(typ.subtype) * typ.count
+    elif isinstance(typ, StructType):
+        return sum([get_storage_size_of_type(v) for v in typ.members.values()])
+    else:
+        raise Exception("Unexpected type: %r" % repr(typ))
+
 def set_default_units(typ):
     if isinstance(typ, BaseType):
         if typ.unit is None: